@@ -0,0 +1,159 @@
+"""Admission control: per-lane concurrency limits in front of the API.
+
+Every request is sorted into a lane by its path before it reaches the
+endpoint. A lane admits at most `concurrency` requests at a time; the rest
+wait in arrival order. Patient-facing lanes queue without limit, so a burst
+at the kiosk is slowed down, never refused. Heavy lanes (reports, exports,
+backups, imports) shed load instead of piling up behind themselves:
+
+* 429 when `max_waiting` requests are already queued in the lane;
+* 503 when a request has waited `wait_timeout` seconds without a slot.
+
+Both carry Retry-After. Slots are held until the response body has been
+sent, so a streamed export counts against its lane for its whole duration.
+Limits are per worker process.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from collections import deque
+from typing import Iterable, Optional, Tuple
+
+import metrics
+
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+lane_wait = metrics.registry.histogram("admission_lane_wait_seconds", "Time requests waited for a slot in their lane", WAIT_BUCKETS)
+lane_active = metrics.registry.gauge("admission_lane_active", "Requests currently holding a lane slot")
+lane_waiting = metrics.registry.gauge("admission_lane_waiting", "Requests queued for a lane slot")
+lane_rejected = metrics.registry.counter("admission_lane_rejected_total", "Requests shed by a lane, by reason")
+
+
+class Rejected(Exception):
+    def __init__(self, lane: str, status: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.lane = lane
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Lane:
+    def __init__(self, name: str, concurrency: int, max_waiting: Optional[int] = None,
+                 wait_timeout: Optional[float] = None, retry_after: int = 5):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiters: deque = deque()
+
+    @classmethod
+    def from_env(cls, name: str, concurrency: int, max_waiting: Optional[int] = None,
+                 wait_timeout: Optional[float] = None, retry_after: int = 5) -> "Lane":
+        """Lane with LANE_<NAME>_CONCURRENCY / _QUEUE / _TIMEOUT overriding the defaults"""
+        prefix = f"LANE_{name.upper()}_"
+        env = os.environ.get
+        return cls(
+            name,
+            int(env(prefix + "CONCURRENCY", concurrency)),
+            int(env(prefix + "QUEUE")) if env(prefix + "QUEUE") else max_waiting,
+            float(env(prefix + "TIMEOUT")) if env(prefix + "TIMEOUT") else wait_timeout,
+            retry_after
+        )
+
+    @property
+    def waiting(self) -> int:
+        return len(self.waiters)
+
+    def _publish(self):
+        metrics.registry.set(lane_active, self.active, lane=self.name)
+        metrics.registry.set(lane_waiting, self.waiting, lane=self.name)
+
+    async def acquire(self):
+        started = time.perf_counter()
+        if self.active < self.concurrency and not self.waiters:
+            self.active += 1
+        else:
+            if self.max_waiting is not None and self.waiting >= self.max_waiting:
+                metrics.registry.inc(lane_rejected, lane=self.name, reason="queue_full")
+                raise Rejected(self.name, 429, f"Too many {self.name} requests queued; retry shortly", self.retry_after)
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            self._publish()
+            try:
+                # release() hands the slot over directly, so `active` is already counted for us
+                await asyncio.wait_for(asyncio.shield(waiter), self.wait_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if waiter.done() and not waiter.cancelled():
+                    self.release()  # the slot arrived just as we gave up
+                else:
+                    waiter.cancel()
+                    self.waiters.remove(waiter)
+                self._publish()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                metrics.registry.inc(lane_rejected, lane=self.name, reason="wait_timeout")
+                raise Rejected(self.name, 503, f"Server busy with {self.name} requests; retry shortly", self.retry_after)
+        metrics.registry.observe(lane_wait, time.perf_counter() - started, lane=self.name)
+        self._publish()
+
+    def release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)  # slot passes straight to the oldest waiter
+                self._publish()
+                return
+        self.active -= 1
+        self._publish()
+
+    def describe(self) -> dict:
+        return {
+            "concurrency": self.concurrency, "active": self.active, "waiting": self.waiting,
+            "max_waiting": self.max_waiting, "wait_timeout": self.wait_timeout
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware that runs every HTTP request inside its lane.
+
+    rules is an ordered list of (lane name or None, path regex); the first
+    match wins, None exempts the path (health checks, long-lived streams) and
+    unmatched paths go to `default`.
+    """
+
+    def __init__(self, app, lanes: dict, rules: Iterable[Tuple[Optional[str], str]], default: str):
+        self.app = app
+        self.lanes = lanes
+        self.rules = [(name, re.compile(pattern)) for name, pattern in rules]
+        self.default = default
+
+    def classify(self, path: str) -> Optional[Lane]:
+        for name, pattern in self.rules:
+            if pattern.search(path):
+                return self.lanes[name] if name else None
+        return self.lanes[self.default]
+
+    async def __call__(self, scope, receive, send):
+        lane = self.classify(scope["path"]) if scope["type"] == "http" and scope["method"] != "OPTIONS" else None
+        if lane is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await lane.acquire()
+        except Rejected as e:
+            body = json.dumps({"detail": e.detail, "lane": e.lane}).encode()
+            await send({"type": "http.response.start", "status": e.status, "headers": [
+                (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(e.retry_after).encode())
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lane.release()
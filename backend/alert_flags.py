@@ -0,0 +1,52 @@
+"""Coded safety-alert flags on queue entries and consents.
+
+The kiosk sends the alerts a patient ticks as one ", "-joined string of their
+labels. They are stored as a list of short codes instead:
+
+    queue:    {..., "alert_flags": ["fever", "alcohol_24h"]}
+    consents: {..., "alerts_declared": "<text as signed>", "alert_flags": [...]}
+
+so a multikey index on alert_flags answers "check-ins flagged X" and the
+alert report is a $unwind/$group over the flags rather than string splitting.
+Labels outside KNOWN (free text from older records or imports) get a code
+derived from the label itself, so nothing declared is dropped.
+"""
+import re
+from typing import Iterable, List, Optional
+
+# code -> label, as shown on the kiosk
+KNOWN = {
+    "fever": "Today: Fever/Flu/Inf",
+    "dizzy": "Today: Dizzy/Faint",
+    "unwell": "Today: Unwell",
+    "alcohol_24h": "Recent: Alcohol <24h",
+    "drugs_72h": "Recent: Drugs <72h",
+    "no_food_24h": "Recent: No Food/Fluid <24h",
+}
+
+
+def _slug(label: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", label.casefold()).strip("_")
+
+
+CODE_OF_LABEL = {_slug(label): code for code, label in KNOWN.items()}
+
+
+def parse(text: Optional[str]) -> List[str]:
+    """Codes for a comma-separated alert string, in the order given, repeats dropped"""
+    codes = []
+    for part in (text or "").split(","):
+        slug = _slug(part)
+        code = CODE_OF_LABEL.get(slug, slug)
+        if code and code not in codes:
+            codes.append(code)
+    return codes
+
+
+def label(code: str) -> str:
+    return KNOWN.get(code) or code.replace("_", " ").capitalize()
+
+
+def display(codes: Optional[Iterable[str]]) -> str:
+    """The ", "-joined labels the API has always returned as `alerts`"""
+    return ", ".join(label(code) for code in codes or [])
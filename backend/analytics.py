@@ -0,0 +1,475 @@
+"""Columnar analytics engine behind /reports/comprehensive.
+
+Visits, patients and queue rows are converted once into NumPy columns: dates
+become int64 epoch seconds (parsed a single time), strings are dictionary
+encoded into integer codes, and every report section is computed with
+vectorised group-bys over those codes. Python loops only ever touch the
+distinct keys of a group-by (days, consultants, cities...), never the rows.
+
+Ties are broken by first appearance in the input, matching the ordering the
+original dict-based implementation produced.
+
+`report_json` is the entry point the API runs in its compute pool (see
+workers.py): it takes the rows as concatenated raw BSON and returns the
+rendered response body, so neither decoding nor serialisation happens on the
+event loop.
+"""
+import json
+from datetime import datetime, timezone
+from itertools import chain
+
+import bson
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib json fallback
+    orjson = None
+
+SECONDS_PER_DAY = 86400
+
+# Returning patients are bucketed by days since their all-time first visit
+TENURE_BUCKETS = ((90, "0-3m"), (365, "3-12m"), (730, "1-2y"), (None, "2y+"))
+
+VISIT_FIELDS = {"_id": 0, "patient_id": 1, "date": 1, "treatment_ids": 1, "consultant_id": 1}
+PATIENT_FIELDS = {
+    "_id": 0, "patient_id": 1, "first_name": 1, "last_name": 1, "phone": 1, "email": 1,
+    "city": 1, "registered_at": 1, "first_visit": 1, "last_visit": 1
+}
+QUEUE_FIELDS = {"_id": 0, "date": 1, "status": 1}
+
+
+def _strings(rows, key, default=""):
+    """String column for one field; missing keys become default and None becomes ''"""
+    return np.array(["" if (v := row.get(key, default)) is None else str(v) for row in rows], dtype=str)
+
+
+def encode_ids(ids: np.ndarray, names: dict, unknown: str = "Unknown"):
+    """Group an integer catalog-id column (-1 = none) like encode(), labelling groups through names"""
+    uniques, codes, first_index = encode(ids)
+    return np.array([names.get(i, unknown) if i >= 0 else unknown for i in uniques.tolist()], dtype=str), codes, first_index
+
+
+def encode(column: np.ndarray):
+    """Dictionary-encode a string column.
+
+    Returns (uniques, codes, first_index) where uniques[codes] == column and
+    first_index[k] is the first row holding uniques[k].
+    """
+    if column.size == 0:
+        return column, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    uniques, first_index, codes = np.unique(column, return_index=True, return_inverse=True)
+    return uniques, codes.astype(np.int64), first_index.astype(np.int64)
+
+
+def parse_epoch(column: np.ndarray):
+    """ISO-8601 strings -> (int64 epoch seconds of their wall-clock time, valid mask)"""
+    clipped = np.array([s[:19] for s in column.tolist()], dtype=str) if column.size else column
+    try:
+        parsed = clipped.astype("datetime64[s]")
+    except ValueError:
+        parsed = np.array([_parse_one(s) for s in clipped.tolist()], dtype="datetime64[s]")
+    valid = ~np.isnat(parsed)
+    seconds = np.where(valid, parsed.astype(np.int64), 0)
+    return seconds, valid
+
+
+def _parse_one(value: str):
+    try:
+        return np.datetime64(value, "s")
+    except ValueError:
+        return np.datetime64("NaT")
+
+
+def grouped_counts(keys: np.ndarray, order_rows: np.ndarray = None):
+    """Count rows per distinct key.
+
+    Returns (keys, counts, first_row) with first_row the first row index
+    (within order_rows if given) where each key occurs.
+    """
+    if keys.size == 0:
+        return keys, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    uniques, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    if order_rows is not None:
+        first = order_rows[first]
+    return uniques, counts.astype(np.int64), first.astype(np.int64)
+
+
+def rank(counts: np.ndarray, first_row: np.ndarray):
+    """Indices ordering groups by count desc, then first appearance"""
+    return np.lexsort((first_row, -counts))
+
+
+def day_strings(days: np.ndarray):
+    return np.datetime_as_string(days.astype("datetime64[D]"), unit="D").tolist()
+
+
+def month_strings(months: np.ndarray):
+    return np.datetime_as_string(months.astype("datetime64[M]"), unit="M").tolist()
+
+
+# Week labels in every report: Monday-based, days before the year's first Monday in week 00
+WEEK_FORMAT = "%Y-W%W"
+
+
+def week_strings(week_keys: np.ndarray):
+    return [f"{k // 100}-W{k % 100:02d}" for k in week_keys.tolist()]
+
+
+class ReportSnapshot:
+    """Columnar copy of the rows one report run needs.
+
+    Visits reference treatments and consultants by catalog id; names maps
+    {"treatments": {id: name}, "consultants": {id: name}}. Grouping happens on
+    the ids and only the distinct ids are looked up.
+    """
+
+    def __init__(self, visits: list, patients: list, queue: list, names: dict = None):
+        names = names or {}
+        # --- visits ---
+        self.visit_count = len(visits)
+        self.visit_dates = _strings(visits, "date")
+        self.visit_ts, self.visit_valid = parse_epoch(self.visit_dates)
+        consultant_ids = np.array([-1 if (v := row.get("consultant_id")) is None else v for row in visits], dtype=np.int64)
+        self.consultants, self.visit_consultant, self.consultant_first = encode_ids(consultant_ids, names.get("consultants", {}))
+        # One entry per treatment given: a visit with two treatments counts towards both
+        treatment_lists = [row.get("treatment_ids") or [-1] for row in visits]
+        self.treatment_visit = np.repeat(np.arange(self.visit_count), [len(ids) for ids in treatment_lists])
+        given = np.fromiter(chain.from_iterable(treatment_lists), dtype=np.int64, count=len(self.treatment_visit))
+        self.treatments, self.given_treatment, self.treatment_first = encode_ids(given, names.get("treatments", {}))
+
+        # --- patients ---
+        self.patient_count = len(patients)
+        self.patient_ids = _strings(patients, "patient_id")
+        self.patients = patients
+
+        # Visits and patients share one patient-id dictionary so they join on integer codes
+        visit_pids = _strings(visits, "patient_id")
+        all_ids, codes, _ = encode(np.concatenate([self.patient_ids, visit_pids]))
+        self.pid_dictionary = all_ids
+        self.patient_code = codes[:self.patient_count]
+        self.visit_patient = codes[self.patient_count:]
+        # Row of each patient code in `patients`, -1 where the visit's patient no longer exists
+        self.row_of_code = np.full(len(all_ids), -1, dtype=np.int64)
+        self.row_of_code[self.patient_code[::-1]] = np.arange(self.patient_count - 1, -1, -1)
+
+        # --- queue ---
+        self.queue_count = len(queue)
+        self.queue_days = np.array([s[:10] for s in _strings(queue, "date").tolist()], dtype=str)
+        self.queue_done = _strings(queue, "status") == "DONE"
+
+    # ------------------------------------------------------------------
+    # Derived calendar columns (valid visits only)
+    # ------------------------------------------------------------------
+
+    def calendar(self):
+        ts = self.visit_ts[self.visit_valid]
+        days = ts // SECONDS_PER_DAY
+        dates = days.astype("datetime64[D]")
+        year_start = dates.astype("datetime64[Y]").astype("datetime64[D]").astype(np.int64)
+        years = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+        weekday = (days + 3) % 7  # 1970-01-01 was a Thursday; Monday == 0
+        # strftime("%W"): Monday-based week number, days before the first Monday are week 0
+        week = (days - year_start + 7 - weekday) // 7
+        return {
+            "rows": np.flatnonzero(self.visit_valid),
+            "days": days,
+            "months": dates.astype("datetime64[M]").astype(np.int64),
+            "weeks": years * 100 + week,
+            "weekday": weekday,
+            "hour": (ts % SECONDS_PER_DAY) // 3600,
+        }
+
+
+def _counts_dict(keys, counts, labels):
+    return dict(zip(labels(keys), counts.tolist()))
+
+
+def visit_trends(s: ReportSnapshot, cal: dict, total_days: int):
+    days, day_counts, day_first = grouped_counts(cal["days"], cal["rows"])
+    weeks, week_counts, _ = grouped_counts(cal["weeks"])
+    months, month_counts, _ = grouped_counts(cal["months"])
+
+    if days.size:
+        order = rank(day_counts, day_first)
+        peak = order[0]
+        worst = np.lexsort((day_first, day_counts))[0]
+        day_labels = day_strings(days)
+        peak_day = {"date": day_labels[peak], "count": int(day_counts[peak])}
+        worst_day = {"date": day_labels[worst], "count": int(day_counts[worst])}
+    else:
+        day_labels = []
+        peak_day = {"date": "N/A", "count": 0}
+        worst_day = {"date": "N/A", "count": 0}
+
+    return {
+        "daily_stats": dict(zip(day_labels, day_counts.tolist())),
+        "weekly_stats": _counts_dict(weeks, week_counts, week_strings),
+        "monthly_stats": _counts_dict(months, month_counts, month_strings),
+        "peak_day": peak_day,
+        "worst_day": worst_day,
+        "avg_daily": round(int(day_counts.sum()) / total_days, 1),
+        "total_visits": s.visit_count
+    }
+
+
+def _trend_by(codes_all, first, cal_codes, period_keys, period_labels, n_codes):
+    """Counts per code over all rows plus a {code: {period: count}} trend over valid rows"""
+    counts = np.bincount(codes_all, minlength=n_codes)
+    trends = {}
+    if cal_codes.size:
+        combined = cal_codes * 10_000_000 + period_keys
+        keys, key_counts, _ = grouped_counts(combined)
+        codes = keys // 10_000_000
+        labels = period_labels(keys % 10_000_000)
+        for code, label, count in zip(codes.tolist(), labels, key_counts.tolist()):
+            trends.setdefault(code, {})[label] = count
+    return counts, rank(counts, first), trends
+
+
+def consultant_workload(s: ReportSnapshot, cal: dict):
+    counts, order, weekly = _trend_by(
+        s.visit_consultant, s.consultant_first, s.visit_consultant[cal["rows"]], cal["weeks"], week_strings, len(s.consultants)
+    )
+    total = int(counts.sum())
+    stats = []
+    for code in order.tolist():
+        count = int(counts[code])
+        stats.append({
+            "name": str(s.consultants[code]),
+            "count": count,
+            "percentage": round(count / total * 100, 1) if total else 0,
+            "weekly_trend": weekly.get(code, {})
+        })
+    return {
+        "consultants": stats,
+        "top_consultant": stats[0] if stats else {"name": "N/A", "count": 0},
+        "total_visits": total
+    }
+
+
+def treatment_mix(s: ReportSnapshot, cal: dict):
+    # Month of every visit row (-1 where the date is invalid), spread over the treatments given
+    visit_month = np.full(s.visit_count, -1, dtype=np.int64)
+    visit_month[cal["rows"]] = cal["months"]
+    given_valid = s.visit_valid[s.treatment_visit]
+    counts, order, monthly = _trend_by(
+        s.given_treatment, s.treatment_first, s.given_treatment[given_valid],
+        visit_month[s.treatment_visit[given_valid]], month_strings, len(s.treatments)
+    )
+    total = int(counts.sum())
+    stats = []
+    for code in order[:20].tolist():
+        count = int(counts[code])
+        stats.append({
+            "name": str(s.treatments[code]),
+            "count": count,
+            "percentage": round(count / total * 100, 1) if total else 0,
+            "monthly_trend": monthly.get(code, {})
+        })
+    return {"treatments": stats, "total": total}
+
+
+def first_visit_days(s: ReportSnapshot, day_codes: np.ndarray, days: np.ndarray):
+    """All-time first visit day (YYYY-MM-DD) per patient code, '' when unknown.
+
+    The stored first_visit summary covers history outside the report window;
+    patients without one (or visits of deleted patients) fall back to their
+    earliest visit inside the snapshot.
+    """
+    n_codes = len(s.pid_dictionary)
+    in_window = np.full(n_codes, len(days), dtype=np.int64)
+    np.minimum.at(in_window, s.visit_patient, day_codes)
+    labels = np.append(days, "")
+    earliest = labels[in_window]
+
+    stored = np.full(n_codes, "", dtype=np.result_type(earliest, "U10"))
+    stored[s.patient_code] = [d[:10] for d in _strings(s.patients, "first_visit").tolist()]
+    use_stored = (stored != "") & ((earliest == "") | (stored < earliest))
+    return np.where(use_stored, stored, earliest)
+
+
+def new_vs_returning(s: ReportSnapshot, start_date: str, end_date: str):
+    n_codes = len(s.pid_dictionary)
+    per_patient = np.bincount(s.visit_patient, minlength=n_codes)
+    in_period = per_patient > 0
+    unique_patients = int(in_period.sum())
+    repeat_patients = int((per_patient >= 2).sum())
+
+    # A visit is "new" when it falls on the patient's all-time first visit day
+    day_prefix = np.array([d[:10] for d in s.visit_dates.tolist()], dtype=str)
+    days, day_codes, _ = encode(day_prefix)
+    first_day = first_visit_days(s, day_codes, days)
+    day_in_range = (days >= start_date) & (days <= end_date)
+    is_new = (day_prefix == first_day[s.visit_patient]) & day_in_range[day_codes] if s.visit_count else day_codes > 0
+    new_visits = int(is_new.sum())
+
+    registered = _strings(s.patients, "registered_at")
+    new_registrations = int(((registered >= start_date) & (registered <= end_date + "T23:59:59")).sum())
+
+    return {
+        "new_patient_visits": new_visits,
+        "returning_visits": s.visit_count - new_visits,
+        "unique_patients": unique_patients,
+        "repeat_patients": repeat_patients,
+        "repeat_rate": round(repeat_patients / unique_patients * 100, 1) if unique_patients else 0,
+        "new_registrations": new_registrations,
+        "cohorts": patient_cohorts(first_day[in_period], start_date, end_date)
+    }
+
+
+def patient_cohorts(first_days: np.ndarray, start_date: str, end_date: str):
+    """Split the period's patients into new (this month / earlier in the period) and returning by tenure"""
+    known = first_days != ""
+    first_ts, valid = parse_epoch(first_days[known])
+    tenure = (int(np.datetime64(end_date, "s").astype(np.int64)) - first_ts[valid]) // SECONDS_PER_DAY
+    firsts = first_days[known][valid]
+
+    is_new = firsts >= start_date
+    returning = tenure[~is_new]
+    by_tenure, lower = {}, -1
+    for upper, label in TENURE_BUCKETS:
+        in_bucket = returning > lower if upper is None else (returning > lower) & (returning <= upper)
+        by_tenure[label] = int(in_bucket.sum())
+        lower = upper
+    return {
+        "new_this_month": int((firsts[is_new] >= end_date[:7]).sum()),
+        "new_in_period": int(is_new.sum()),
+        "returning": int(returning.size),
+        "returning_by_tenure": by_tenure,
+        "unknown": int(first_days.size - firsts.size)
+    }
+
+
+def inactive_patients(s: ReportSnapshot, now: datetime):
+    # Last in-window visit per patient row, else the stored all-time last_visit summary
+    last_dates = _strings(s.patients, "last_visit")
+    if s.visit_count:
+        last_dates = last_dates.astype(np.result_type(last_dates, s.visit_dates))
+        order = np.lexsort((s.visit_dates, s.visit_patient))
+        last_of_group = np.r_[s.visit_patient[order][1:] != s.visit_patient[order][:-1], True]
+        codes = s.visit_patient[order][last_of_group]
+        rows = s.row_of_code[codes]
+        known = rows >= 0
+        last_dates[rows[known]] = s.visit_dates[order][last_of_group][known]
+
+    last_ts, valid = parse_epoch(last_dates)
+    days_since = (int(now.timestamp()) - last_ts) // SECONDS_PER_DAY
+    inactive_60, inactive_90 = [], []
+    for row in np.flatnonzero(valid & (days_since > 60)).tolist():
+        p = s.patients[row]
+        info = {
+            "patient_id": p.get("patient_id", ""),
+            "name": f"{p.get('first_name', '')} {p.get('last_name', '')}",
+            "phone": p.get("phone", ""),
+            "email": p.get("email", ""),
+            "last_visit": str(last_dates[row])[:10],
+            "days_since": int(days_since[row])
+        }
+        (inactive_90 if info["days_since"] > 90 else inactive_60).append(info)
+
+    return {
+        "over_60_days": sorted(inactive_60, key=lambda x: -x["days_since"]),
+        "over_90_days": sorted(inactive_90, key=lambda x: -x["days_since"]),
+        "count_60": len(inactive_60),
+        "count_90": len(inactive_90)
+    }
+
+
+def queue_analytics(s: ReportSnapshot, total_days: int):
+    days, counts, _ = grouped_counts(s.queue_days)
+    done_days, done_counts, _ = grouped_counts(s.queue_days[s.queue_done])
+    total_checkins = int(counts.sum())
+    total_completed = int(done_counts.sum())
+    return {
+        "daily_checkins": dict(zip(days.tolist(), counts.tolist())),
+        "daily_completed": dict(zip(done_days.tolist(), done_counts.tolist())),
+        "total_checkins": total_checkins,
+        "total_completed": total_completed,
+        "completion_rate": round(total_completed / total_checkins * 100, 1) if total_checkins else 0,
+        "avg_checkins_per_day": round(total_checkins / total_days, 1)
+    }
+
+
+def geographic(s: ReportSnapshot):
+    # Normalise each distinct spelling once, then re-encode on the normalised names
+    raw, raw_codes, _ = encode(_strings(s.patients, "city", "Unknown"))
+    cities, city_of_raw, _ = encode(np.array([c.strip().upper() or "Unknown" for c in raw.tolist()], dtype=str))
+    patient_city = city_of_raw[raw_codes]
+    city_counts = np.bincount(patient_city, minlength=len(cities))
+    city_first = np.full(len(cities), s.patient_count, dtype=np.int64)
+    np.minimum.at(city_first, patient_city, np.arange(s.patient_count))
+
+    # Visits join to their patient's city; visits of deleted patients count as "UNKNOWN",
+    # the same bucket as patients with no city field at all
+    city_visits = {}
+    if s.visit_count:
+        visit_rows = s.row_of_code[s.visit_patient]
+        if s.patient_count:
+            names = np.where(visit_rows >= 0, cities[patient_city][np.maximum(visit_rows, 0)], "UNKNOWN")
+        else:
+            names = np.full(s.visit_count, "UNKNOWN")
+        visit_names, visit_counts, _ = grouped_counts(names)
+        city_visits = dict(zip(visit_names.tolist(), visit_counts.tolist()))
+
+    months, month_codes, _ = encode(np.array([r[:7] for r in _strings(s.patients, "registered_at").tolist()], dtype=str))
+    has_month = months[month_codes] != "" if s.patient_count else np.zeros(0, dtype=bool)
+    keys, key_counts, _ = grouped_counts(patient_city[has_month] * 1_000_000 + month_codes[has_month])
+    trends = {}
+    for key, count in zip(keys.tolist(), key_counts.tolist()):
+        trends.setdefault(key // 1_000_000, {})[str(months[key % 1_000_000])] = count
+
+    total = s.patient_count
+    stats = []
+    for code in rank(city_counts, city_first)[:15].tolist():
+        count = int(city_counts[code])
+        name = str(cities[code])
+        stats.append({
+            "city": name,
+            "patient_count": count,
+            "visit_count": city_visits.get(name, 0),
+            "percentage": round(count / total * 100, 1) if total else 0,
+            "registration_trend": trends.get(code, {})
+        })
+    return {"cities": stats, "total_cities": len(cities), "total_patients": total}
+
+
+def hourly_heatmap(cal: dict):
+    keys, counts, _ = grouped_counts(cal["weekday"] * 100 + cal["hour"])
+    return {f"{k // 100}-{k % 100}": c for k, c in zip(keys.tolist(), counts.tolist())}
+
+
+def compute_reports(s: ReportSnapshot, start_date: str, end_date: str, now: datetime = None, *,
+                    quality: dict, alerts: dict) -> dict:
+    """All ten report sections for the snapshot's period.
+
+    quality and alerts are the data_quality and alerts_analytics sections,
+    which the API reads from its quality counters and an aggregation over
+    the check-ins' alert flags.
+    """
+    now = now or datetime.now(timezone.utc)
+    total_days = max(1, (datetime.fromisoformat(end_date) - datetime.fromisoformat(start_date)).days + 1)
+    cal = s.calendar()
+    return {
+        "period": {"start": start_date, "end": end_date, "days": total_days},
+        "visit_trends": visit_trends(s, cal, total_days),
+        "consultant_workload": consultant_workload(s, cal),
+        "treatment_mix": treatment_mix(s, cal),
+        "new_vs_returning": new_vs_returning(s, start_date, end_date),
+        "inactive_patients": inactive_patients(s, now),
+        "queue_analytics": queue_analytics(s, total_days),
+        "alerts_analytics": alerts,
+        "geographic": geographic(s),
+        "data_quality": quality,
+        "hourly_heatmap": hourly_heatmap(cal)
+    }
+
+
+def report_json(visits: bytes, patients: bytes, queue: bytes, start_date: str, end_date: str,
+                now: datetime = None, quality: dict = None, names: dict = None, alerts: dict = None) -> bytes:
+    """Compute the comprehensive report from raw BSON rows and return its JSON body"""
+    snapshot = ReportSnapshot(bson.decode_all(visits), bson.decode_all(patients), bson.decode_all(queue), names)
+    body = {"success": True, **compute_reports(snapshot, start_date, end_date, now, quality=quality, alerts=alerts)}
+    if orjson is None:
+        return json.dumps(body).encode()
+    return orjson.dumps(body, option=orjson.OPT_NON_STR_KEYS)
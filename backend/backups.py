@@ -0,0 +1,286 @@
+"""Backup storage: a small catalog plus chunked payloads.
+
+`backups` holds one catalog document per backup (id, creator, status, counts,
+size), so listing, retention and deletion never touch backup contents.
+`backup_chunks` holds the contents, one document per slice of one collection:
+
+    {"backup_id": ..., "collection": "visits", "seq": 3, "count": 812,
+     "payload": Binary(<concatenated BSON documents>)}
+
+Documents are copied as raw BSON straight from the cursor (never decoded) and
+chunks are capped at CHUNK_BYTES, well under Mongo's 16 MB document limit, so
+a backup's size is bounded by disk rather than by a single document.
+
+Every collection's document count and checksum are recorded in the catalog
+when it is written. The checksum is the sum of the SHA-256 of each document's
+BSON modulo 2**256, so it does not depend on document order and can be
+recomputed from a restored copy. verify() restores a backup into a scratch
+database, recomputes both and times the restore.
+
+Automatic backups are pruned grandfather-father-son: the newest backup of
+each of the last `daily` days, `weekly` ISO weeks and `monthly` months is
+kept, using nothing but catalog dates. Manual backups are never pruned.
+"""
+import hashlib
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+import bson
+from bson.binary import Binary
+
+logger = logging.getLogger(__name__)
+
+# Everything a backup copies; restore puts back the clinical collections only
+BACKUP_COLLECTIONS = (
+    "patients", "visits", "queue", "consents", "users", "audit_log", "login_audit",
+    "treatments", "consultants", "catalog_counters"
+)
+# Visits reference the catalogs by id, so the two are restored together
+RESTORED_COLLECTIONS = ("patients", "visits", "queue", "treatments", "consultants", "catalog_counters")
+
+CHUNK_BYTES = 8 * 1024 * 1024
+CHECKSUM_MODULUS = 1 << 256
+AUTO_CREATOR = "SYSTEM_AUTO"
+
+# Catalog entries stuck in "writing" this long belonged to a crashed backup
+STALE_WRITE = timedelta(hours=6)
+
+
+def split_bson(blob: bytes) -> Iterable[memoryview]:
+    """Individual documents of a concatenated BSON blob, still encoded"""
+    view = memoryview(blob)
+    offset = 0
+    while offset < len(blob):
+        size = int.from_bytes(view[offset:offset + 4], "little")
+        yield view[offset:offset + size]
+        offset += size
+
+
+def _digest(doc: bytes) -> int:
+    return int.from_bytes(hashlib.sha256(doc).digest(), "big")
+
+
+def format_checksum(value: int) -> str:
+    return f"{value:064x}"
+
+
+async def collection_checksum(database, name: str) -> tuple:
+    """(documents, checksum) of a live collection, read as raw BSON without _id"""
+    docs = total = 0
+    async for batch in database[name].find_raw_batches({}, {"_id": 0}):
+        for doc in split_bson(batch):
+            docs += 1
+            total = (total + _digest(doc)) % CHECKSUM_MODULUS
+    return docs, format_checksum(total)
+
+
+class _ChunkWriter:
+    """Packs encoded documents of one collection into backup_chunks documents"""
+
+    def __init__(self, db, backup_id: str, collection: str):
+        self.db = db
+        self.backup_id = backup_id
+        self.collection = collection
+        self.parts: List[bytes] = []
+        self.part_bytes = 0
+        self.chunks = self.docs = self.bytes = self.checksum = 0
+
+    async def add(self, doc: bytes):
+        if self.parts and self.part_bytes + len(doc) > CHUNK_BYTES:
+            await self.flush()
+        self.parts.append(doc)
+        self.part_bytes += len(doc)
+        self.docs += 1
+        self.bytes += len(doc)
+        self.checksum = (self.checksum + _digest(doc)) % CHECKSUM_MODULUS
+
+    async def flush(self):
+        if not self.parts:
+            return
+        await self.db.backup_chunks.insert_one({
+            "backup_id": self.backup_id, "collection": self.collection, "seq": self.chunks,
+            "count": len(self.parts), "payload": Binary(b"".join(self.parts))
+        })
+        self.chunks += 1
+        self.parts, self.part_bytes = [], 0
+
+
+async def create(db, backup_id: str, created_by: str, now: Optional[datetime] = None) -> dict:
+    """Write a full backup and return its catalog entry"""
+    now = now or datetime.now(timezone.utc)
+    entry = {
+        "backup_id": backup_id,
+        "created_at": now.isoformat(),
+        "created_by": created_by,
+        "kind": "auto" if created_by == AUTO_CREATOR else "manual",
+        "status": "writing",
+        "collections": list(BACKUP_COLLECTIONS),
+    }
+    await db.backups.insert_one(dict(entry))
+    counts, checksums, size, chunks = {}, {}, 0, 0
+    try:
+        for name in BACKUP_COLLECTIONS:
+            writer = _ChunkWriter(db, backup_id, name)
+            # Copied as raw BSON batches; documents are never decoded on the way through
+            async for batch in db[name].find_raw_batches({}, {"_id": 0}):
+                for doc in split_bson(batch):
+                    await writer.add(doc)
+            await writer.flush()
+            counts[name] = writer.docs
+            checksums[name] = format_checksum(writer.checksum)
+            size += writer.bytes
+            chunks += writer.chunks
+    except Exception:
+        await delete(db, backup_id)
+        raise
+    finished = {"status": "complete", "counts": counts, "checksums": checksums, "bytes": size, "chunks": chunks,
+                "completed_at": datetime.now(timezone.utc).isoformat()}
+    await db.backups.update_one({"backup_id": backup_id}, {"$set": finished})
+    return {**entry, **finished}
+
+
+async def iter_documents(db, backup_id: str, collection: str):
+    """Yield a backed-up collection one decoded chunk (list of documents) at a time"""
+    async for chunk in db.backup_chunks.find(
+        {"backup_id": backup_id, "collection": collection}, {"_id": 0, "payload": 1}
+    ).sort("seq", 1):
+        yield bson.decode_all(chunk["payload"])
+
+
+async def verify(db, scratch, backup_id: str) -> Optional[dict]:
+    """Test-restore a backup into the scratch database and record the outcome in the catalog.
+
+    Every backed-up collection is restored (not only the ones a real restore
+    replaces), counted and checksummed, then dropped from scratch again.
+    restore_seconds covers reading and inserting the payload, i.e. the
+    recovery time of a real restore before summaries are rebuilt. Returns the
+    verification record, or None if there is no complete backup backup_id.
+    """
+    entry = await db.backups.find_one(
+        {"backup_id": backup_id, "status": "complete"},
+        {"_id": 0, "collections": 1, "counts": 1, "checksums": 1, "bytes": 1}
+    )
+    if entry is None:
+        return None
+    expected_counts = entry.get("counts", {})
+    expected_checksums = entry.get("checksums", {})
+    names = entry.get("collections") or list(expected_counts)
+
+    collections, failed, error = {}, [], None
+    restore_seconds = 0.0
+    documents = 0
+    try:
+        for name in names:
+            await scratch[name].drop()
+            started = time.perf_counter()
+            async for docs in iter_documents(db, backup_id, name):
+                if docs:
+                    await scratch[name].insert_many(docs)
+            restore_seconds += time.perf_counter() - started
+
+            count, checksum = await collection_checksum(scratch, name)
+            documents += count
+            expected = expected_checksums.get(name)
+            result = {
+                "expected_count": expected_counts.get(name), "restored_count": count,
+                # Backups migrated from inline payloads before checksums existed have none to compare
+                "checksum_ok": None if expected is None else checksum == expected
+            }
+            collections[name] = result
+            if count != result["expected_count"] or result["checksum_ok"] is False:
+                failed.append(name)
+    except Exception as e:
+        error = str(e) or type(e).__name__
+    finally:
+        for name in names:
+            await scratch[name].drop()
+
+    verification = {
+        "status": "failed" if failed or error else "passed",
+        "verified_at": datetime.now(timezone.utc).isoformat(),
+        "restore_seconds": round(restore_seconds, 3),
+        "documents": documents,
+        "bytes": entry.get("bytes"),
+        "documents_per_second": round(documents / restore_seconds) if restore_seconds else None,
+        "failed_collections": failed,
+        "collections": collections,
+        "error": error,
+    }
+    await db.backups.update_one({"backup_id": backup_id}, {"$set": {"verification": verification}})
+    return verification
+
+
+async def delete(db, backup_id: str) -> bool:
+    """Remove a backup's payload first, then its catalog entry"""
+    await db.backup_chunks.delete_many({"backup_id": backup_id})
+    result = await db.backups.delete_one({"backup_id": backup_id})
+    return result.deleted_count > 0
+
+
+def gfs_retained(entries: List[dict], daily: int, weekly: int, monthly: int) -> set:
+    """backup_ids kept by grandfather-father-son retention.
+
+    entries are catalog rows (backup_id, created_at) sorted newest first. For
+    each granularity the newest backup of each of the most recent periods is
+    kept; the newest backup overall is always kept.
+    """
+    keep = {entries[0]["backup_id"]} if entries else set()
+    for period_format, limit in (("%Y-%m-%d", daily), ("%G-W%V", weekly), ("%Y-%m", monthly)):
+        periods = set()
+        for entry in entries:
+            period = datetime.fromisoformat(entry["created_at"]).strftime(period_format)
+            if period in periods:
+                continue
+            if len(periods) >= limit:
+                break
+            periods.add(period)
+            keep.add(entry["backup_id"])
+    return keep
+
+
+async def prune(db, daily: int, weekly: int, monthly: int) -> List[str]:
+    """Apply GFS retention to automatic backups and clear out crashed writes; returns deleted ids"""
+    entries = await db.backups.find(
+        {"created_by": AUTO_CREATOR, "status": "complete"}, {"_id": 0, "backup_id": 1, "created_at": 1}
+    ).sort("created_at", -1).to_list(None)
+    keep = gfs_retained(entries, daily, weekly, monthly)
+    doomed = [e["backup_id"] for e in entries if e["backup_id"] not in keep]
+
+    stale_before = (datetime.now(timezone.utc) - STALE_WRITE).isoformat()
+    async for entry in db.backups.find({"status": "writing", "created_at": {"$lt": stale_before}}, {"_id": 0, "backup_id": 1}):
+        doomed.append(entry["backup_id"])
+
+    for backup_id in doomed:
+        await delete(db, backup_id)
+    return doomed
+
+
+async def migrate_inline_payloads(db) -> int:
+    """Move the `data` of backups written before the catalog split into chunks"""
+    migrated = 0
+    async for entry in db.backups.find({"data": {"$exists": True}}, {"_id": 0, "backup_id": 1}):
+        backup_id = entry["backup_id"]
+        # One legacy backup in memory at a time
+        legacy = await db.backups.find_one({"backup_id": backup_id}, {"_id": 0, "data": 1, "created_by": 1})
+        await db.backup_chunks.delete_many({"backup_id": backup_id})
+        counts, checksums, size, chunks = {}, {}, 0, 0
+        for name, docs in legacy.get("data", {}).items():
+            writer = _ChunkWriter(db, backup_id, name)
+            for doc in docs:
+                await writer.add(bson.encode(doc))
+            await writer.flush()
+            counts[name] = writer.docs
+            checksums[name] = format_checksum(writer.checksum)
+            size += writer.bytes
+            chunks += writer.chunks
+        await db.backups.update_one({"backup_id": backup_id}, {
+            "$set": {"status": "complete", "kind": "auto" if legacy.get("created_by") == AUTO_CREATOR else "manual",
+                     "collections": list(counts), "counts": counts, "checksums": checksums, "bytes": size, "chunks": chunks},
+            "$unset": {"data": ""}
+        })
+        migrated += 1
+    if migrated:
+        logger.info(f"Moved {migrated} inline backup payloads into backup_chunks")
+    return migrated
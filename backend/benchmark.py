@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""Load benchmark for the clinic API hot paths.
+
+Seeds a throwaway Mongo database with a synthetic clinic (see seed_data.py),
+then drives a mixed concurrent workload (kiosk registrations, dashboard polls,
+visit creation and report queries) and reports p50/p95/p99 latency and
+requests/second per endpoint.
+
+By default the app is driven in-process through httpx's ASGI transport, so no
+server has to be running; pass --base-url to benchmark a deployed instance
+that points at the same --db-name.
+
+Examples:
+    python benchmark.py --size small
+    python benchmark.py --size medium --duration 60 --save-baseline bench_medium.json
+    python benchmark.py --size medium --compare bench_medium.json --tolerance 0.2
+    python benchmark.py --analytics --patients 50000 --years 3
+    python benchmark.py --size medium --isolation --report-load 4
+    REPORT_WORKERS=0 python benchmark.py --size medium --isolation --skip-seed
+
+--analytics also reports the event-loop lag a ticking probe sees while
+reports are computed on the loop, in a thread and in the process pool.
+--isolation measures kiosk and queue latency twice, alone and while
+--report-load clients request whole-history reports from the same worker,
+and fails if kiosk p99 degrades by more than --tolerance.
+
+Never point this at a production database: seeding drops the target database.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+import bson
+
+sys.path.insert(0, str(Path(__file__).parent))
+import seed_data  # noqa: E402
+
+SIZES = {
+    "small": {"patients": 1_000, "years": 1},
+    "medium": {"patients": 10_000, "years": 2},
+    "large": {"patients": 100_000, "years": 3},
+}
+
+# Relative weights of each scenario in the mixed workload
+SCENARIO_WEIGHTS = {
+    "dashboard": 40,
+    "queue": 25,
+    "kiosk_register": 15,
+    "create_visit": 15,
+    "reports": 5,
+    "alert_report": 2,
+}
+
+# Front-desk traffic whose latency must not depend on report load
+ISOLATION_WEIGHTS = {"kiosk_register": 1, "queue": 1}
+
+TREATMENTS = list(seed_data.TREATMENTS)
+CONSULTANTS = list(seed_data.CONSULTANTS)
+# A few KB of base64, similar in size to a real signature pad capture
+FAKE_SIGNATURE = "data:image/png;base64," + "iVBORw0KGgo" * 400
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class Runner:
+    def __init__(self, client, patient_ids, rng: random.Random):
+        self.client = client
+        self.patient_ids = patient_ids
+        self.rng = rng
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.counter = 0
+
+    async def call(self, name, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except Exception:
+            ok = False
+        self.latencies[name].append(time.perf_counter() - started)
+        if not ok:
+            self.errors[name] += 1
+
+    async def scenario(self, name):
+        if name == "dashboard":
+            await self.call(name, "GET", "/api/dashboard")
+        elif name == "queue":
+            await self.call(name, "GET", "/api/queue")
+        elif name == "kiosk_register":
+            self.counter += 1
+            await self.call(name, "POST", "/api/kiosk/register", json={
+                "first_name": "BENCH", "last_name": f"KIOSK{self.counter}{self.rng.getrandbits(24)}", "dob": "1990-01-01",
+                "postcode": "RG1 1AA", "phone": "0700000000", "email": "bench@example.com", "street": "1 Road",
+                "city": "READING", "emergency_name": "EM", "emergency_phone": "0711111111", "reason": "Bench",
+                "consent_data_processing": True, "signature_data_processing": FAKE_SIGNATURE
+            })
+        elif name == "create_visit":
+            await self.call(name, "POST", "/api/visits", json={
+                "patient_id": self.rng.choice(self.patient_ids), "treatment": self.rng.choice(TREATMENTS),
+                "notes": "bench", "consultant": self.rng.choice(CONSULTANTS)
+            })
+        elif name == "reports":
+            await self.call(name, "GET", "/api/reports/comprehensive")
+        elif name == "alert_report":
+            await self.call(name, "GET", "/api/reports/alerts")
+
+    async def worker(self, deadline, scenario_weights=SCENARIO_WEIGHTS):
+        names = list(scenario_weights)
+        weights = [scenario_weights[n] for n in names]
+        while time.perf_counter() < deadline:
+            await self.scenario(self.rng.choices(names, weights)[0])
+
+    async def report_loop(self, deadline):
+        # Whole-history reports: the heaviest request the Analytics page makes
+        while time.perf_counter() < deadline:
+            await self.call("reports", "GET", "/api/reports/comprehensive?start_date=2000-01-01")
+
+    def summary(self, elapsed):
+        results = {}
+        for name, values in sorted(self.latencies.items()):
+            values.sort()
+            results[name] = {
+                "requests": len(values),
+                "errors": self.errors[name],
+                "rps": round(len(values) / elapsed, 2),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+            }
+        return results
+
+
+def print_table(results):
+    print(f"{'endpoint':<16}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['requests']:>10}{r['errors']:>8}{r['rps']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions beyond tolerance (fractional) against a saved run"""
+    regressions = []
+    for name, base in baseline["results"].items():
+        current = results.get(name)
+        if not current:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if base[key] and current[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name} {key}: {base[key]} -> {current[key]}")
+        if base["rps"] and current["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name} rps: {base['rps']} -> {current['rps']}")
+    return regressions
+
+
+def _projected(rows, fields):
+    return b"".join(bson.encode({k: row[k] for k in fields if k in row}) for row in rows)
+
+
+async def measure_stall(payload, pool_size=None, runs=3, interval=0.005):
+    """Event-loop lag (ms) seen by a ticking probe while reports are computed.
+
+    pool_size=None computes on the loop itself, as the API did before the
+    compute pool; 0 uses a thread and N > 0 a pool of N processes.
+    """
+    import analytics
+    import workers
+
+    pool = workers.ComputePool("bench", pool_size or 0)
+    await pool.start()
+    lags = []
+    done = asyncio.Event()
+
+    async def probe():
+        while not done.is_set():
+            ticked = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - ticked - interval)
+
+    task = asyncio.create_task(probe())
+    await asyncio.sleep(interval * 2)
+    for _ in range(runs):
+        if pool_size is None:
+            analytics.report_json(*payload)
+            await asyncio.sleep(0)
+        else:
+            await pool.run(analytics.report_json, *payload)
+    done.set()
+    await task
+    await pool.stop()
+    lags.sort()
+    return round(percentile(lags, 99) * 1000, 1), round(lags[-1] * 1000, 1)
+
+
+async def run_analytics(size, seed, repeat=3):
+    """Time the columnar report engine on an in-memory clinic, no Mongo involved"""
+    import analytics
+    import catalogs
+
+    generator = seed_data.ClinicGenerator(size["patients"], size["years"], seed=seed)
+    rows = {"patients": [], "visits": [], "queue": [], "consents": []}
+    for name, doc in generator.generate():
+        if name != "consents":
+            rows[name].append(doc)
+    # The generator writes free text, as the clinic did before catalogs; reference ids like migrated visits
+    names = {kind: {} for kind in catalogs.KINDS}
+    ids = {kind: {} for kind in catalogs.KINDS}
+    for visit in rows["visits"]:
+        refs = {}
+        for kind, field in catalogs.LEGACY_FIELDS.items():
+            text = visit.pop(field)
+            refs[kind] = ids[kind].setdefault(catalogs.normalize(text), len(ids[kind]) + 1)
+            names[kind][refs[kind]] = text
+        visit["treatment_ids"] = [refs["treatments"]]
+        visit["consultant_id"] = refs["consultants"]
+    start_date = generator.start.strftime("%Y-%m-%d")
+    end_date = generator.now.strftime("%Y-%m-%d")
+    # The API reads the data-quality and alert sections with Mongo queries (quality counters,
+    # an aggregation over alert_flags) that the load benchmark's reports and alert_report
+    # scenarios time; here they are only carried through
+    quality, alerts = {}, {}
+    print(f"{len(rows['visits'])} visits, {len(rows['patients'])} patients, {len(rows['queue'])} queue rows")
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        snapshot = analytics.ReportSnapshot(rows["visits"], rows["patients"], rows["queue"], names)
+        built = time.perf_counter()
+        analytics.compute_reports(snapshot, start_date, end_date, generator.now, quality=quality, alerts=alerts)
+        done = time.perf_counter()
+        print(f"snapshot {1000 * (built - started):8.1f} ms   sections {1000 * (done - built):8.1f} ms   total {1000 * (done - started):8.1f} ms")
+
+    # What the event loop (and so every kiosk request on the worker) feels while reports run
+    payload = (
+        _projected(rows["visits"], analytics.VISIT_FIELDS), _projected(rows["patients"], analytics.PATIENT_FIELDS),
+        _projected(rows["queue"], analytics.QUEUE_FIELDS), start_date, end_date, generator.now, quality, names, alerts
+    )
+    print(f"\n{'report compute':<22}{'loop lag p99 ms':>16}{'max ms':>10}")
+    for label, pool_size in (("on the event loop", None), ("thread", 0), ("2 processes", 2)):
+        p99, worst = await measure_stall(payload, pool_size)
+        print(f"{label:<22}{p99:>16}{worst:>10}")
+    return 0
+
+
+async def run_isolation(client, patient_ids, rng, args):
+    """Kiosk/queue latency alone, then with report requests on the same worker"""
+    phases = {}
+    for label, report_clients in (("alone", 0), (f"with {args.report_load} report clients", args.report_load)):
+        runner = Runner(client, patient_ids, rng)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(
+            *(runner.worker(deadline, ISOLATION_WEIGHTS) for _ in range(args.concurrency)),
+            *(runner.report_loop(deadline) for _ in range(report_clients))
+        )
+        phases[label] = runner.summary(time.perf_counter() - started)
+        print(f"\n{label}:")
+        print_table(phases[label])
+
+    alone, loaded = (phases[label].get("kiosk_register", {}).get("p99_ms", 0) for label in phases)
+    print(f"\nkiosk_register p99: {alone} ms alone, {loaded} ms under report load "
+          f"(REPORT_WORKERS={os.environ.get('REPORT_WORKERS', 'default')})")
+    if alone and loaded > alone * (1 + args.tolerance):
+        print(f"REGRESSION: kiosk p99 grew by more than {args.tolerance:.0%} under report load")
+        return 1
+    return 0
+
+
+async def main(args):
+    size = dict(SIZES[args.size])
+    if args.patients:
+        size["patients"] = args.patients
+    if args.years:
+        size["years"] = args.years
+    if args.analytics:
+        return await run_analytics(size, args.seed)
+
+    # server.py binds its database at import time, so select the bench DB first
+    os.environ["DB_NAME"] = args.db_name
+    import httpx
+    import server
+
+    rng = random.Random(args.seed)
+    if args.skip_seed:
+        patient_ids = [p["patient_id"] async for p in server.db.patients.find({}, {"_id": 0, "patient_id": 1})]
+    else:
+        started = time.perf_counter()
+        generator = seed_data.ClinicGenerator(size["patients"], size["years"], seed=args.seed)
+        counts = await seed_data.load_clinic(server.db, generator)
+        patient_ids = generator.patient_ids
+        print(f"Seeded {counts} in {time.perf_counter() - started:.1f}s")
+    await server.init_database()
+
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=120)
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://bench", timeout=120)
+    async with client:
+        login = await client.post("/api/auth/login", json={"username": "ADMIN", "password": args.admin_password})
+        login.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {login.json()['token']}"
+
+        if args.isolation:
+            if not args.base_url:
+                # No lifespan events over the ASGI transport, so spawn the pool outside the measurement
+                await server.report_pool.start()
+            try:
+                return await run_isolation(client, patient_ids, rng, args)
+            finally:
+                await server.report_pool.stop()
+
+        runner = Runner(client, patient_ids, rng)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(runner.worker(deadline) for _ in range(args.concurrency)))
+        results = runner.summary(time.perf_counter() - started)
+
+    print_table(results)
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "config": {**size, "concurrency": args.concurrency, "duration": args.duration, "seed": args.seed},
+        "results": results,
+    }
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(report, indent=2))
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.compare:
+        regressions = compare(results, json.loads(Path(args.compare).read_text()), args.tolerance)
+        if regressions:
+            print("REGRESSIONS:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.compare}")
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size", choices=SIZES, default="small")
+    parser.add_argument("--patients", type=int, help="override the preset patient count")
+    parser.add_argument("--years", type=int, help="override the preset years of history")
+    parser.add_argument("--db-name", default=os.environ.get("BENCH_DB_NAME", "just_vitality_bench"))
+    parser.add_argument("--base-url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--admin-password", default="vit2025")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of mixed load")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the data already in --db-name")
+    parser.add_argument("--analytics", action="store_true", help="only time the report engine on in-memory data")
+    parser.add_argument("--isolation", action="store_true", help="compare kiosk latency with and without report load")
+    parser.add_argument("--report-load", type=int, default=4, help="concurrent report clients in --isolation mode")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH", help="fail on regressions against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed fractional slowdown (default 0.2)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,243 @@
+"""Treatment and consultant catalogs.
+
+Visits reference treatments and consultants by small integer id instead of
+repeating free text on every row:
+
+    visits:      {..., "treatment_ids": [3, 7], "consultant_id": 2}
+    treatments:  {"id": 3, "name": "IV Vitamin Drip", "aliases": ["Vit drip"],
+                  "keys": ["iv vitamin drip", "vit drip"], "active": True}
+
+`keys` holds the normalised name and aliases (case, punctuation and spacing
+folded) under a unique index, so "IV Drip", "iv drip" and "IV-drip" resolve to
+one entry and two workers can never create the same entry twice. Text that
+matches no entry creates a new one, so the desk can still type a treatment
+the catalog does not know yet; managers rename, alias, retire or merge
+entries afterwards. A visit's treatment text holds one treatment per line and
+each line is one reference. Ids come from a per-catalog sequence in
+catalog_counters.
+
+The API keeps returning visits with `treatment` and `consultant` names;
+`Catalog` turns references back into text. migrate_visits() converts visits
+still carrying the free-text fields, naming each entry after the most common
+spelling in the history.
+"""
+import logging
+import re
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("treatments", "consultants")
+# The legacy free-text field each catalog replaces
+LEGACY_FIELDS = {"treatments": "treatment", "consultants": "consultant"}
+
+
+def normalize(text: Optional[str]) -> str:
+    return " ".join(re.sub(r"[\W_]+", " ", (text or "").casefold()).split())
+
+
+def clean_name(text: Optional[str]) -> str:
+    return " ".join((text or "").split())
+
+
+def split_treatments(text: Optional[str]) -> List[str]:
+    """The treatments of a visit's treatment text, one per non-blank line, repeats dropped"""
+    seen, names = set(), []
+    for line in (text or "").splitlines():
+        key = normalize(line)
+        if key and key not in seen:
+            seen.add(key)
+            names.append(clean_name(line))
+    return names
+
+
+def distinct_aliases(name: str, aliases: Iterable[str]) -> List[str]:
+    """Cleaned aliases, without blanks, repeats and spellings of the name itself"""
+    seen, kept = {normalize(name)}, []
+    for alias in aliases:
+        key = normalize(alias)
+        if key and key not in seen:
+            seen.add(key)
+            kept.append(clean_name(alias))
+    return kept
+
+
+def entry_keys(name: str, aliases: Iterable[str]) -> List[str]:
+    keys = []
+    for text in (name, *aliases):
+        key = normalize(text)
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+class Catalog:
+    """One catalog in memory: entries by id and by normalised name or alias"""
+
+    def __init__(self, kind: str, entries: List[dict]):
+        self.kind = kind
+        self.entries = sorted(entries, key=lambda e: e["name"].casefold())
+        self.by_id = {e["id"]: e for e in entries}
+        self.by_key = {key: e["id"] for e in entries for key in e.get("keys", [])}
+
+    def lookup(self, text: Optional[str]) -> Optional[int]:
+        return self.by_key.get(normalize(text))
+
+    def name(self, entry_id: Optional[int]) -> str:
+        """The entry's name; an id this copy lacks shows as "#<id>" rather than vanishing"""
+        if entry_id is None:
+            return ""
+        entry = self.by_id.get(entry_id)
+        return entry["name"] if entry else f"#{entry_id}"
+
+    def covers(self, entry_ids: Iterable[int]) -> bool:
+        return all(entry_id in self.by_id for entry_id in entry_ids if entry_id is not None)
+
+    def names(self) -> Dict[int, str]:
+        return {e["id"]: e["name"] for e in self.entries}
+
+    def listing(self, include_inactive: bool = False) -> List[dict]:
+        return [
+            {"id": e["id"], "name": e["name"], "aliases": e.get("aliases", []), "active": e.get("active", True)}
+            for e in self.entries if include_inactive or e.get("active", True)
+        ]
+
+
+async def load(db, kind: str) -> Catalog:
+    return Catalog(kind, await db[kind].find({}, {"_id": 0}).to_list(None))
+
+
+async def create(db, kind: str, name: str, aliases: Iterable[str] = (), session=None) -> dict:
+    """Insert a new active entry; raises DuplicateKeyError if its name or an alias is taken"""
+    name = clean_name(name)
+    aliases = distinct_aliases(name, aliases)
+    counter = await db.catalog_counters.find_one_and_update(
+        {"catalog": kind}, {"$inc": {"seq": 1}}, upsert=True, return_document=ReturnDocument.AFTER, session=session
+    )
+    entry = {
+        "id": counter["seq"], "name": name, "aliases": aliases, "keys": entry_keys(name, aliases),
+        "active": True, "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db[kind].insert_one(dict(entry), session=session)
+    return entry
+
+
+async def resolve(db, catalog: Catalog, names: Iterable[str], session=None) -> tuple:
+    """(ids, created) for names, creating entries for names the catalog does not know.
+
+    Pass the caller's session so entries made for a write that is rolled back
+    are rolled back with it.
+    """
+    ids, created = [], False
+    for text in names:
+        if not normalize(text):
+            continue
+        entry_id = catalog.lookup(text)
+        if entry_id is None:
+            # The in-memory copy may predate an entry another worker added; inside a
+            # transaction a duplicate key error would abort it, so look before inserting
+            found = await db[catalog.kind].find_one({"keys": normalize(text)}, {"_id": 0, "id": 1}, session=session)
+            if found:
+                entry_id = found["id"]
+            else:
+                try:
+                    entry_id = (await create(db, catalog.kind, text, session=session))["id"]
+                except DuplicateKeyError:
+                    # Another request created it since the lookup
+                    entry_id = (await db[catalog.kind].find_one({"keys": normalize(text)}, {"_id": 0, "id": 1}))["id"]
+            created = True
+        if entry_id not in ids:
+            ids.append(entry_id)
+    return ids, created
+
+
+async def update(db, kind: str, entry_id: int, name: Optional[str] = None,
+                 aliases: Optional[List[str]] = None, active: Optional[bool] = None) -> Optional[dict]:
+    """Rename, re-alias or (de)activate an entry; a replaced name stays resolvable as an alias.
+
+    Raises DuplicateKeyError if the new name or an alias belongs to another entry.
+    """
+    entry = await db[kind].find_one({"id": entry_id}, {"_id": 0})
+    if entry is None:
+        return None
+    new_name = clean_name(name) or entry["name"]
+    new_aliases = distinct_aliases(new_name, [*(entry.get("aliases", []) if aliases is None else aliases), entry["name"]])
+    changes = {"name": new_name, "aliases": new_aliases, "keys": entry_keys(new_name, new_aliases)}
+    if active is not None:
+        changes["active"] = active
+    await db[kind].update_one({"id": entry_id}, {"$set": changes})
+    return {**entry, **changes}
+
+
+async def merge(db, kind: str, source_id: int, target_id: int) -> Optional[int]:
+    """Fold source into target: visits are repointed, source's names become target's aliases.
+
+    Every step leaves a state the merge can be repeated from: visits are
+    repointed, the source gives up its keys, the target takes its names, and
+    only then is the source deleted. No visit ever points at a missing entry.
+    Returns the number of visits changed, or None if either entry does not exist.
+    """
+    source = await db[kind].find_one({"id": source_id}, {"_id": 0})
+    target = await db[kind].find_one({"id": target_id}, {"_id": 0})
+    if source is None or target is None:
+        return None
+    if kind == "treatments":
+        both = await db.visits.update_many({"treatment_ids": {"$all": [source_id, target_id]}}, {"$pull": {"treatment_ids": source_id}})
+        moved = await db.visits.update_many({"treatment_ids": source_id}, {"$set": {"treatment_ids.$": target_id}})
+        changed = both.modified_count + moved.modified_count
+    else:
+        changed = (await db.visits.update_many({"consultant_id": source_id}, {"$set": {"consultant_id": target_id}})).modified_count
+    # Free the source's keys (unique across entries) before the target takes them over
+    await db[kind].update_one({"id": source_id}, {"$set": {"keys": [], "active": False}})
+    await update(db, kind, target_id, aliases=[*target.get("aliases", []), source["name"], *source.get("aliases", [])])
+    await db[kind].delete_one({"id": source_id})
+    return changed
+
+
+async def migrate_visits(db) -> int:
+    """Replace free-text treatment/consultant fields on visits with catalog references; returns visits changed"""
+    legacy = {"$or": [{field: {"$exists": True}} for field in LEGACY_FIELDS.values()]}
+    if not await db.visits.count_documents(legacy, limit=1):
+        return 0
+
+    changed = 0
+    for kind, field in LEGACY_FIELDS.items():
+        id_field = "treatment_ids" if kind == "treatments" else "consultant_id"
+        values = {}
+        async for row in db.visits.aggregate([
+            {"$match": {field: {"$exists": True}}},
+            {"$group": {"_id": f"${field}", "visits": {"$sum": 1}}}
+        ]):
+            values[row["_id"]] = row["visits"]
+
+        # Name each new entry after the spelling most visits used
+        spellings = defaultdict(Counter)
+        for value, visits in values.items():
+            names = split_treatments(value) if kind == "treatments" else [clean_name(value)]
+            for name in names:
+                if normalize(name):
+                    spellings[normalize(name)][name] += visits
+        catalog = await load(db, kind)
+        for key in sorted(spellings, key=lambda k: -sum(spellings[k].values())):
+            if key not in catalog.by_key:
+                await create(db, kind, spellings[key].most_common(1)[0][0])
+        catalog = await load(db, kind)
+
+        for value in values:
+            names = split_treatments(value) if kind == "treatments" else [value]
+            ids = [catalog.lookup(name) for name in names if normalize(name)]
+            update = {"$unset": {field: ""}}
+            if kind == "treatments":
+                update["$set"] = {id_field: list(dict.fromkeys(ids))}
+            elif ids:
+                update["$set"] = {id_field: ids[0]}
+            # {field: None} would also match visits already converted, which lack the field
+            match = {field: value} if value is not None else {field: {"$type": "null"}}
+            changed += (await db.visits.update_many(match, update)).modified_count
+        logger.info(f"Catalogued {len(values)} distinct {field} values into {len(catalog.entries)} {kind}")
+    return changed
@@ -0,0 +1,76 @@
+"""Single-flight coalescing of identical concurrent reads.
+
+When several requests ask for the same expensive read at the same moment
+(every desk terminal loading the dashboard at opening time, managers opening
+Analytics on the default range), only the first one runs it; the others await
+that computation and share its result. Nothing is cached: once the flight
+lands the next request starts a fresh one.
+
+Staleness is bounded by one flight: a follower gets the result of a
+computation that started before it arrived, so a write committed in between
+(by this worker or any other) may be missing from what it sees. Such a
+result is at most one computation's duration older than an uncoalesced read,
+and the follower's next request starts after the flight has landed.
+
+The computation runs as its own task, so a leader whose client disconnects
+does not cancel it for the followers. Shared results must be treated as
+read-only; endpoints share rendered bytes where they can.
+"""
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Hashable, Tuple
+
+import metrics
+
+coalesced_requests = metrics.registry.counter(
+    "singleflight_requests_total", "Requests that ran a computation (leader) or shared one (follower)"
+)
+flights_in_progress = metrics.registry.gauge("singleflight_in_flight", "Computations currently being shared")
+
+
+class SingleFlight:
+    def __init__(self, max_tracked_keys: int = 256):
+        self.flights: Dict[Tuple[str, Hashable], asyncio.Task] = {}
+        # Per-key counters for the most recently used keys (report ranges are unbounded)
+        self.key_stats: "OrderedDict[Tuple[str, Hashable], dict]" = OrderedDict()
+        self.max_tracked_keys = max_tracked_keys
+
+    def _record(self, name: str, key: Hashable, role: str):
+        metrics.registry.inc(coalesced_requests, endpoint=name, role=role)
+        stats = self.key_stats.pop((name, key), None) or {"leaders": 0, "followers": 0}
+        stats[role + "s"] += 1
+        stats["last_at"] = datetime.now(timezone.utc).isoformat()
+        self.key_stats[(name, key)] = stats
+        while len(self.key_stats) > self.max_tracked_keys:
+            self.key_stats.popitem(last=False)
+
+    def _landed(self, name: str, flight_key, task: asyncio.Task):
+        if self.flights.get(flight_key) is task:
+            del self.flights[flight_key]
+        metrics.registry.set(flights_in_progress, sum(1 for n, _ in self.flights if n == name), endpoint=name)
+        if not task.cancelled():
+            task.exception()  # mark retrieved; the awaiting requests re-raise it
+
+    async def do(self, name: str, key: Hashable, compute: Callable[[], Awaitable]):
+        """Result of compute(), shared with every concurrent call for the same (name, key)"""
+        flight_key = (name, key)
+        task = self.flights.get(flight_key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self.flights[flight_key] = task
+            task.add_done_callback(lambda t: self._landed(name, flight_key, t))
+            metrics.registry.set(flights_in_progress, sum(1 for n, _ in self.flights if n == name), endpoint=name)
+            self._record(name, key, "leader")
+        else:
+            self._record(name, key, "follower")
+        return await asyncio.shield(task)
+
+    def stats(self) -> list:
+        """Per-key leader/follower counts, most recently used first"""
+        return [
+            {"endpoint": name, "key": repr(key), **stats,
+             "coalesced_pct": round(stats["followers"] / (stats["leaders"] + stats["followers"]) * 100, 1),
+             "in_flight": (name, key) in self.flights}
+            for (name, key), stats in reversed(self.key_stats.items())
+        ]
@@ -0,0 +1,209 @@
+"""Background cascade deletion in throttled batches.
+
+Erasing a patient touches every collection that references them, and the
+admin purges empty whole collections. Neither runs inside the request: the
+endpoint records a task in `deletion_tasks` and returns its task_id, and a
+loop in every worker claims queued tasks one at a time and works through the
+task's plan, a list of steps:
+
+* Delete(collection, filter) removes matching documents BATCH at a time,
+  selected by _id, so no single delete holds locks or fills the oplog for
+  long;
+* Update(collection, filter, update) likewise; the update must make the
+  filter stop matching, or the step never ends;
+* Call(label, func) runs a follow-up once (rebuilding summaries, dropping
+  revision tokens, announcing the change).
+
+Between batches the loop sleeps at least `pause` and at least as long as the
+batch took, so a purge never takes more than half of the database's time
+from kiosk and desk traffic. Progress (current step, documents done and the
+step's starting total) is written to the task after every batch.
+
+Plans are registered per task kind and rebuild their steps from the task
+document, so only plain data (kind, params, cutoff) is stored. Steps are
+idempotent, so a task whose worker died is reclaimed once its heartbeat is
+STALE_AFTER old and simply continues from its current step.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+STALE_AFTER = timedelta(minutes=5)
+
+deleted_documents = metrics.registry.counter(
+    "deletion_documents_total", "Documents removed or updated by background deletion tasks"
+)
+deletion_batch_duration = metrics.registry.histogram(
+    "deletion_batch_duration_seconds", "Time to process one deletion batch",
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+
+class Delete:
+    def __init__(self, collection: str, filter: dict, label: Optional[str] = None):
+        self.collection = collection
+        self.filter = filter
+        self.label = label or collection
+
+
+class Update:
+    def __init__(self, collection: str, filter: dict, update: dict, label: Optional[str] = None):
+        self.collection = collection
+        self.filter = filter
+        self.update = update
+        self.label = label or f"{collection} (update)"
+
+
+class Call:
+    def __init__(self, label: str, func: Callable[[], Awaitable]):
+        self.label = label
+        self.func = func
+
+
+class DeletionEngine:
+    def __init__(self, db, owner: str, batch_size: int = 500, pause: float = 0.05, poll_interval: float = 30):
+        self.db = db
+        self.owner = owner
+        self.batch_size = batch_size
+        self.pause = pause
+        self.poll_interval = poll_interval
+        self.plans: Dict[str, Callable[[dict], List]] = {}
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def plan(self, kind: str):
+        """Decorator registering the step builder for a task kind"""
+        def register(builder: Callable[[dict], List]):
+            self.plans[kind] = builder
+            return builder
+        return register
+
+    async def submit(self, kind: str, requested_by: str, params: Optional[dict] = None, session=None) -> dict:
+        """Queue a task; pass the session to enqueue it in the same transaction as the request's own writes"""
+        now = datetime.now(timezone.utc)
+        task = {
+            "task_id": str(uuid.uuid4()),
+            "kind": kind,
+            "params": params or {},
+            "requested_by": requested_by,
+            "requested_at": now.isoformat(),
+            # Rows written after this (e.g. a patient registering again) are not part of the task
+            "cutoff": now,
+            "status": "queued",
+            "step": 0,
+            "steps": [],
+        }
+        await self.db.deletion_tasks.insert_one(dict(task), session=session)
+        return task
+
+    def kick(self):
+        """Wake this worker's loop after submitting, instead of waiting for the next poll"""
+        self.wakeup.set()
+
+    @property
+    def alive(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    async def start(self):
+        self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def _loop(self):
+        metrics.registry.set(metrics.task_running, 1, task="deletions")
+        try:
+            while True:
+                self.wakeup.clear()
+                while (task := await self._claim()) is not None:
+                    await self._run(task)
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            metrics.registry.set(metrics.task_running, 0, task="deletions")
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await self.db.deletion_tasks.find_one_and_update(
+            {"$or": [
+                {"status": "queued"},
+                {"status": "running", "heartbeat_at": {"$lt": now - STALE_AFTER}}
+            ]},
+            {"$set": {"status": "running", "owner": self.owner, "heartbeat_at": now},
+             "$min": {"started_at": now.isoformat()}},
+            sort=[("requested_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _progress(self, task_id: str, update: dict):
+        update.setdefault("$set", {})["heartbeat_at"] = datetime.now(timezone.utc)
+        await self.db.deletion_tasks.update_one({"task_id": task_id, "owner": self.owner}, update)
+
+    async def _run(self, task: dict):
+        task_id = task["task_id"]
+        started = time.time()
+        try:
+            steps = self.plans[task["kind"]](task)
+            if not task.get("steps"):
+                await self._progress(task_id, {"$set": {"steps": [
+                    {"label": step.label, "done": 0, "total": None} for step in steps
+                ]}})
+            for index in range(task.get("step", 0), len(steps)):
+                step = steps[index]
+                if isinstance(step, Call):
+                    result = await step.func()
+                    await self._progress(task_id, {"$set": {f"steps.{index}.result": result}})
+                else:
+                    await self._batches(task_id, index, step)
+                await self._progress(task_id, {"$set": {"step": index + 1}})
+            outcome = {"status": "done"}
+        except Exception as e:
+            logger.error(f"Deletion task {task_id} ({task['kind']}) failed: {e}")
+            outcome = {"status": "failed", "error": str(e) or type(e).__name__}
+        await self._progress(task_id, {"$set": {
+            **outcome, "finished_at": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round((time.time() - started) * 1000)
+        }})
+        logger.info(f"Deletion task {task_id} ({task['kind']}) {outcome['status']} in {time.time() - started:.1f}s")
+
+    async def _batches(self, task_id: str, index: int, step):
+        collection = self.db[step.collection]
+        total = await collection.count_documents(step.filter)
+        await self._progress(task_id, {"$set": {f"steps.{index}.total": total}})
+        while True:
+            batch_started = time.perf_counter()
+            ids = [doc["_id"] async for doc in collection.find(step.filter, {"_id": 1}).limit(self.batch_size)]
+            if not ids:
+                return
+            if isinstance(step, Delete):
+                done = (await collection.delete_many({"_id": {"$in": ids}})).deleted_count
+            else:
+                done = (await collection.update_many({"_id": {"$in": ids}}, step.update)).modified_count
+                if not done:
+                    raise RuntimeError(f"Update step '{step.label}' does not clear its own filter")
+            elapsed = time.perf_counter() - batch_started
+            metrics.registry.observe(deletion_batch_duration, elapsed, collection=step.collection)
+            metrics.registry.inc(deleted_documents, done, collection=step.collection)
+            await self._progress(task_id, {"$inc": {f"steps.{index}.done": done}})
+            # Leave the database at least as much idle time as this batch used
+            await asyncio.sleep(max(self.pause, elapsed))
+
+    async def get(self, task_id: str) -> Optional[dict]:
+        return await self.db.deletion_tasks.find_one({"task_id": task_id}, {"_id": 0, "cutoff": 0, "heartbeat_at": 0})
+
+    async def recent(self, limit: int = 50) -> list:
+        return await self.db.deletion_tasks.find(
+            {}, {"_id": 0, "cutoff": 0, "heartbeat_at": 0}
+        ).sort("requested_at", -1).to_list(limit)
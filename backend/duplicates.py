@@ -0,0 +1,249 @@
+"""Duplicate-patient candidate generation and scoring.
+
+Comparing every patient with every other is 5 * 10^9 pairs at 100k patients,
+so candidates are generated by blocking: patients are grouped on a few cheap
+normalised keys and only patients sharing a key are compared.
+
+* phone: the last ten digits, with a +44/0044 prefix folded to 0;
+* email: lowercased, without a +tag;
+* name_dob: date of birth plus the first letter of the last name (catches
+  spelling variants of the name; exact name + DOB already share a patient_id);
+* name: Soundex of the last name plus the first initial (catches mistyped
+  dates of birth).
+
+Blocks larger than MAX_BLOCK (a shared clinic phone, a very common surname)
+are skipped rather than compared pairwise, and reported as such.
+
+Each candidate pair gets a 0-100 score from date of birth, Jaro-Winkler name
+similarity and matching contact details. Pairs whose first names are clearly
+different (twins, parent and child sharing a phone) are scaled down so that
+shared household details alone never make a likely duplicate.
+
+`candidates_json` is what the API runs in its compute pool: raw BSON of the
+patients in, rendered JSON out, like analytics.report_json.
+"""
+import json
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import bson
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib json fallback
+    orjson = None
+
+PATIENT_FIELDS = {
+    "_id": 0, "patient_id": 1, "first_name": 1, "last_name": 1, "dob": 1, "phone": 1, "email": 1,
+    "postcode": 1, "visit_count": 1, "registered_at": 1
+}
+
+MAX_BLOCK = 50
+LIKELY_SCORE = 90
+
+# Weights of the score components; they add up to 100
+WEIGHTS = {"dob": 30, "last_name": 25, "first_name": 20, "phone": 12, "email": 10, "postcode": 3}
+# Below this first-name similarity the pair is probably two people of one household
+FIRST_NAME_GATE = 0.75
+HOUSEHOLD_FACTOR = 0.6
+
+SOUNDEX_CODES = {c: str(d) for d, letters in enumerate(("aeiouyhw", "bfpv", "cgjkqsxz", "dt", "l", "mn", "r")) for c in letters}
+
+
+def normalize_name(value: Optional[str]) -> str:
+    """Lowercase ASCII letters only: accents folded, spaces, hyphens and apostrophes dropped"""
+    folded = unicodedata.normalize("NFKD", value or "").encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z]", "", folded.lower())
+
+
+def normalize_phone(value: Optional[str]) -> str:
+    digits = re.sub(r"\D", "", value or "")
+    if digits.startswith("0044"):
+        digits = "0" + digits[4:]
+    elif digits.startswith("44") and len(digits) > 11:
+        digits = "0" + digits[2:]
+    return digits[-10:] if len(digits) >= 7 else ""
+
+
+def normalize_email(value: Optional[str]) -> str:
+    email = (value or "").strip().lower()
+    local, at, domain = email.partition("@")
+    if not at or not local or "." not in domain:
+        return ""
+    return f"{local.split('+', 1)[0]}@{domain}"
+
+
+def normalize_dob(value: Optional[str]) -> str:
+    """YYYY-MM-DD from ISO or DD/MM/YYYY input; anything else is kept as typed"""
+    value = (value or "").strip()
+    match = re.fullmatch(r"(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})", value)
+    if match:
+        day, month, year = match.groups()
+        return f"{year}-{int(month):02d}-{int(day):02d}"
+    return value[:10]
+
+
+def soundex(name: str) -> str:
+    if not name:
+        return ""
+    code, last = name[0], SOUNDEX_CODES.get(name[0], "")
+    for c in name[1:]:
+        digit = SOUNDEX_CODES.get(c, "")
+        if digit != last and digit not in ("", "0"):
+            code += digit
+        if c not in "hw":
+            last = digit
+    return (code + "000")[:4]
+
+
+def jaro_winkler(a: str, b: str) -> float:
+    if a == b:
+        return 1.0 if a else 0.0
+    if not a or not b:
+        return 0.0
+    window = max(max(len(a), len(b)) // 2 - 1, 0)
+    a_matched, b_matched = [False] * len(a), [False] * len(b)
+    matches = 0
+    for i, c in enumerate(a):
+        for j in range(max(0, i - window), min(len(b), i + window + 1)):
+            if not b_matched[j] and b[j] == c:
+                a_matched[i] = b_matched[j] = True
+                matches += 1
+                break
+    if not matches:
+        return 0.0
+    a_seq = [c for c, m in zip(a, a_matched) if m]
+    b_seq = [c for c, m in zip(b, b_matched) if m]
+    transpositions = sum(x != y for x, y in zip(a_seq, b_seq)) / 2
+    jaro = (matches / len(a) + matches / len(b) + (matches - transpositions) / matches) / 3
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * 0.1 * (1 - jaro)
+
+
+def dob_similarity(a: str, b: str) -> float:
+    """1 for the same date, 0.6 for one mistyped digit or swapped day and month, else 0"""
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    if len(a) == len(b) == 10:
+        if sum(x != y for x, y in zip(a, b)) == 1:
+            return 0.6
+        if a[:4] == b[:4] and a[5:7] == b[8:10] and a[8:10] == b[5:7]:
+            return 0.6
+    return 0.0
+
+
+class Patient:
+    __slots__ = ("patient_id", "first", "last", "dob", "phone", "email", "postcode", "doc")
+
+    def __init__(self, doc: dict):
+        self.patient_id = doc.get("patient_id", "")
+        self.first = normalize_name(doc.get("first_name"))
+        self.last = normalize_name(doc.get("last_name"))
+        self.dob = normalize_dob(doc.get("dob"))
+        self.phone = normalize_phone(doc.get("phone"))
+        self.email = normalize_email(doc.get("email"))
+        self.postcode = re.sub(r"\s", "", (doc.get("postcode") or "").upper())
+        self.doc = doc
+
+    def blocking_keys(self) -> Iterable[Tuple[str, str]]:
+        if self.phone:
+            yield "phone", self.phone
+        if self.email:
+            yield "email", self.email
+        if self.dob and self.last:
+            yield "name_dob", f"{self.dob}|{self.last[0]}"
+        if self.last and self.first:
+            yield "name", f"{soundex(self.last)}|{self.first[0]}"
+
+
+def score_pair(a: Patient, b: Patient) -> Tuple[float, Dict[str, float]]:
+    parts = {
+        "dob": dob_similarity(a.dob, b.dob),
+        "last_name": jaro_winkler(a.last, b.last),
+        "first_name": jaro_winkler(a.first, b.first),
+        "phone": float(bool(a.phone) and a.phone == b.phone),
+        "email": float(bool(a.email) and a.email == b.email),
+        "postcode": float(bool(a.postcode) and a.postcode == b.postcode),
+    }
+    score = sum(WEIGHTS[k] * v for k, v in parts.items())
+    if parts["first_name"] < FIRST_NAME_GATE:
+        score *= HOUSEHOLD_FACTOR
+    return round(score, 1), {k: round(v, 2) for k, v in parts.items()}
+
+
+def find_candidates(docs: List[dict], min_score: float = 65, dismissed: Iterable[str] = ()) -> dict:
+    """Scored candidate pairs, best first, plus blocking statistics"""
+    patients = [Patient(d) for d in docs if d.get("patient_id")]
+    blocks: Dict[Tuple[str, str], List[int]] = defaultdict(list)
+    for index, patient in enumerate(patients):
+        for key in patient.blocking_keys():
+            blocks[key].append(index)
+
+    reasons: Dict[Tuple[int, int], set] = defaultdict(set)
+    skipped = defaultdict(int)
+    for (kind, _), members in blocks.items():
+        if len(members) < 2:
+            continue
+        if len(members) > MAX_BLOCK:
+            skipped[kind] += 1
+            continue
+        for x in range(len(members)):
+            for y in range(x + 1, len(members)):
+                reasons[(members[x], members[y])].add(kind)
+
+    dismissed = set(dismissed)
+    pairs = []
+    for (i, j), matched_on in reasons.items():
+        a, b = patients[i], patients[j]
+        if pair_key(a.patient_id, b.patient_id) in dismissed:
+            continue
+        score, parts = score_pair(a, b)
+        if score < min_score:
+            continue
+        # Keep the record with the longer history; ties go to the earlier registration
+        survivor, duplicate = sorted((a, b), key=lambda p: (-(p.doc.get("visit_count") or 0), p.doc.get("registered_at") or "~", p.patient_id))
+        pairs.append({
+            "pair": pair_key(a.patient_id, b.patient_id),
+            "score": score,
+            "likely": score >= LIKELY_SCORE,
+            "matched_on": sorted(matched_on),
+            "components": parts,
+            "survivor": _summary(survivor.doc),
+            "duplicate": _summary(duplicate.doc),
+        })
+    pairs.sort(key=lambda p: (-p["score"], p["pair"]))
+    return {
+        "patients": len(patients),
+        "blocks": sum(1 for members in blocks.values() if len(members) > 1),
+        "blocks_skipped": dict(skipped),
+        "pairs_compared": len(reasons),
+        "candidates": pairs,
+    }
+
+
+def pair_key(a: str, b: str) -> str:
+    return "|".join(sorted((a, b)))
+
+
+def _summary(doc: dict) -> dict:
+    return {k: doc.get(k) for k in ("patient_id", "first_name", "last_name", "dob", "phone", "email", "postcode", "visit_count", "registered_at")}
+
+
+def candidates_json(patients_bytes: bytes, min_score: float, limit: int, dismissed: List[str]) -> bytes:
+    """Compute-pool entry point: raw BSON patients in, rendered response body out"""
+    result = find_candidates(bson.decode_all(patients_bytes), min_score, dismissed)
+    result["total_candidates"] = len(result["candidates"])
+    result["likely_candidates"] = sum(1 for p in result["candidates"] if p["likely"])
+    result["candidates"] = result["candidates"][:limit]
+    body = {"success": True, **result}
+    if orjson is not None:
+        return orjson.dumps(body)
+    return json.dumps(body).encode()
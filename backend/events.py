@@ -0,0 +1,186 @@
+"""Cross-worker event bus on a capped Mongo collection.
+
+Every uvicorn worker (on any host) tails the same capped `events` collection,
+so anything one worker publishes reaches all of them in insertion order:
+
+* cache invalidation - `SharedCache` entries are dropped everywhere when any
+  worker changes the underlying data;
+* push channels - Server-Sent Event streams subscribe to the bus, so a client
+  connected to worker A sees changes written through worker B.
+
+The listener uses a tailable, awaitable cursor. Deployments whose Mongo
+flavour has no tailable cursors fall back to polling every
+EVENT_POLL_SECONDS.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+logger = logging.getLogger(__name__)
+
+EVENTS_COLLECTION_BYTES = int(os.environ.get("EVENTS_COLLECTION_BYTES", str(16 * 1024 * 1024)))
+EVENT_POLL_SECONDS = float(os.environ.get("EVENT_POLL_SECONDS", "1"))
+# ObjectIds and `at` stamps come from each writer's clock, so events are
+# re-read from this far back whenever the listener resumes and deduplicated
+EVENT_OVERLAP = timedelta(seconds=5)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class EventBus:
+    def __init__(self, db, collection: str = "events"):
+        self.db = db
+        self.name = collection
+        self.handlers = []
+        self.task: Optional[asyncio.Task] = None
+        self.mode = "stopped"
+        # _id -> `at` of events dispatched within the overlap window
+        self.seen: Dict[Any, datetime] = {}
+
+    @property
+    def collection(self):
+        return self.db[self.name]
+
+    @property
+    def alive(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def subscribe(self, handler: Callable[[dict], Any]):
+        """Call handler(event) for every event, including this worker's own"""
+        self.handlers.append(handler)
+        return handler
+
+    def unsubscribe(self, handler):
+        if handler in self.handlers:
+            self.handlers.remove(handler)
+
+    async def publish(self, kind: str, **payload):
+        await self.collection.insert_one({
+            "kind": kind, "payload": payload, "origin": WORKER_ID, "at": datetime.now(timezone.utc)
+        })
+
+    async def start(self):
+        try:
+            await self.db.create_collection(self.name, capped=True, size=EVENTS_COLLECTION_BYTES)
+        except (CollectionInvalid, OperationFailure):
+            pass  # already created by another worker
+        self.task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    def _dispatch(self, event: dict):
+        for handler in list(self.handlers):
+            try:
+                handler(event)
+            except Exception as e:
+                logger.error(f"Event handler failed for {event.get('kind')}: {e}")
+
+    def _deliver(self, event: dict):
+        """Dispatch an event the first time it is read; overlapping re-reads skip it"""
+        if event["_id"] in self.seen:
+            return
+        self.seen[event["_id"]] = _aware(event.get("at") or event["_id"].generation_time)
+        if len(self.seen) > 1000:
+            self._resume_point()
+        self._dispatch(event)
+
+    def _resume_point(self) -> datetime:
+        """Time to re-read from: the overlap window before the newest event seen"""
+        newest = max(self.seen.values(), default=datetime.now(timezone.utc))
+        since = newest - EVENT_OVERLAP
+        self.seen = {event_id: at for event_id, at in self.seen.items() if at >= since}
+        return since
+
+    async def _listen(self):
+        # Start after whatever is already in the collection; history is not replayed
+        last = await self.collection.find_one({}, sort=[("$natural", -1)])
+        self.seen = {last["_id"]: _aware(last.get("at") or last["_id"].generation_time)} if last else {}
+        while True:
+            try:
+                self.mode = "tailing"
+                await self._tail()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                logger.warning(f"Tailable cursor unavailable ({e}); polling the event bus every {EVENT_POLL_SECONDS}s")
+                self.mode = "polling"
+                await self._poll()
+            except Exception as e:
+                logger.error(f"Event bus listener error: {e}")
+            await asyncio.sleep(EVENT_POLL_SECONDS)
+
+    async def _tail(self):
+        # Resuming with $gt on _id would skip events another host inserted with a
+        # "smaller" id; re-read the overlap window instead, as polling does
+        cursor = self.collection.find({"at": {"$gte": self._resume_point()}}, cursor_type=CursorType.TAILABLE_AWAIT)
+        while cursor.alive:
+            async for event in cursor:
+                self._deliver(event)
+
+    async def _poll(self):
+        while True:
+            async for event in self.collection.find({"at": {"$gte": self._resume_point()}}).sort("$natural", 1):
+                self._deliver(event)
+            await asyncio.sleep(EVENT_POLL_SECONDS)
+
+
+def _aware(value: datetime) -> datetime:
+    # Mongo hands datetimes back naive (in UTC) unless the client is tz_aware
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class SharedCache:
+    """Small in-process cache whose entries are invalidated on every worker via the bus.
+
+    The TTL bounds staleness should an invalidation event ever be missed
+    (e.g. while a worker's listener is reconnecting).
+    """
+
+    def __init__(self, bus: EventBus, name: str, ttl: float = 300):
+        self.bus = bus
+        self.name = name
+        self.ttl = ttl
+        self.entries: Dict[str, tuple] = {}
+        # Bumped on every invalidation so a load racing with one is not cached
+        self.generation = 0
+        bus.subscribe(self._on_event)
+
+    def _drop(self, key: Optional[str]):
+        self.generation += 1
+        if key is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
+
+    def _on_event(self, event: dict):
+        if event.get("kind") == "cache_invalidate" and event["payload"].get("cache") == self.name:
+            self._drop(event["payload"].get("key"))
+
+    async def get(self, key: str, load):
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        generation = self.generation
+        value = await load()
+        if generation == self.generation:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def discard(self, key: str):
+        """Drop key on this worker only, e.g. when it proved stale here"""
+        self._drop(key)
+
+    async def invalidate(self, key: Optional[str] = None):
+        """Drop key (or everything) here and, through the bus, on every other worker"""
+        self._drop(key)
+        await self.bus.publish("cache_invalidate", cache=self.name, key=key)
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""Declarative index registry for the clinic database.
+
+INDEXES lists every index the API relies on; `reconcile` runs at startup and
+creates what is missing, rebuilds indexes whose definition changed and drops
+the ones listed in RETIRED_INDEXES (superseded by a compound index). Indexes
+not mentioned here, such as ones added by hand by an operator, are left alone.
+
+QUERY_SHAPES mirrors the filters and sorts the endpoints issue. `find_collscans`
+explains each one and reports any that would scan a whole collection; run it
+against a database after schema or query changes:
+
+    python indexes.py --check            # uses MONGO_URL / DB_NAME from .env
+
+tests/test_indexes.py runs the same check in a throwaway database.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_1", unique=True),
+    ],
+    "patients": [
+        IndexModel([("patient_id", ASCENDING)], name="patient_id_1", unique=True),
+        IndexModel([("last_name", ASCENDING)], name="last_name_1"),
+        IndexModel([("registered_at", ASCENDING)], name="registered_at_1"),
+        IndexModel([("quality.score", ASCENDING), ("patient_id", ASCENDING)], name="quality.score_1_patient_id_1"),
+        IndexModel([("quality.missing", ASCENDING)], name="quality.missing_1"),
+    ],
+    "visits": [
+        IndexModel([("visit_id", ASCENDING)], name="visit_id_1", unique=True),
+        IndexModel([("patient_id", ASCENDING), ("date", DESCENDING)], name="patient_id_1_date_-1"),
+        IndexModel([("at", ASCENDING)], name="at_1"),
+        IndexModel([("consultant_id", ASCENDING)], name="consultant_id_1"),
+        IndexModel([("treatment_ids", ASCENDING)], name="treatment_ids_1"),
+    ],
+    "queue": [
+        IndexModel([("date", ASCENDING), ("patient_id", ASCENDING)], name="date_1_patient_id_1"),
+        IndexModel([("date", ASCENDING), ("timestamp", ASCENDING)], name="date_1_timestamp_1"),
+        IndexModel([("at", ASCENDING)], name="at_1"),
+        IndexModel([("patient_id", ASCENDING), ("timestamp", ASCENDING)], name="patient_id_1_timestamp_1"),
+        IndexModel([("alert_flags", ASCENDING), ("at", DESCENDING)], name="alert_flags_1_at_-1"),
+    ],
+    "consents": [
+        IndexModel([("patient_id", ASCENDING), ("timestamp", DESCENDING)], name="patient_id_1_timestamp_-1"),
+        IndexModel([("alert_flags", ASCENDING), ("timestamp", DESCENDING)], name="alert_flags_1_timestamp_-1"),
+    ],
+    "audit_log": [
+        IndexModel([("timestamp", DESCENDING)], name="timestamp_-1"),
+        IndexModel([("patient_id", ASCENDING), ("timestamp", DESCENDING)], name="patient_id_1_timestamp_-1"),
+    ],
+    "login_audit": [
+        IndexModel([("timestamp", DESCENDING)], name="timestamp_-1"),
+    ],
+    "backups": [
+        IndexModel([("backup_id", ASCENDING)], name="backup_id_1", unique=True),
+        IndexModel([("created_at", DESCENDING)], name="created_at_-1"),
+        IndexModel([("created_by", ASCENDING), ("created_at", DESCENDING)], name="created_by_1_created_at_-1"),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_1_created_at_1"),
+    ],
+    "backup_chunks": [
+        IndexModel([("backup_id", ASCENDING), ("collection", ASCENDING), ("seq", ASCENDING)],
+                   name="backup_id_1_collection_1_seq_1", unique=True),
+    ],
+    "settings": [
+        IndexModel([("type", ASCENDING)], name="type_1"),
+    ],
+    "revisions": [
+        IndexModel([("key", ASCENDING)], name="key_1", unique=True),
+    ],
+    "cohorts": [
+        IndexModel([("cohort", ASCENDING)], name="cohort_1", unique=True),
+    ],
+    "visit_buckets": [
+        IndexModel([("day", ASCENDING)], name="day_1", unique=True),
+    ],
+    "queue_buckets": [
+        IndexModel([("day", ASCENDING)], name="day_1", unique=True),
+    ],
+    "quality_counters": [
+        IndexModel([("key", ASCENDING)], name="key_1", unique=True),
+        IndexModel([("kind", ASCENDING), ("count", DESCENDING)], name="kind_1_count_-1"),
+    ],
+    "treatments": [
+        IndexModel([("id", ASCENDING)], name="id_1", unique=True),
+        IndexModel([("keys", ASCENDING)], name="keys_1", unique=True),
+    ],
+    "consultants": [
+        IndexModel([("id", ASCENDING)], name="id_1", unique=True),
+        IndexModel([("keys", ASCENDING)], name="keys_1", unique=True),
+    ],
+    "catalog_counters": [
+        IndexModel([("catalog", ASCENDING)], name="catalog_1", unique=True),
+    ],
+    "duplicate_dismissals": [
+        IndexModel([("pair", ASCENDING)], name="pair_1", unique=True),
+    ],
+    "deletion_tasks": [
+        IndexModel([("task_id", ASCENDING)], name="task_id_1", unique=True),
+        IndexModel([("status", ASCENDING), ("requested_at", ASCENDING)], name="status_1_requested_at_1"),
+        IndexModel([("requested_at", DESCENDING)], name="requested_at_-1"),
+    ],
+    "job_runs": [
+        IndexModel([("run_id", ASCENDING)], name="run_id_1"),
+        IndexModel([("job", ASCENDING), ("started_at", DESCENDING)], name="job_1_started_at_-1"),
+        IndexModel([("started_at", ASCENDING)], name="started_at_1"),
+    ],
+}
+
+# Indexes made redundant by a compound index with the same prefix, or by a newer field
+RETIRED_INDEXES = {
+    "visits": ["patient_id_1", "date_1", "consultant_1"],
+    "consents": ["patient_id_1"],
+}
+
+PERIOD_START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+PERIOD_END = datetime(2025, 2, 1, tzinfo=timezone.utc)
+
+# (description, collection, filter, sort) for every query an endpoint or job issues
+# on a collection that grows. Full exports and backups read everything by design
+# and are not listed.
+QUERY_SHAPES = [
+    ("login / user lookup", "users", {"username": "ADMIN"}, None),
+    ("patient by id", "patients", {"patient_id": "X"}, None),
+    ("patient list / dashboard", "patients", {}, {"last_name": 1}),
+    ("new registrations in period", "patients", {"registered_at": {"$gte": "2025-01-01"}}, None),
+    ("worst data quality first", "patients", {}, {"quality.score": 1, "patient_id": 1}),
+    ("patients missing a field", "patients", {"quality.missing": "email"}, None),
+    ("visit by id", "visits", {"visit_id": "X"}, None),
+    ("visit history", "visits", {"patient_id": "X"}, {"date": -1}),
+    ("visits in report period", "visits", {"at": {"$gte": PERIOD_START, "$lt": PERIOD_END}}, None),
+    ("today's queue", "queue", {"date": "2025-01-01", "status": {"$ne": "DONE"}}, {"timestamp": 1}),
+    ("queue entry of patient", "queue", {"patient_id": "X", "date": "2025-01-01"}, None),
+    ("queue in report period", "queue", {"at": {"$gte": PERIOD_START, "$lt": PERIOD_END}}, None),
+    ("queue rows of patient", "queue", {"patient_id": "X", "timestamp": {"$lt": "2025-01-01"}}, None),
+    ("queue days of patient", "queue", {"patient_id": "X"}, None),
+    ("queue rows of merged patients", "queue", {"patient_id": {"$in": ["X", "Y"]}}, None),
+    ("check-ins with a flag in period", "queue", {"alert_flags": "fever", "at": {"$gte": PERIOD_START, "$lt": PERIOD_END}}, {"at": -1}),
+    ("flagged check-ins in period", "queue", {"at": {"$gte": PERIOD_START, "$lt": PERIOD_END}, "alert_flags.0": {"$exists": True}}, None),
+    ("patient alert history", "queue", {"patient_id": "X", "alert_flags.0": {"$exists": True}}, {"timestamp": -1}),
+    ("consents declaring a flag", "consents", {"alert_flags": "fever", "timestamp": {"$gte": "2025-01-01", "$lt": "2025-02-01"}}, None),
+    ("patient declared alerts", "consents", {"patient_id": "X", "alert_flags.0": {"$exists": True}}, {"timestamp": -1}),
+    ("queue of listed days", "queue", {"date": {"$in": ["2025-01-01"]}}, None),
+    ("patient consents", "consents", {"patient_id": "X"}, {"timestamp": -1}),
+    ("system audit", "audit_log", {}, {"timestamp": -1}),
+    ("patient audit", "audit_log", {"patient_id": "X"}, {"timestamp": -1}),
+    ("patient audit before cutoff", "audit_log", {"patient_id": "X", "timestamp": {"$lt": "2025-01-01"}}, None),
+    ("patient consents before cutoff", "consents", {"patient_id": "X", "timestamp": {"$lt": "2025-01-01"}}, None),
+    ("patient visits before cutoff", "visits", {"patient_id": "X", "at": {"$lt": PERIOD_END}}, None),
+    ("login audit", "login_audit", {}, {"timestamp": -1}),
+    ("backup list", "backups", {}, {"created_at": -1}),
+    ("backup by id", "backups", {"backup_id": "X"}, None),
+    ("automatic backups", "backups", {"created_by": "SYSTEM_AUTO", "status": "complete"}, {"created_at": -1}),
+    ("newest complete backup", "backups", {"status": "complete"}, {"created_at": -1}),
+    ("stale backup writes", "backups", {"status": "writing", "created_at": {"$lt": "2025-01-01"}}, None),
+    ("backup payload of a collection", "backup_chunks", {"backup_id": "X", "collection": "visits"}, {"seq": 1}),
+    ("backup payload", "backup_chunks", {"backup_id": "X"}, None),
+    ("kiosk settings", "settings", {"type": "kiosk"}, None),
+    ("revision token", "revisions", {"key": "patient:X"}, None),
+    ("cohort matrix", "cohorts", {"cohort": {"$gte": "2025-01"}}, {"cohort": 1}),
+    ("visit buckets in period", "visit_buckets", {"day": {"$gte": PERIOD_START, "$lt": PERIOD_END}}, {"day": 1}),
+    ("queue buckets in period", "queue_buckets", {"day": {"$gte": PERIOD_START, "$lt": PERIOD_END}}, {"day": 1}),
+    ("visit bucket of a day", "visit_buckets", {"day": PERIOD_START}, None),
+    ("data quality totals", "quality_counters", {"key": "totals"}, None),
+    ("duplicate contact keys", "quality_counters", {"kind": "email", "count": {"$gte": 2}}, {"count": -1}),
+    ("catalog entry by id", "treatments", {"id": 1}, None),
+    ("catalog entry by name or alias", "consultants", {"keys": "dr smith"}, None),
+    ("catalog sequence", "catalog_counters", {"catalog": "treatments"}, None),
+    ("visits of a treatment", "visits", {"treatment_ids": 1}, None),
+    ("visits of a consultant", "visits", {"consultant_id": 1}, None),
+    ("dismissed duplicate pair", "duplicate_dismissals", {"pair": "X|Y"}, None),
+    ("claim deletion task", "deletion_tasks", {"$or": [
+        {"status": "queued"}, {"status": "running", "heartbeat_at": {"$lt": PERIOD_START}}
+    ]}, {"requested_at": 1}),
+    ("deletion task by id", "deletion_tasks", {"task_id": "X"}, None),
+    ("recent deletion tasks", "deletion_tasks", {}, {"requested_at": -1}),
+    ("job run history", "job_runs", {"job": "auto_backup"}, {"started_at": -1}),
+    ("job run by id", "job_runs", {"run_id": "X"}, None),
+    ("job history cleanup", "job_runs", {"started_at": {"$lt": "2025-01-01"}, "status": {"$ne": "running"}}, None),
+]
+
+
+def _same_definition(model: IndexModel, existing: dict) -> bool:
+    spec = model.document
+    wanted = [(field, int(direction)) for field, direction in spec["key"].items()]
+    current = [(field, int(direction)) for field, direction in existing["key"]]
+    return wanted == current and bool(spec.get("unique")) == bool(existing.get("unique"))
+
+
+async def reconcile(db) -> dict:
+    """Bring the database's indexes in line with INDEXES; returns what changed"""
+    changes = {"created": [], "rebuilt": [], "dropped": [], "failed": []}
+    for collection_name in sorted(set(INDEXES) | set(RETIRED_INDEXES)):
+        collection = db[collection_name]
+        existing = await collection.index_information()
+
+        for model in INDEXES.get(collection_name, []):
+            name = model.document["name"]
+            label = f"{collection_name}.{name}"
+            current = existing.get(name)
+            if current and _same_definition(model, current):
+                continue
+            if current:
+                await collection.drop_index(name)
+            try:
+                await collection.create_indexes([model])
+            except OperationFailure as e:
+                # e.g. a unique index over data that already holds duplicates
+                logger.error(f"Could not build index {label}: {e}")
+                changes["failed"].append({"index": label, "error": str(e)})
+                if current:
+                    # Keep the old definition rather than leave the field unindexed
+                    await collection.create_indexes([IndexModel(list(current["key"]), name=name, unique=bool(current.get("unique")))])
+                continue
+            changes["rebuilt" if current else "created"].append(label)
+
+        # Retire superseded indexes only once their replacements exist
+        for name in RETIRED_INDEXES.get(collection_name, []):
+            if name in existing:
+                await collection.drop_index(name)
+                changes["dropped"].append(f"{collection_name}.{name}")
+
+    for kind in ("created", "rebuilt", "dropped"):
+        if changes[kind]:
+            logger.info(f"Indexes {kind}: {', '.join(changes[kind])}")
+    return changes
+
+
+def _stages(plan: dict):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if isinstance(plan.get(key), dict):
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+async def explain_shape(db, collection: str, query: dict, sort: dict = None) -> list:
+    """Stages of the winning plan for one query shape"""
+    command = {"find": collection, "filter": query}
+    if sort:
+        command["sort"] = sort
+    result = await db.command({"explain": command, "verbosity": "queryPlanner"})
+    planner = result.get("queryPlanner", {})
+    return list(_stages(planner.get("winningPlan", {})))
+
+
+async def find_collscans(db, shapes=QUERY_SHAPES) -> list:
+    """Descriptions of the query shapes whose winning plan is a collection scan"""
+    scans = []
+    for description, collection, query, sort in shapes:
+        stages = await explain_shape(db, collection, query, sort)
+        if "COLLSCAN" in stages:
+            scans.append({"query": description, "collection": collection, "stages": stages})
+    return scans
+
+
+async def main(args) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / ".env")
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[args.db_name or os.environ["DB_NAME"]]
+
+    changes = await reconcile(db)
+    print(f"created {len(changes['created'])}, rebuilt {len(changes['rebuilt'])}, "
+          f"dropped {len(changes['dropped'])}, failed {len(changes['failed'])}")
+    status = 1 if changes["failed"] else 0
+    if args.check:
+        scans = await find_collscans(db)
+        for scan in scans:
+            print(f"COLLSCAN: {scan['query']} on {scan['collection']} ({' <- '.join(filter(None, scan['stages']))})")
+        print(f"{len(QUERY_SHAPES) - len(scans)}/{len(QUERY_SHAPES)} query shapes use an index")
+        status = status or (1 if scans else 0)
+    client.close()
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile indexes and check query plans")
+    parser.add_argument("--check", action="store_true", help="fail if any known query shape scans a collection")
+    parser.add_argument("--db-name", help="database to use instead of DB_NAME")
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,288 @@
+"""Lightweight scheduled-job runner for the clinic API.
+
+Jobs are registered with a cron-like schedule (UTC) and an async callable.
+Every uvicorn worker runs the same scheduler loop, but a job only runs where
+it wins a lease in the `job_locks` collection:
+
+* a scheduled run claims the lock for its schedule slot, so each slot runs
+  once across all workers even if their clocks tick at slightly different
+  times;
+* the lease expires after `lock_ttl` seconds unless the running worker renews
+  it, so a crashed worker never blocks a job for good.
+
+Every run (scheduled or manual) is recorded in `job_runs` with its duration,
+outcome and whatever small dict the job returned.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+}
+
+# (low, high) of minute, hour, day of month, month, day of week (0 = Sunday)
+FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+# Never sleep longer than this between checks, so new runs and clock changes are picked up
+MAX_TICK_SECONDS = 60
+
+
+class JobAlreadyRunning(Exception):
+    """Raised when a manual run is requested while another worker holds the job's lease"""
+
+
+class CronSchedule:
+    """Five-field cron expression (minute hour day month weekday) evaluated in UTC.
+
+    Supports '*', lists, ranges and steps ("*/15", "1-5", "0,30") and the
+    @hourly/@daily/@weekly/@monthly aliases. As in cron, when both day of
+    month and day of week are restricted a day matches either of them.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression!r}")
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, FIELD_RANGES)
+        )
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int) -> frozenset:
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_text = part.split("/", 1)
+                step = int(step_text)
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(v) for v in part.split("-", 1))
+            else:
+                start = end = int(part)
+                if step != 1:
+                    end = high
+            if high == 6:
+                # Day of week: accept 7 as Sunday
+                start, end = min(start, 7), min(end, 7)
+            if start < low or end > (7 if high == 6 else high) or start > end or step < 1:
+                raise ValueError(f"Invalid cron field {field!r}")
+            values.update(v % 7 if high == 6 else v for v in range(start, end + 1, step))
+        return frozenset(values)
+
+    def _day_matches(self, dt: datetime) -> bool:
+        in_month = dt.day in self.days
+        in_week = (dt.isoweekday() % 7) in self.weekdays
+        if self.any_day:
+            return in_week
+        if self.any_weekday:
+            return in_month
+        return in_month or in_week
+
+    def next_after(self, after: datetime) -> datetime:
+        """First matching minute strictly after `after` (aware UTC datetime)"""
+        dt = after.astimezone(timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError(f"Cron expression never fires: {self.expression!r}")
+
+
+class Job:
+    def __init__(self, name: str, schedule: Optional[str], func: Callable[[], Awaitable[Optional[dict]]],
+                 lock_ttl: int, description: str):
+        self.name = name
+        self.schedule = CronSchedule(schedule) if schedule else None
+        self.func = func
+        self.lock_ttl = lock_ttl
+        self.description = description
+        self.next_run: Optional[datetime] = None
+
+
+class JobScheduler:
+    def __init__(self, db, owner: Optional[str] = None):
+        self.db = db
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.jobs: Dict[str, Job] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.running_tasks = set()
+
+    def register(self, name: str, schedule: Optional[str], func, lock_ttl: int = 900, description: str = ""):
+        """Register an async job; schedule=None makes it manual-only"""
+        self.jobs[name] = Job(name, schedule, func, lock_ttl, description)
+
+    @property
+    def alive(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    async def start(self):
+        now = datetime.now(timezone.utc)
+        for job in self.jobs.values():
+            if job.schedule:
+                job.next_run = job.schedule.next_after(now)
+                logger.info(f"Job {job.name} scheduled ({job.schedule.expression}), next run {job.next_run.isoformat()}")
+        self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+        for task in list(self.running_tasks):
+            task.cancel()
+
+    async def _loop(self):
+        metrics.registry.set(metrics.task_running, 1, task="scheduler")
+        try:
+            while True:
+                now = datetime.now(timezone.utc)
+                for job in self.jobs.values():
+                    if job.next_run and now >= job.next_run:
+                        slot = job.next_run
+                        job.next_run = job.schedule.next_after(now)
+                        self._spawn(self._run_scheduled(job, slot))
+                pending = [j.next_run for j in self.jobs.values() if j.next_run]
+                wait = min([(t - now).total_seconds() for t in pending] + [MAX_TICK_SECONDS])
+                await asyncio.sleep(max(wait, 1))
+        finally:
+            metrics.registry.set(metrics.task_running, 0, task="scheduler")
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.running_tasks.add(task)
+        task.add_done_callback(self.running_tasks.discard)
+        return task
+
+    # ------------------------------------------------------------------
+    # Lease lock
+    # ------------------------------------------------------------------
+
+    async def acquire(self, job: Job, slot: Optional[str] = None) -> bool:
+        """Take the job's lease; with a slot, only if that slot has not been claimed yet"""
+        now = datetime.now(timezone.utc)
+        conditions = [{"$or": [{"expires_at": {"$lte": now.isoformat()}}, {"expires_at": {"$exists": False}}]}]
+        update = {"owner": self.owner, "acquired_at": now.isoformat(),
+                  "expires_at": (now + timedelta(seconds=job.lock_ttl)).isoformat()}
+        if slot:
+            conditions.append({"$or": [{"last_slot": {"$lt": slot}}, {"last_slot": {"$exists": False}}]})
+            update["last_slot"] = slot
+        try:
+            lock = await self.db.job_locks.find_one_and_update(
+                {"_id": job.name, "$and": conditions},
+                {"$set": update},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # The lock document exists but another worker holds it (or already ran this slot)
+            return False
+        return lock is not None and lock.get("owner") == self.owner
+
+    async def release(self, job: Job):
+        await self.db.job_locks.update_one(
+            {"_id": job.name, "owner": self.owner},
+            {"$set": {"expires_at": datetime.now(timezone.utc).isoformat()}}
+        )
+
+    async def _renew(self, job: Job):
+        while True:
+            await asyncio.sleep(job.lock_ttl / 3)
+            expires = datetime.now(timezone.utc) + timedelta(seconds=job.lock_ttl)
+            await self.db.job_locks.update_one(
+                {"_id": job.name, "owner": self.owner}, {"$set": {"expires_at": expires.isoformat()}}
+            )
+
+    # ------------------------------------------------------------------
+    # Running
+    # ------------------------------------------------------------------
+
+    async def _run_scheduled(self, job: Job, slot: datetime):
+        if not await self.acquire(job, slot.isoformat()):
+            logger.info(f"Job {job.name} slot {slot.isoformat()} taken by another worker")
+            return
+        await self._execute(job, "schedule", str(uuid.uuid4()))
+
+    async def run_now(self, name: str, user: str) -> str:
+        """Start a manual run in the background and return its run_id"""
+        job = self.jobs[name]
+        if not await self.acquire(job):
+            raise JobAlreadyRunning(name)
+        run_id = str(uuid.uuid4())
+        self._spawn(self._execute(job, f"manual:{user}", run_id))
+        return run_id
+
+    async def _execute(self, job: Job, trigger: str, run_id: str):
+        started = time.time()
+        started_at = datetime.now(timezone.utc)
+        await self.db.job_runs.insert_one({
+            "run_id": run_id, "job": job.name, "trigger": trigger, "owner": self.owner,
+            "started_at": started_at.isoformat(), "status": "running"
+        })
+        renewer = asyncio.create_task(self._renew(job))
+        outcome = {"status": "success"}
+        try:
+            result = await job.func()
+            if result:
+                outcome["result"] = result
+        except Exception as e:
+            outcome = {"status": "failed", "error": str(e) or type(e).__name__}
+            logger.error(f"Job {job.name} failed: {e}")
+        finally:
+            renewer.cancel()
+            await self.release(job)
+        metrics.record_task_run(job.name, started, ok=outcome["status"] == "success")
+        await self.db.job_runs.update_one({"run_id": run_id}, {"$set": {
+            **outcome,
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round((time.time() - started) * 1000)
+        }})
+        logger.info(f"Job {job.name} {outcome['status']} in {time.time() - started:.1f}s ({trigger})")
+
+    # ------------------------------------------------------------------
+    # Introspection
+    # ------------------------------------------------------------------
+
+    async def describe(self) -> list:
+        locks = {lock["_id"]: lock async for lock in self.db.job_locks.find({"_id": {"$in": list(self.jobs)}})}
+        now = datetime.now(timezone.utc).isoformat()
+        jobs = []
+        for job in self.jobs.values():
+            last = await self.db.job_runs.find_one({"job": job.name}, {"_id": 0}, sort=[("started_at", -1)])
+            lock = locks.get(job.name, {})
+            jobs.append({
+                "name": job.name,
+                "description": job.description,
+                "schedule": job.schedule.expression if job.schedule else None,
+                "next_run": job.next_run.isoformat() if job.next_run else None,
+                "running": lock.get("expires_at", "") > now,
+                "lock_owner": lock.get("owner"),
+                "last_run": last
+            })
+        return jobs
@@ -0,0 +1,280 @@
+"""In-process metrics for the clinic API, rendered in Prometheus text format.
+
+Kept dependency-free: a small registry of counters, gauges and histograms,
+an ASGI middleware for per-route latency, a pymongo command listener for
+per-collection Mongo timings and a pool listener for connection checkouts.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+from pymongo import monitoring
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, str]) -> LabelSet:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: LabelSet, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets=HTTP_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+        series["counts"][bisect_left(self.buckets, value)] += 1
+        series["sum"] += value
+        series["count"] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(key, ('le', _format_value(float(bound))))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(key)} {series['sum']}"
+            yield f"{self.name}_count{_format_labels(key)} {series['count']}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.series = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        self.series[_labels(labels)] += amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, value in sorted(self.series.items()):
+            yield f"{self.name}{_format_labels(key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self.series[_labels(labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.series[_labels(labels)] -= amount
+
+
+class MetricsRegistry:
+    """Holds every metric; safe to update from motor's executor threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get(self, cls, name, help_text, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help_text, **kwargs)
+            return metric
+
+    def histogram(self, name: str, help_text: str, buckets=HTTP_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help_text, buckets=buckets)
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._get(Gauge, name, help_text)
+
+    def observe(self, metric: Histogram, value: float, **labels):
+        with self.lock:
+            metric.observe(value, **labels)
+
+    def inc(self, metric: Counter, amount: float = 1, **labels):
+        with self.lock:
+            metric.inc(amount, **labels)
+
+    def set(self, metric: Gauge, value: float, **labels):
+        with self.lock:
+            metric.set(value, **labels)
+
+    def render(self) -> str:
+        with self.lock:
+            lines = [line for metric in self.metrics.values() for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_latency = registry.histogram("http_request_duration_seconds", "HTTP request latency by route template")
+http_in_flight = registry.gauge("http_requests_in_flight", "Requests currently being handled")
+mongo_latency = registry.histogram("mongo_command_duration_seconds", "MongoDB command latency by collection", MONGO_BUCKETS)
+mongo_failures = registry.counter("mongo_command_failures_total", "MongoDB commands that returned an error")
+task_runs = registry.counter("background_task_runs_total", "Background task runs by outcome")
+task_duration = registry.histogram("background_task_duration_seconds", "Background task run time", (1, 5, 15, 30, 60, 120, 300, 600, 1800))
+task_last_success = registry.gauge("background_task_last_success_timestamp_seconds", "Unix time of the last successful run")
+task_running = registry.gauge("background_task_alive", "1 while the background task loop is running")
+pool_wait = registry.histogram("mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled Mongo connection", POOL_WAIT_BUCKETS)
+pool_checkouts = registry.counter("mongo_pool_checkouts_total", "Mongo connection checkouts by outcome")
+pool_in_use = registry.gauge("mongo_pool_connections_in_use", "Mongo connections currently checked out")
+pool_open = registry.gauge("mongo_pool_connections_open", "Mongo connections currently open")
+pool_max_size = registry.gauge("mongo_pool_max_size", "Configured maxPoolSize per server")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency per route template and in-flight requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        registry.inc(http_in_flight, 1)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            registry.inc(http_in_flight, -1)
+            route = scope.get("route")
+            # Route templates keep label cardinality bounded (no patient ids)
+            path = getattr(route, "path", None) or "unmatched"
+            registry.observe(
+                http_latency, time.perf_counter() - start,
+                method=scope["method"], route=path, status=str(status["code"])
+            )
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times every Mongo command, labelled by command name and collection"""
+
+    def __init__(self):
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else "-"
+        with self.pending_lock:
+            self.pending[(event.request_id, event.connection_id)] = collection
+
+    def _finish(self, event):
+        with self.pending_lock:
+            collection = self.pending.pop((event.request_id, event.connection_id), "-")
+        registry.observe(
+            mongo_latency, event.duration_micros / 1_000_000,
+            command=event.command_name, collection=collection
+        )
+        return collection
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        collection = self._finish(event)
+        registry.inc(mongo_failures, command=event.command_name, collection=collection)
+
+
+def record_task_run(name: str, started: float, ok: bool):
+    """Record one run of a background task started at time.time() value `started`"""
+    now = time.time()
+    registry.inc(task_runs, task=name, outcome="success" if ok else "failure")
+    registry.observe(task_duration, now - started, task=name)
+    if ok:
+        registry.set(task_last_success, now, task=name)
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """Checkout wait times and connection counts, for sizing maxPoolSize"""
+
+    def __init__(self):
+        # pymongo emits check-out started and checked-out on the same (executor) thread
+        self.local = threading.local()
+
+    def _address(self, event):
+        return "%s:%s" % event.address
+
+    def connection_check_out_started(self, event):
+        self.local.started = time.perf_counter()
+
+    def _waited(self, event):
+        started = getattr(self.local, "started", None)
+        self.local.started = None
+        if started is not None:
+            registry.observe(pool_wait, time.perf_counter() - started, server=self._address(event))
+
+    def connection_checked_out(self, event):
+        self._waited(event)
+        registry.inc(pool_checkouts, server=self._address(event), outcome="ok")
+        registry.inc(pool_in_use, 1, server=self._address(event))
+
+    def connection_check_out_failed(self, event):
+        # reason is "timeout" when the wait queue timed out, "connectionError" or "poolClosed"
+        self._waited(event)
+        registry.inc(pool_checkouts, server=self._address(event), outcome=str(event.reason))
+
+    def connection_checked_in(self, event):
+        registry.inc(pool_in_use, -1, server=self._address(event))
+
+    def connection_created(self, event):
+        registry.inc(pool_open, 1, server=self._address(event))
+
+    def connection_closed(self, event):
+        registry.inc(pool_open, -1, server=self._address(event))
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
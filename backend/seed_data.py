@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""Deterministic synthetic clinic data for scale testing.
+
+Generates patients (with realistic gaps, duplicates and messy cities), visits
+following weekday/hour-of-day patterns, queue histories with alerts and
+consent records with signature payloads, and bulk-loads them straight into
+Mongo. The same --seed always produces the same clinic.
+
+Examples:
+    python seed_data.py --db-name just_vitality_scale --patients 50000 --years 3
+    python seed_data.py --db-name just_vitality_scale --patients 100000 --signature-size 500
+
+The target database is dropped first unless --append is given.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+FIRST_NAMES = [
+    "OLIVER", "GEORGE", "HARRY", "JACK", "JACOB", "NOAH", "CHARLIE", "THOMAS", "OSCAR", "WILLIAM",
+    "JAMES", "ADAM", "PIOTR", "JAN", "TOMASZ", "KRZYSZTOF", "MARCIN", "RAJ", "ARJUN", "MOHAMMED",
+    "OLIVIA", "AMELIA", "ISLA", "AVA", "EMILY", "SOPHIA", "GRACE", "MIA", "POPPY", "ELLA",
+    "ANNA", "KATARZYNA", "MAGDALENA", "AGNIESZKA", "EWA", "PRIYA", "AISHA", "FATIMA", "CHLOE", "LUCY",
+]
+# Spelling variants used when generating duplicate registrations of the same person
+NAME_VARIANTS = {
+    "JON": "JOHN", "JOHN": "JON", "KATARZYNA": "KASIA", "THOMAS": "TOM", "WILLIAM": "BILL",
+    "MOHAMMED": "MUHAMMAD", "SOPHIA": "SOFIA", "PIOTR": "PETER", "ANNA": "ANA", "LUCY": "LUCIE",
+}
+LAST_NAMES = [
+    "SMITH", "JONES", "TAYLOR", "BROWN", "WILLIAMS", "WILSON", "JOHNSON", "DAVIES", "ROBINSON", "WRIGHT",
+    "THOMPSON", "EVANS", "WALKER", "WHITE", "ROBERTS", "GREEN", "HALL", "WOOD", "JACKSON", "CLARKE",
+    "NOWAK", "KOWALSKI", "WISNIEWSKI", "WOJCIK", "KOWALCZYK", "KAMINSKI", "LEWANDOWSKI", "ZIELINSKI",
+    "PATEL", "SHAH", "KHAN", "ALI", "SINGH", "O'BRIEN", "MCDONALD", "SMITH-JONES",
+]
+# city -> (weight, postcode outward codes)
+CITIES = {
+    "Reading": (30, ["RG1", "RG2", "RG4", "RG6", "RG30", "RG31"]),
+    "Wokingham": (12, ["RG40", "RG41"]),
+    "Bracknell": (10, ["RG12", "RG42"]),
+    "Slough": (10, ["SL1", "SL2", "SL3"]),
+    "Maidenhead": (8, ["SL6"]),
+    "Windsor": (6, ["SL4"]),
+    "London": (12, ["W5", "SW19", "N1", "E14", "SE10"]),
+    "Oxford": (5, ["OX1", "OX2", "OX4"]),
+    "High Wycombe": (4, ["HP10", "HP11", "HP13"]),
+    "Newbury": (3, ["RG14"]),
+}
+TREATMENTS = {
+    "IV Vitamin Drip": 25, "B12 Injection": 22, "Hydration Drip": 12, "Vitamin D Injection": 10,
+    "NAD+ Infusion": 7, "Glutathione Drip": 7, "Myers Cocktail": 6, "Immunity Boost": 5,
+    "Blood Test": 4, "Consultation": 2,
+}
+CONSULTANTS = {"Dr Sarah Mitchell": 30, "Nurse Emma Clarke": 28, "Dr Raj Patel": 22, "Nurse Tom Baker": 15, "Locum": 5}
+ALERTS = {"Pregnant": 3, "Diabetes": 8, "Blood thinners": 6, "Epilepsy": 2, "Pacemaker": 1,
+          "Needle phobia": 7, "Fainting history": 5, "Latex allergy": 3, "Kidney disease": 2}
+REASONS = ["Tiredness", "Immunity", "Hangover", "Sports recovery", "Skin health", "Routine top-up", "Stress", "Jet lag"]
+ALLERGIES = ["NKDA"] * 17 + ["Penicillin", "Latex", "Nuts"]
+MEDICATIONS = [""] * 6 + ["Metformin", "Levothyroxine", "Sertraline", "Warfarin", "Contraceptive pill", "Ramipril"]
+CONDITIONS = [""] * 6 + ["Type 2 diabetes", "Hypothyroidism", "Asthma", "Hypertension", "Anxiety"]
+
+# Monday..Sunday and 08:00..19:00 relative demand
+WEEKDAY_WEIGHTS = [1.0, 1.15, 1.2, 1.1, 1.3, 0.8, 0.15]
+HOUR_WEIGHTS = {8: 0.4, 9: 0.9, 10: 1.3, 11: 1.4, 12: 1.0, 13: 0.8, 14: 0.9, 15: 1.0, 16: 1.2, 17: 1.4, 18: 1.0, 19: 0.4}
+
+BATCH_SIZE = 5000
+
+
+def _weighted(table: dict):
+    return list(table), list(table.values())
+
+
+def generate_patient_id(first_name: str, last_name: str, dob: str) -> str:
+    # Mirrors server.generate_patient_id without importing the app
+    def normalize(s):
+        return ''.join(c for c in s.upper() if c.isalnum())
+    return f"{normalize(last_name)}-{normalize(first_name)}-{dob}"
+
+
+def fake_signature(rng: random.Random, size: int) -> str:
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+    return "data:image/png;base64,iVBORw0KGgo" + "".join(rng.choices(alphabet, k=max(0, size)))
+
+
+class ClinicGenerator:
+    """Yields (collection, document) pairs for a whole synthetic clinic from one seed"""
+
+    def __init__(self, patients: int, years: int, seed: int = 42, now: datetime = None,
+                 duplicate_rate: float = 0.03, missing_rate: float = 0.08, visits_per_year: float = 2.5,
+                 signature_size: int = 1500, today_queue: int = 25):
+        self.patients = patients
+        self.years = years
+        self.rng = random.Random(seed)
+        self.now = (now or datetime.now(timezone.utc)).replace(microsecond=0)
+        self.start = self.now - timedelta(days=365 * years)
+        self.duplicate_rate = duplicate_rate
+        self.missing_rate = missing_rate
+        self.visits_per_year = visits_per_year
+        self.signature_size = signature_size
+        self.today_queue = today_queue
+        self.treatments = _weighted(TREATMENTS)
+        self.consultants = _weighted(CONSULTANTS)
+        self.alerts = _weighted(ALERTS)
+        self.cities = _weighted({city: weight for city, (weight, _) in CITIES.items()})
+        self.hours = _weighted(HOUR_WEIGHTS)
+        # Signatures are expensive to generate, so reuse a small pool
+        self.signatures = [fake_signature(self.rng, signature_size) for _ in range(16)]
+        self.seen_ids = set()
+        self.patient_ids = []
+
+    def maybe_blank(self, value: str) -> str:
+        return "" if self.rng.random() < self.missing_rate else value
+
+    def clinic_day(self, after: datetime) -> datetime:
+        """A random opening-hours timestamp after `after`, following weekday and hour demand"""
+        rng = self.rng
+        span = max(1, (self.now - after).days)
+        while True:
+            day = after + timedelta(days=rng.randrange(span))
+            if rng.random() * 1.3 <= WEEKDAY_WEIGHTS[day.weekday()]:
+                break
+        hour = rng.choices(*self.hours)[0]
+        return min(self.now, day.replace(hour=hour, minute=rng.randrange(60), second=rng.randrange(60)))
+
+    def make_patient(self, index: int, template: dict = None) -> dict:
+        rng = self.rng
+        if template:
+            # Same person registering again: a name variant or a mistyped DOB, same contact details
+            first = NAME_VARIANTS.get(template["first_name"], template["first_name"])
+            dob = template["dob"]
+            if first == template["first_name"]:
+                y, m, d = dob.split("-")
+                dob = f"{y}-{d if int(d) <= 12 else m}-{m if int(d) <= 12 else d}"
+                if dob == template["dob"]:
+                    dob = f"{int(y) + 1}-{m}-{d}"
+            patient = {**template, "first_name": first, "dob": dob}
+        else:
+            city = rng.choices(*self.cities)[0]
+            age = min(85, max(18, int(rng.gauss(42, 13))))
+            dob = f"{self.now.year - age}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+            first = rng.choice(FIRST_NAMES)
+            last = rng.choice(LAST_NAMES)
+            outward = rng.choice(CITIES[city][1])
+            handle = f"{first}.{last}".lower().replace("'", "")
+            patient = {
+                "first_name": first,
+                "last_name": last,
+                "dob": dob,
+                "phone": self.maybe_blank(f"07{rng.randint(100000000, 999999999)}"),
+                "email": self.maybe_blank(f"{handle}{rng.randint(1, 999)}@example.com"),
+                "street": self.maybe_blank(f"{rng.randint(1, 250)} {rng.choice(['High', 'Station', 'Church', 'London', 'Park'])} Road"),
+                # Free-text cities arrive in every casing and with stray spaces
+                "city": self.maybe_blank(rng.choice([city, city.upper(), city.lower(), f"{city} "])),
+                "postcode": self.maybe_blank(f"{outward} {rng.randint(1, 9)}{rng.choice('ABDEFGHJLNPQRSTUWXYZ')}{rng.choice('ABDEFGHJLNPQRSTUWXYZ')}"),
+                "emergency_name": self.maybe_blank(f"{rng.choice(FIRST_NAMES)} {last}"),
+                "emergency_phone": self.maybe_blank(f"07{rng.randint(100000000, 999999999)}"),
+                "reason": "",
+                "medications": rng.choice(MEDICATIONS),
+                "allergies": rng.choice(ALLERGIES),
+                "conditions": rng.choice(CONDITIONS),
+                "surgeries": "",
+                "procedures": "",
+            }
+        patient["patient_id"] = generate_patient_id(patient["first_name"], patient["last_name"], patient["dob"])
+        if patient["patient_id"] in self.seen_ids:
+            # Common names collide; disambiguate the way a receptionist would, via the DOB day
+            patient["dob"] = f"{patient['dob'][:8]}{(index % 28) + 1:02d}"
+            patient["patient_id"] = generate_patient_id(patient["first_name"], patient["last_name"], patient["dob"])
+            if patient["patient_id"] in self.seen_ids:
+                patient["last_name"] = f"{patient['last_name']}{index}"
+                patient["patient_id"] = generate_patient_id(patient["first_name"], patient["last_name"], patient["dob"])
+        self.seen_ids.add(patient["patient_id"])
+        return patient
+
+    def generate(self):
+        rng = self.rng
+        previous = []
+        for index in range(self.patients):
+            template = None
+            if previous and rng.random() < self.duplicate_rate:
+                template = rng.choice(previous)
+            patient = self.make_patient(index, template)
+            if len(previous) < 5000:
+                previous.append(patient)
+            elif rng.random() < 0.01:
+                previous[rng.randrange(len(previous))] = patient
+
+            registered = self.clinic_day(self.start)
+            pid = patient["patient_id"]
+            self.patient_ids.append(pid)
+            patient_alerts = ", ".join(sorted({rng.choices(*self.alerts)[0] for _ in range(rng.choice([1, 1, 2]))})) \
+                if rng.random() < 0.2 else ""
+
+            # Heavy-tailed loyalty: most come once or twice, a few are regulars
+            remaining_years = max(0.1, (self.now - registered).days / 365)
+            loyalty = rng.paretovariate(2.0) - 0.6
+            visit_count = max(0, int(loyalty * self.visits_per_year * remaining_years))
+            if rng.random() < 0.15:
+                visit_count = 0  # registered but never treated
+            visit_times = sorted(self.clinic_day(registered) for _ in range(visit_count))
+            if visit_times:
+                visit_times[0] = registered  # first treatment on the day they registered
+
+            consultant = rng.choices(*self.consultants)[0]
+            for at in visit_times:
+                # Regulars mostly stick with one consultant
+                who = consultant if rng.random() < 0.7 else rng.choices(*self.consultants)[0]
+                yield "visits", {
+                    "visit_id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                    "patient_id": pid,
+                    "date": at.isoformat(),
+                    "at": at,
+                    "treatment": rng.choices(*self.treatments)[0],
+                    "notes": rng.choice(["", "", "Tolerated well", "Slight bruising", "Follow-up in 4 weeks"]),
+                    "consultant": who,
+                }
+                checked_in = at - timedelta(minutes=rng.randint(5, 40))
+                yield "queue", {
+                    "date": at.strftime("%Y-%m-%d"),
+                    "timestamp": checked_in.isoformat(),
+                    "at": checked_in,
+                    "patient_id": pid,
+                    "first_name": patient["first_name"],
+                    "last_name": patient["last_name"],
+                    "reason": rng.choice(REASONS),
+                    "alerts": patient_alerts,
+                    "status": "DONE",
+                }
+            # Occasional walk-outs who checked in but were never treated
+            if rng.random() < 0.05:
+                at = self.clinic_day(registered)
+                yield "queue", {
+                    "date": at.strftime("%Y-%m-%d"), "timestamp": at.isoformat(), "at": at, "patient_id": pid,
+                    "first_name": patient["first_name"], "last_name": patient["last_name"],
+                    "reason": rng.choice(REASONS), "alerts": patient_alerts, "status": "WAITING",
+                }
+
+            consent_times = [registered] + [t for t in visit_times[1:] if rng.random() < 0.1]
+            for at in consent_times:
+                yield "consents", {
+                    "patient_id": pid,
+                    "timestamp": at.isoformat(),
+                    "consent_data_processing": True,
+                    "consent_medical_disclaimer": True,
+                    "signature_data_processing": rng.choice(self.signatures),
+                    "signature_medical_disclaimer": rng.choice(self.signatures),
+                    "alerts_declared": patient_alerts,
+                    "conditions_declared": patient["conditions"],
+                    "medications_declared": patient["medications"],
+                    "allergies_declared": patient["allergies"],
+                    "reason_declared": rng.choice(REASONS),
+                }
+
+            yield "patients", {
+                **patient,
+                "registered_at": registered.isoformat(),
+                "updated_at": (visit_times[-1] if visit_times else registered).isoformat(),
+                "visit_count": len(visit_times),
+                **({
+                    "first_visit": visit_times[0].isoformat(), "last_visit": visit_times[-1].isoformat(),
+                    "visit_months": sorted({t.strftime("%Y-%m") for t in visit_times})
+                } if visit_times else {}),
+            }
+
+        # Today's waiting room
+        today = self.now.strftime("%Y-%m-%d")
+        for pid in rng.sample(self.patient_ids, min(self.today_queue, len(self.patient_ids))):
+            checked_in = self.now.replace(hour=9, minute=rng.randrange(60))
+            yield "queue", {
+                "date": today,
+                "timestamp": checked_in.isoformat(),
+                "at": checked_in,
+                "patient_id": pid, "first_name": "", "last_name": "",
+                "reason": rng.choice(REASONS), "alerts": rng.choice(["", "", "", "Diabetes", "Needle phobia"]),
+                "status": "WAITING",
+            }
+
+
+async def load_clinic(db, generator: ClinicGenerator, drop: bool = True, batch_size: int = BATCH_SIZE) -> dict:
+    """Bulk-insert everything the generator yields; returns per-collection counts"""
+    if drop:
+        await db.client.drop_database(db.name)
+    buffers = {"patients": [], "visits": [], "queue": [], "consents": []}
+    counts = dict.fromkeys(buffers, 0)
+
+    async def flush(name):
+        if buffers[name]:
+            await db[name].insert_many(buffers[name], ordered=False)
+            counts[name] += len(buffers[name])
+            buffers[name] = []
+
+    for name, doc in generator.generate():
+        buffers[name].append(doc)
+        if len(buffers[name]) >= batch_size:
+            await flush(name)
+    for name in buffers:
+        await flush(name)
+    return counts
+
+
+async def main(args):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(args.mongo_url or os.environ['MONGO_URL'])
+    generator = ClinicGenerator(
+        args.patients, args.years, seed=args.seed, duplicate_rate=args.duplicate_rate,
+        missing_rate=args.missing_rate, visits_per_year=args.visits_per_year, signature_size=args.signature_size,
+        now=datetime.fromisoformat(args.as_of).replace(tzinfo=timezone.utc) if args.as_of else None
+    )
+    started = time.perf_counter()
+    counts = await load_clinic(client[args.db_name], generator, drop=not args.append)
+    print(f"Loaded {counts} into {args.db_name} in {time.perf_counter() - started:.1f}s")
+    client.close()
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db-name", required=True, help="target database (dropped unless --append)")
+    parser.add_argument("--mongo-url", help="defaults to MONGO_URL")
+    parser.add_argument("--patients", type=int, default=10_000)
+    parser.add_argument("--years", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--duplicate-rate", type=float, default=0.03)
+    parser.add_argument("--missing-rate", type=float, default=0.08)
+    parser.add_argument("--visits-per-year", type=float, default=2.5)
+    parser.add_argument("--signature-size", type=int, default=1500, help="base64 characters per signature")
+    parser.add_argument("--as-of", help="YYYY-MM-DD treated as today; fixes the data completely for a given seed")
+    parser.add_argument("--append", action="store_true")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -1,32 +1,126 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, status
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteMany, DeleteOne, ReadPreference, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError, ExecutionTimeout
 import os
 import logging
 import hashlib
 import secrets
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
 from typing import List, Optional, Dict, Any
 import uuid
+import csv
+import io
+import json
 from datetime import datetime, timezone, timedelta
 from collections import Counter, defaultdict
+from concurrent.futures.process import BrokenProcessPool
 import jwt
 import asyncio
+import time
+
+import admission
+import alert_flags
+import analytics
+import backups
+import catalogs
+import coalesce
+import deletions
+import duplicates
+import events
+import indexes
+import jobs
+import metrics
+import workers
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to the stdlib encoder
+    orjson = None
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # pragma: no cover - gzip only
+    BrotliMiddleware = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+
+# Pool and timeout settings; these override the same options given in MONGO_URL.
+# A stalled server fails requests after the selection / wait-queue timeouts
+# instead of hanging them.
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+    "minPoolSize": int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+    "maxIdleTimeMS": int(os.environ.get('MONGO_MAX_IDLE_MS', '300000')),
+    "waitQueueTimeoutMS": int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000')),
+    "serverSelectionTimeoutMS": int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+    "connectTimeoutMS": int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+    "socketTimeoutMS": int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '60000')),
+}
+
+# Server-side time limit on report queries; keep it below MONGO_SOCKET_TIMEOUT_MS
+REPORT_MAX_TIME_MS = int(os.environ.get('REPORT_MAX_TIME_MS', '30000'))
+
+client = AsyncIOMotorClient(
+    mongo_url,
+    event_listeners=[metrics.MongoCommandListener(), metrics.PoolListener()],
+    **MONGO_CLIENT_OPTIONS
+)
 db = client[os.environ['DB_NAME']]
+# Reports and exports tolerate slightly stale data, so they read from a secondary
+# when the deployment has one and leave the primary to kiosk and desk writes
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+analytics_db = client.get_database(
+    os.environ['DB_NAME'],
+    read_preference=READ_PREFERENCES[os.environ.get('ANALYTICS_READ_PREFERENCE', 'secondaryPreferred')]
+)
+metrics.registry.set(metrics.pool_max_size, MONGO_CLIENT_OPTIONS["maxPoolSize"])
+# Scratch database that backup verification restores into; its collections are dropped after each run
+BACKUP_VERIFY_DB = os.environ.get('BACKUP_VERIFY_DB', f"{os.environ['DB_NAME']}_restore_test")
+if BACKUP_VERIFY_DB == os.environ['DB_NAME']:
+    raise RuntimeError("BACKUP_VERIFY_DB must not be the live database")
+verify_db = client[BACKUP_VERIFY_DB]
 
 JWT_SECRET = os.environ.get('JWT_SECRET', 'just-vitality-secret-key-2025')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 6
 
+# Upper bound on rows a single report run loads into its columnar snapshot
+REPORT_MAX_ROWS = int(os.environ.get('REPORT_MAX_ROWS', '500000'))
+# Processes per uvicorn worker that compute reports off the event loop (0 = a thread instead)
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', '2'))
+
+# Automatic backups kept grandfather-father-son (newest per day / ISO week / month), and days of job run history kept
+BACKUP_KEEP_DAILY = int(os.environ.get('BACKUP_KEEP_DAILY', '7'))
+BACKUP_KEEP_WEEKLY = int(os.environ.get('BACKUP_KEEP_WEEKLY', '4'))
+BACKUP_KEEP_MONTHLY = int(os.environ.get('BACKUP_KEEP_MONTHLY', '12'))
+JOB_HISTORY_DAYS = int(os.environ.get('JOB_HISTORY_DAYS', '90'))
+
+# Background deletions remove this many documents per batch and pause at least this long between batches
+DELETE_BATCH_SIZE = int(os.environ.get('DELETE_BATCH_SIZE', '500'))
+DELETE_BATCH_PAUSE_MS = int(os.environ.get('DELETE_BATCH_PAUSE_MS', '50'))
+
+# Idle push streams send a keep-alive comment this often so proxies keep them open
+SSE_HEARTBEAT_SECONDS = int(os.environ.get('SSE_HEARTBEAT_SECONDS', '15'))
+
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+
 app = FastAPI(title="Just Vitality Clinic API")
 api_router = APIRouter(prefix="/api")
 security = HTTPBearer()
@@ -139,6 +233,74 @@ class ConsentRecord(BaseModel):
     medications_declared: str
     allergies_declared: str
 
+class PatientImportRow(BaseModel):
+    model_config = ConfigDict(extra="ignore", str_strip_whitespace=True, coerce_numbers_to_str=True)
+    
+    first_name: str = Field(min_length=1)
+    last_name: str = Field(min_length=1)
+    dob: str
+    phone: str = ""
+    email: str = ""
+    street: str = ""
+    city: str = ""
+    postcode: str = ""
+    emergency_name: str = ""
+    emergency_phone: str = ""
+    reason: str = ""
+    medications: str = ""
+    allergies: str = "NKDA"
+    conditions: str = ""
+    surgeries: str = ""
+    procedures: str = ""
+    registered_at: Optional[str] = None
+    
+    @field_validator("dob")
+    @classmethod
+    def check_dob(cls, v):
+        datetime.strptime(v, "%Y-%m-%d")
+        return v
+
+class VisitImportRow(BaseModel):
+    model_config = ConfigDict(extra="ignore", str_strip_whitespace=True, coerce_numbers_to_str=True)
+    
+    patient_id: str = Field(min_length=1)
+    date: str
+    treatment: str = Field(min_length=1)
+    notes: str = ""
+    consultant: str = ""
+    visit_id: Optional[str] = None
+    
+    @field_validator("date")
+    @classmethod
+    def normalize_date(cls, v):
+        dt = datetime.fromisoformat(v.replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.astimezone(timezone.utc).isoformat()
+
+class CatalogEntryCreate(BaseModel):
+    name: str = Field(min_length=1)
+    aliases: List[str] = []
+
+class CatalogEntryUpdate(BaseModel):
+    name: Optional[str] = None
+    aliases: Optional[List[str]] = None
+    active: Optional[bool] = None
+
+class CatalogMerge(BaseModel):
+    into_id: int
+
+class PatientMerge(BaseModel):
+    survivor_id: str = Field(min_length=1)
+    duplicate_id: str = Field(min_length=1)
+
+class DuplicateMergeRequest(BaseModel):
+    password: str
+    merges: List[PatientMerge] = Field(min_length=1)
+
+class DuplicateDismissRequest(BaseModel):
+    pairs: List[str] = Field(min_length=1)  # "pair" keys as listed by /admin/duplicates
+
 # ==========================================
 # HELPER FUNCTIONS
 # ==========================================
@@ -190,7 +352,7 @@ async def verify_password_for_user(username: str, password: str) -> bool:
         return False
     return hash_password(password, db_user["salt"]) == db_user["password_hash"]
 
-async def log_system_event(action: str, details: str, user: str, patient_id: str = "SYSTEM", field: str = "", old_value: str = "", new_value: str = ""):
+async def log_system_event(action: str, details: str, user: str, patient_id: str = "SYSTEM", field: str = "", old_value: str = "", new_value: str = "", session=None):
     """Log any system event to audit log"""
     await db.audit_log.insert_one({
         "timestamp": datetime.now(timezone.utc).isoformat(),
@@ -200,7 +362,178 @@ async def log_system_event(action: str, details: str, user: str, patient_id: str
         "old_value": old_value,
         "new_value": new_value or details,
         "user": user
-    })
+    }, session=session)
+
+# Set in init_database once we know whether the server is a replica set / mongos
+transactions_supported = False
+
+async def run_atomic(callback):
+    """Run callback(session) in a multi-document transaction when the server supports it.
+
+    On a standalone mongod there are no transactions, so the callback runs with
+    session=None and its writes are NOT atomic: a failure part-way (e.g. after
+    create_visit's patient summary update but before the visit insert) leaves
+    the earlier writes in place. Callbacks order their writes so the summary
+    rebuild jobs can repair what is left behind.
+    """
+    if not transactions_supported:
+        return await callback(None)
+    async with await client.start_session() as session:
+        return await session.with_transaction(callback)
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson when available.
+    
+    Hot endpoints return this directly so FastAPI skips jsonable_encoder on large payloads.
+    """
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+def parse_fields(fields: Optional[str]) -> Optional[set]:
+    """Parse a comma-separated fields= parameter; None means all fields"""
+    if not fields:
+        return None
+    return {f.strip() for f in fields.split(",") if f.strip()}
+
+def field_projection(wanted: Optional[set], required: tuple = (), hidden: tuple = ()) -> dict:
+    """Mongo projection for the requested fields plus any the endpoint needs internally
+
+    hidden lists internal fields left out when no fields are requested.
+    """
+    if wanted is None:
+        return {"_id": 0, **{f: 0 for f in hidden}}
+    return {"_id": 0, **{f: 1 for f in wanted | set(required)}}
+
+def fields_key(wanted: Optional[set]) -> Optional[tuple]:
+    """Order-independent form of a fields= selection, for coalescing keys"""
+    return tuple(sorted(wanted)) if wanted is not None else None
+
+def json_body(content: Any) -> Response:
+    """Wrap an already rendered JSON body, e.g. one shared between coalesced requests"""
+    return Response(content, media_type="application/json")
+
+def select_fields(doc: dict, wanted: Optional[set]) -> dict:
+    if wanted is None:
+        return doc
+    return {k: v for k, v in doc.items() if k in wanted}
+
+def rebuild_key(value):
+    # Stored datetimes come back naive; compare them as the aware UTC values they were written as
+    return parse_event_time(value) if isinstance(value, datetime) else value
+
+async def existing_keys(collection, key: str) -> set:
+    """The keys a derived collection holds now; read them before a rebuild scans its source"""
+    return {rebuild_key(doc[key]) async for doc in collection.find({}, {"_id": 0, key: 1}) if key in doc}
+
+async def replace_keyed(collection, key: str, docs: List[dict], previous: set):
+    """Make a derived collection hold docs, one per unique key, without ever emptying it.
+
+    Each doc replaces (or upserts) its key in place, then the keys in previous
+    the rebuild no longer produced are deleted. Live writers $inc-upserting the
+    same collection meanwhile never hit a duplicate key, and keys they create
+    after previous was read are kept.
+    """
+    ops = [ReplaceOne({key: doc[key]}, doc, upsert=True) for doc in docs]
+    stale = previous - {rebuild_key(doc[key]) for doc in docs}
+    if stale:
+        ops.append(DeleteMany({key: {"$in": list(stale)}}))
+    if ops:
+        await collection.bulk_write(ops, ordered=False)
+
+# ==========================================
+# CROSS-WORKER EVENTS
+# ==========================================
+# Several uvicorn workers (and hosts) share nothing but Mongo: the event bus
+# tails a capped collection so cache invalidations and change notifications
+# reach every worker. See README "Running several workers".
+
+bus = events.EventBus(db)
+kiosk_settings_cache = events.SharedCache(bus, "kiosk_settings")
+
+async def publish_changes(*keys: str):
+    """Tell every worker, and the push streams connected to it, which resources changed"""
+    await bus.publish("changed", keys=list(dict.fromkeys(keys)))
+
+# ==========================================
+# RESOURCE REVISIONS (ETAGS)
+# ==========================================
+# Each cacheable resource has a revision token in db.revisions, keyed as
+# "patient:<id>", "visits:<id>", "consents:<id>" or "queue:<date>". Writers
+# replace the token *after* changing the data, so a reader can never pair a
+# new token with an old body.
+
+async def touch_revisions(*keys: str, session=None, publish: bool = True):
+    """Give each resource key a fresh revision token and announce the change.
+    
+    Inside a transaction pass publish=False and call publish_changes after the
+    commit: the capped events collection cannot be written in a transaction.
+    """
+    if not keys:
+        return
+    now = datetime.now(timezone.utc).isoformat()
+    await db.revisions.bulk_write([
+        UpdateOne({"key": key}, {"$set": {"etag": uuid.uuid4().hex, "updated_at": now}}, upsert=True)
+        for key in dict.fromkeys(keys)
+    ], ordered=False, session=session)
+    if publish:
+        await publish_changes(*keys)
+
+async def invalidate_revisions(*prefixes: str):
+    """Drop revision tokens after bulk changes; readers mint new ones on next fetch"""
+    if not prefixes:
+        await db.revisions.delete_many({})
+        await publish_changes("*")
+        return
+    for prefix in prefixes:
+        await db.revisions.delete_many({"key": {"$regex": f"^{prefix}:"}})
+    await publish_changes(*(f"{prefix}:*" for prefix in prefixes))
+
+def etag_matches(request: Request, etag: str, exists: bool = False) -> bool:
+    """If-None-Match check; `*` only matches once the resource is known to exist"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return (exists and "*" in candidates) or etag in candidates
+
+async def conditional_response(request: Request, key: str, load, variant: str = ""):
+    """Serve a revisioned resource, answering 304 without loading it when If-None-Match matches"""
+    def make_etag(token):
+        return f'"{hashlib.sha1(f"{token}|{variant}".encode()).hexdigest()}"' if variant else f'"{token}"'
+    
+    headers = {"Cache-Control": "private, no-cache"}
+    revision = await db.revisions.find_one({"key": key}, {"_id": 0, "etag": 1})
+    if revision:
+        etag = make_etag(revision["etag"])
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={**headers, "ETag": etag})
+        # The token is read before the body: a write landing in between leaves the
+        # ETag older than the body (one extra refetch), never newer (a stale body cached)
+        body = await load()
+    else:
+        # A key is only revisioned once load() has found something to serve, so
+        # lookups of unknown ids (404 or empty) leave no revision behind
+        body = await load()
+        if not body:
+            return FastJSONResponse(body, headers=headers)
+        token = uuid.uuid4().hex
+        revision = await db.revisions.find_one_and_update(
+            {"key": key},
+            {"$setOnInsert": {"etag": token, "updated_at": datetime.now(timezone.utc).isoformat()}},
+            projection={"_id": 0, "etag": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if revision["etag"] != token:
+            # A write minted the token while the body loaded, so the body may predate it
+            return FastJSONResponse(body, headers=headers)
+        etag = make_etag(token)
+    
+    if etag_matches(request, etag, exists=True):
+        return Response(status_code=304, headers={**headers, "ETag": etag})
+    return FastJSONResponse(body, headers={**headers, "ETag": etag})
 
 # ==========================================
 # INITIALIZATION
@@ -222,84 +555,648 @@ async def init_database():
         })
         logger.info("Created default ADMIN user")
     
-    await db.patients.create_index("patient_id", unique=True)
-    await db.visits.create_index("patient_id")
-    await db.queue.create_index([("date", 1), ("patient_id", 1)])
-    await db.consents.create_index("patient_id")
-
-# Background task for automatic backups
-async def scheduled_backup():
-    """Run automatic backup at 2:00 AM daily"""
-    while True:
-        now = datetime.now(timezone.utc)
-        # Calculate seconds until next 2:00 AM UTC
-        next_2am = now.replace(hour=2, minute=0, second=0, microsecond=0)
-        if now >= next_2am:
-            next_2am += timedelta(days=1)
-        
-        wait_seconds = (next_2am - now).total_seconds()
-        logger.info(f"Next automatic backup scheduled in {wait_seconds/3600:.1f} hours at {next_2am.isoformat()}")
-        
-        await asyncio.sleep(wait_seconds)
-        
-        # Perform backup
+    await indexes.reconcile(db)
+    
+    global transactions_supported
+    hello = await client.admin.command("hello")
+    transactions_supported = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+    if transactions_supported:
+        logger.info("Multi-document transactions enabled")
+    else:
+        logger.warning(
+            "Multi-document transactions unavailable (standalone server): visit creation, merges and other "
+            "multi-collection writes run as separate, non-atomic writes. Run MongoDB as a replica set to make them atomic."
+        )
+    
+    await backfill_visit_summaries()
+    await migrate_visit_catalogs()
+    await migrate_alert_flags()
+    await backfill_timeseries()
+    await backfill_quality()
+    await backups.migrate_inline_payloads(db)
+
+async def refresh_visit_summaries(patient_ids: Optional[List[str]] = None, only_missing: bool = False, session=None) -> int:
+    """Recompute visit_count / first_visit / last_visit / visit_months from the visits collection.
+
+    Limited to patient_ids when given; only_missing skips patients that already have a summary.
+    """
+    pipeline = []
+    if patient_ids is not None:
+        pipeline.append({"$match": {"patient_id": {"$in": patient_ids}}})
+    pipeline.append({"$group": {
+        "_id": "$patient_id", "count": {"$sum": 1}, "first": {"$min": "$date"}, "last": {"$max": "$date"},
+        "months": {"$addToSet": {"$substrCP": ["$date", 0, 7]}}
+    }})
+    
+    ops = []
+    updated = 0
+    async for row in db.visits.aggregate(pipeline, session=session):
+        patient_filter = {"patient_id": row["_id"]}
+        if only_missing:
+            patient_filter["visit_months"] = {"$exists": False}
+        ops.append(UpdateOne(
+            patient_filter,
+            {"$set": {
+                "visit_count": row["count"], "first_visit": row["first"], "last_visit": row["last"],
+                "visit_months": sorted(row["months"])
+            }}
+        ))
+        if len(ops) >= 1000:
+            updated += (await db.patients.bulk_write(ops, ordered=False, session=session)).modified_count
+            ops = []
+    if ops:
+        updated += (await db.patients.bulk_write(ops, ordered=False, session=session)).modified_count
+    return updated
+
+async def backfill_visit_summaries():
+    """Populate visit summaries (and the cohort table) on data created before they were maintained"""
+    stale = {"$or": [
+        {"visit_count": {"$exists": False}},
+        {"visit_count": {"$gt": 0}, "visit_months": {"$exists": False}}
+    ]}
+    if await db.patients.count_documents(stale, limit=1):
+        updated = await refresh_visit_summaries(only_missing=True)
+        result = await db.patients.update_many({"visit_count": {"$exists": False}}, {"$set": {"visit_count": 0}})
+        logger.info(f"Backfilled visit summaries for {updated + result.modified_count} patients")
+    elif await db.cohorts.count_documents({}, limit=1) or not await db.patients.count_documents({"visit_count": {"$gt": 0}}, limit=1):
+        return
+    
+    cohorts = await rebuild_cohorts()
+    logger.info(f"Rebuilt cohort table ({cohorts} cohorts)")
+
+# ==========================================
+# COHORT AGGREGATES
+# ==========================================
+# One document per cohort month (the month of a patient's first visit):
+#   {"cohort": "2025-03", "patients": 41, "visits": 260, "active": {"0": 41, "1": 17, ...}}
+# where active[k] counts cohort patients with at least one visit in month cohort+k.
+# create_visit keeps it current through the patient's visit_months set, so the
+# retention report never scans visits.
+
+COHORT_REPORT_OFFSETS = 12
+
+def month_offset(cohort: str, month: str) -> int:
+    """Whole months from cohort to month, both formatted YYYY-MM"""
+    return (int(month[:4]) - int(cohort[:4])) * 12 + int(month[5:7]) - int(cohort[5:7])
+
+def shift_month(month: str, delta: int) -> str:
+    index = int(month[:4]) * 12 + int(month[5:7]) - 1 + delta
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+def cohort_increments(visit_months: List[str], visit_count: int, sign: int = 1):
+    """(cohort, $inc document) adding (sign=1) or retracting (sign=-1) one patient's cells"""
+    cohort = min(visit_months)
+    inc = {"patients": sign, "visits": sign * visit_count}
+    for month in set(visit_months):
+        inc[f"active.{month_offset(cohort, month)}"] = sign
+    return cohort, inc
+
+async def rebuild_cohorts() -> int:
+    """Recompute the whole cohort table from the patients' visit_months summaries"""
+    previous = await existing_keys(db.cohorts, "cohort")
+    cells = defaultdict(Counter)
+    async for p in db.patients.find({"visit_months.0": {"$exists": True}}, {"_id": 0, "visit_months": 1, "visit_count": 1}):
+        cohort, inc = cohort_increments(p["visit_months"], p.get("visit_count", 0))
+        cells[cohort].update(inc)
+    
+    docs = []
+    for cohort, inc in sorted(cells.items()):
+        active = {key.split(".", 1)[1]: count for key, count in inc.items() if key.startswith("active.")}
+        docs.append({"cohort": cohort, "patients": inc["patients"], "visits": inc["visits"], "active": active})
+    await replace_keyed(db.cohorts, "cohort", docs, previous)
+    return len(docs)
+
+# ==========================================
+# DATA QUALITY
+# ==========================================
+# Each patient stores its own completeness, computed whenever the record is written:
+#   "quality": {"score": 71, "missing": ["email", "postcode"], "email_key": "jo@x.com", "phone_key": "7700900123"}
+# and quality_counters keeps running totals beside the patients:
+#   {"key": "totals", "patients": 812, "score_total": 60211, "missing": {"email": 40, ...}}
+#   {"key": "email:jo@x.com", "kind": "email", "value": "jo@x.com", "count": 2}
+# so the data-quality dashboard is one document read plus indexed counter queries.
+
+# (field, weight) of the completeness score; the emergency contact counts double
+QUALITY_CHECKS = (("email", 1), ("phone", 1), ("postcode", 1), ("street", 1), ("city", 1), ("emergency_contact", 2))
+QUALITY_REPORTED_MISSING = ("email", "phone", "postcode", "emergency_contact")
+# Everything patient_quality reads
+QUALITY_SOURCE_FIELDS = ("email", "phone", "postcode", "street", "city", "emergency_name", "emergency_phone")
+
+def patient_quality(patient: dict) -> dict:
+    def present(field):
+        return bool(str(patient.get(field) or "").strip())
+    
+    has = {field: present(field) for field in ("email", "phone", "postcode", "street", "city")}
+    has["emergency_contact"] = present("emergency_name") and present("emergency_phone")
+    weight = sum(w for _, w in QUALITY_CHECKS)
+    return {
+        "score": round(sum(w for field, w in QUALITY_CHECKS if has[field]) / weight * 100),
+        "missing": [field for field, _ in QUALITY_CHECKS if not has[field]],
+        "email_key": duplicates.normalize_email(patient.get("email")) or None,
+        "phone_key": duplicates.normalize_phone(patient.get("phone")) or None,
+    }
+
+def quality_counter_ops(old: Optional[dict], new: Optional[dict]) -> list:
+    """Counter updates for one patient's quality going from old to new (None = no patient)"""
+    inc = Counter()
+    for quality, sign in ((old, -1), (new, 1)):
+        if quality:
+            inc["patients"] += sign
+            inc["score_total"] += sign * quality["score"]
+            for field in quality["missing"]:
+                inc[f"missing.{field}"] += sign
+    ops = []
+    inc = {k: v for k, v in inc.items() if v}
+    if inc:
+        ops.append(UpdateOne({"key": "totals"}, {"$inc": inc}, upsert=True))
+    for kind in ("email", "phone"):
+        before, after = (old or {}).get(f"{kind}_key"), (new or {}).get(f"{kind}_key")
+        if before == after:
+            continue
+        if before:
+            ops.append(UpdateOne({"key": f"{kind}:{before}"}, {"$inc": {"count": -1}}))
+        if after:
+            ops.append(UpdateOne({"key": f"{kind}:{after}"}, {"$inc": {"count": 1}, "$setOnInsert": {"kind": kind, "value": after}}, upsert=True))
+    return ops
+
+async def apply_quality_changes(changes: List[tuple], session=None):
+    """Apply (old quality, new quality) pairs to quality_counters"""
+    ops = [op for old, new in changes for op in quality_counter_ops(old, new)]
+    if ops:
+        await db.quality_counters.bulk_write(ops, ordered=False, session=session)
+
+async def rebuild_quality(recompute: bool = False) -> int:
+    """Recount quality_counters from the stored scores; recompute=True rescores every patient first"""
+    previous = await existing_keys(db.quality_counters, "key")
+    totals = Counter()
+    keys = Counter()
+    ops = []
+    rescored = 0
+    # Patients without a stored score are scored here, so their source fields are always read
+    projection = {"_id": 0, "patient_id": 1, "quality": 1, **{field: 1 for field in QUALITY_SOURCE_FIELDS}}
+    async for p in db.patients.find({}, projection):
+        quality = p.get("quality")
+        if recompute or not quality:
+            quality = patient_quality(p)
+            ops.append(UpdateOne({"patient_id": p["patient_id"]}, {"$set": {"quality": quality}}))
+            if len(ops) >= 1000:
+                rescored += (await db.patients.bulk_write(ops, ordered=False)).modified_count
+                ops = []
+        totals["patients"] += 1
+        totals["score_total"] += quality["score"]
+        for field in quality["missing"]:
+            totals[f"missing.{field}"] += 1
+        for kind in ("email", "phone"):
+            if quality.get(f"{kind}_key"):
+                keys[(kind, quality[f"{kind}_key"])] += 1
+    if ops:
+        rescored += (await db.patients.bulk_write(ops, ordered=False)).modified_count
+    
+    docs = [{
+        "key": "totals", "patients": totals["patients"], "score_total": totals["score_total"],
+        "missing": {field: totals[f"missing.{field}"] for field, _ in QUALITY_CHECKS}
+    }]
+    docs += [{"key": f"{kind}:{value}", "kind": kind, "value": value, "count": count} for (kind, value), count in keys.items()]
+    await replace_keyed(db.quality_counters, "key", docs, previous)
+    return rescored
+
+async def backfill_quality():
+    """Score patients written before quality was stored, and build the counters if missing"""
+    if await db.patients.count_documents({"quality": {"$exists": False}}, limit=1) or not await db.quality_counters.find_one({"key": "totals"}):
+        rescored = await rebuild_quality()
+        logger.info(f"Backfilled data quality ({rescored} patients scored)")
+
+async def data_quality_summary(top: int = 10) -> dict:
+    """The report's data_quality section, from the counters alone"""
+    totals = await db.quality_counters.find_one({"key": "totals"}, {"_id": 0}) or {}
+    patients = totals.get("patients", 0)
+    missing = totals.get("missing", {})
+    dups = {}
+    for kind in ("email", "phone"):
+        query = {"kind": kind, "count": {"$gte": 2}}
+        rows = await db.quality_counters.find(query, {"_id": 0, "value": 1}).sort("count", -1).limit(top).to_list(top)
+        dups[kind] = ([r["value"] for r in rows], await db.quality_counters.count_documents(query))
+    return {
+        "missing": {field: missing.get(field, 0) for field in QUALITY_REPORTED_MISSING},
+        "duplicates": {
+            "emails": dups["email"][0],
+            "phones": dups["phone"][0],
+            "email_count": dups["email"][1],
+            "phone_count": dups["phone"][1]
+        },
+        "avg_completeness_score": round(totals.get("score_total", 0) / patients, 1) if patients else 0,
+        "total_patients": patients
+    }
+
+# ==========================================
+# TREATMENT AND CONSULTANT CATALOGS
+# ==========================================
+# Visits store catalog ids (treatment_ids, consultant_id) rather than free text;
+# see catalogs.py. Both catalogs are small and read on every visit write and
+# listing, so each worker keeps them in memory and drops them, on every worker,
+# whenever an entry is added or changed.
+
+catalog_cache = events.SharedCache(bus, "catalogs")
+
+def check_catalog_kind(kind: str):
+    if kind not in catalogs.KINDS:
+        raise HTTPException(status_code=404, detail="Unknown catalog")
+
+async def get_catalog(kind: str) -> catalogs.Catalog:
+    return await catalog_cache.get(kind, lambda: catalogs.load(db, kind))
+
+async def catalog_ids(kind: str, names: List[str], session=None) -> List[int]:
+    """Catalog ids for names as typed, adding entries for names not catalogued yet"""
+    ids, created = await catalogs.resolve(db, await get_catalog(kind), names, session=session)
+    if created:
+        await catalog_cache.invalidate(kind)
+    return ids
+
+async def visit_references(treatment: Optional[str], consultant: Optional[str], session=None) -> dict:
+    """The catalog fields a visit stores for its treatment text (one per line) and consultant"""
+    refs = {"treatment_ids": await catalog_ids("treatments", catalogs.split_treatments(treatment), session)}
+    consultant_ids = await catalog_ids("consultants", [consultant or ""], session)
+    if consultant_ids:
+        refs["consultant_id"] = consultant_ids[0]
+    return refs
+
+async def visit_namer():
+    """Async function filling in a visit's treatment and consultant names from its catalog ids
+
+    An id missing from this worker's copy (another worker just added it, or a
+    merge is under way) reloads that catalog once, so a listing cached under
+    its ETag does not keep a blank name.
+    """
+    loaded = dict(zip(catalogs.KINDS, await asyncio.gather(*(get_catalog(kind) for kind in catalogs.KINDS))))
+    reloaded = set()
+    
+    async def catalog_for(kind: str, entry_ids: list) -> catalogs.Catalog:
+        if kind not in reloaded and not loaded[kind].covers(entry_ids):
+            reloaded.add(kind)
+            catalog_cache.discard(kind)
+            loaded[kind] = await get_catalog(kind)
+        return loaded[kind]
+    
+    async def name(visit: dict) -> dict:
+        if "treatment_ids" in visit:
+            treatment_ids = visit.pop("treatment_ids")
+            treatments = await catalog_for("treatments", treatment_ids)
+            visit["treatment"] = "\n".join(treatments.name(t) for t in treatment_ids)
+        if "consultant_id" in visit:
+            consultant_id = visit.pop("consultant_id")
+            visit["consultant"] = (await catalog_for("consultants", [consultant_id])).name(consultant_id)
+        return visit
+    return name
+
+async def migrate_visit_catalogs():
+    """Move visits still holding free-text treatment/consultant onto catalog ids"""
+    converted = await catalogs.migrate_visits(db)
+    if converted:
+        await catalog_cache.invalidate()
+        logger.info(f"Moved {converted} visits onto treatment/consultant catalogs; rebuilt {await rebuild_visit_buckets()} visit buckets")
+        await invalidate_revisions("visits")
+    return converted
+
+# ==========================================
+# ALERT FLAGS
+# ==========================================
+# Queue entries and consents carry alert_flags, a list of codes (see alert_flags.py),
+# under multikey indexes; the queue's legacy ", "-joined `alerts` string is gone and
+# the API derives it from the flags. Consents keep the declared text as signed.
+
+async def migrate_alert_flags() -> int:
+    """Give queue entries and consents written before alert flags their coded flags"""
+    migrated = 0
+    for collection, source, keep_source in ((db.queue, "alerts", False), (db.consents, "alerts_declared", True)):
+        legacy = {source: {"$exists": True}, "alert_flags": {"$exists": False}}
+        if not await collection.count_documents(legacy, limit=1):
+            continue
+        # One update per distinct string: the kiosk only ever produces a few dozen combinations
+        async for row in collection.aggregate([{"$match": legacy}, {"$group": {"_id": f"${source}"}}]):
+            value = row["_id"]
+            update = {"$set": {"alert_flags": alert_flags.parse(value if isinstance(value, str) else "")}}
+            if not keep_source:
+                update["$unset"] = {source: ""}
+            match = {**legacy, source: value if value is not None else {"$type": "null"}}
+            migrated += (await collection.update_many(match, update)).modified_count
+    if migrated:
+        logger.info(f"Coded alert flags on {migrated} queue entries and consents")
+    return migrated
+
+async def alert_summary(start: datetime, end: datetime, top: int = 10) -> dict:
+    """The report's alerts section, aggregated by Mongo over the period's check-ins"""
+    period = {"at": {"$gte": start, "$lt": end}}
+    total, flagged, counts = await asyncio.gather(
+        analytics_db.queue.count_documents(period, maxTimeMS=REPORT_MAX_TIME_MS),
+        analytics_db.queue.count_documents({**period, "alert_flags.0": {"$exists": True}}, maxTimeMS=REPORT_MAX_TIME_MS),
+        analytics_db.queue.aggregate([
+            {"$match": {**period, "alert_flags.0": {"$exists": True}}},
+            {"$unwind": "$alert_flags"},
+            {"$group": {"_id": "$alert_flags", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": top}
+        ], maxTimeMS=REPORT_MAX_TIME_MS).to_list(None)
+    )
+    return {
+        "top_alerts": [{"alert": alert_flags.label(row["_id"]), "code": row["_id"], "count": row["count"]} for row in counts],
+        "checkins_with_alerts": flagged,
+        "alert_rate": round(flagged / total * 100, 1) if total else 0,
+        "total_checkins": total
+    }
+
+# ==========================================
+# TIME-SERIES BUCKETS
+# ==========================================
+# Visits and queue entries carry a native UTC datetime `at` next to the ISO strings
+# the API returns, and roll up into one bucket document per UTC day:
+#   visit_buckets: {"day": <midnight>, "count": 14, "hours": {"9": 3, ...},
+#                   "treatments": {"4": 6, ...}, "consultants": {"2": 9, ...}}
+#   queue_buckets: {"day": <midnight>, "total": 17, "done": 14, "with_alerts": 3}
+# Trend and heatmap reports read a year of history from 365 bucket documents
+# instead of every visit. Treatments and consultants are counted under their catalog
+# ids ("%" for a visit without one) and named when the report is served.
+
+def parse_event_time(value) -> Optional[datetime]:
+    """Aware UTC datetime for an ISO date/datetime string or a stored datetime; None if unparseable"""
+    if isinstance(value, datetime):
+        parsed = value
+    else:
         try:
-            backup_id = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S_AUTO")
-            
-            patients = await db.patients.find({}, {"_id": 0}).to_list(50000)
-            visits = await db.visits.find({}, {"_id": 0}).to_list(100000)
-            queue = await db.queue.find({}, {"_id": 0}).to_list(10000)
-            users_data = await db.users.find({}, {"_id": 0}).to_list(100)
-            consents_data = await db.consents.find({}, {"_id": 0}).to_list(50000)
-            
-            backup_doc = {
-                "backup_id": backup_id,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "created_by": "SYSTEM_AUTO",
-                "data": {
-                    "patients": patients,
-                    "visits": visits,
-                    "queue": queue,
-                    "users": users_data,
-                    "consents": consents_data
-                },
-                "counts": {
-                    "patients": len(patients),
-                    "visits": len(visits),
-                    "queue": len(queue),
-                    "users": len(users_data),
-                    "consents": len(consents_data)
-                }
-            }
-            
-            await db.backups.insert_one(backup_doc)
-            logger.info(f"Automatic backup completed: {backup_id}")
-            
-            # Clean up old automatic backups (keep last 30)
-            auto_backups = await db.backups.find({"created_by": "SYSTEM_AUTO"}).sort("created_at", -1).to_list(100)
-            if len(auto_backups) > 30:
-                for old_backup in auto_backups[30:]:
-                    await db.backups.delete_one({"backup_id": old_backup["backup_id"]})
-                logger.info(f"Cleaned up {len(auto_backups) - 30} old automatic backups")
-                
-        except Exception as e:
-            logger.error(f"Automatic backup failed: {e}")
-
-backup_task = None
+            parsed = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return None
+    # Naive values (Mongo hands datetimes back naive) are UTC
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed.astimezone(timezone.utc)
+
+def day_start(at: datetime) -> datetime:
+    return at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def bucket_key(entry_id: Optional[int]) -> str:
+    return "%" if entry_id is None else str(entry_id)
+
+def bucket_name(catalog: catalogs.Catalog, key: str) -> str:
+    return "" if key == "%" else catalog.name(int(key))
+
+def visit_bucket_inc(visit: dict, sign: int = 1):
+    """(day, $inc document) adding (sign=1) or retracting (sign=-1) one visit; day is None without a usable time"""
+    at = parse_event_time(visit.get("at") or visit.get("date"))
+    if at is None:
+        return None, {}
+    inc = {"count": sign, f"hours.{at.hour}": sign, f"consultants.{bucket_key(visit.get('consultant_id'))}": sign}
+    # Every treatment given counts once, so a visit with two treatments adds to both
+    for treatment_id in visit.get("treatment_ids") or [None]:
+        inc[f"treatments.{bucket_key(treatment_id)}"] = sign
+    return day_start(at), inc
+
+async def rebuild_visit_buckets() -> int:
+    """Recompute every visit bucket from the visits collection"""
+    previous = await existing_keys(db.visit_buckets, "day")
+    cells = defaultdict(Counter)
+    async for v in db.visits.find({"at": {"$type": "date"}}, {"_id": 0, "at": 1, "treatment_ids": 1, "consultant_id": 1}):
+        day, inc = visit_bucket_inc(v)
+        cells[day].update(inc)
+
+    docs = []
+    for day, inc in sorted(cells.items()):
+        doc = {"day": day, "count": inc.pop("count"), "hours": {}, "treatments": {}, "consultants": {}}
+        for key, count in inc.items():
+            group, name = key.split(".", 1)
+            doc[group][name] = count
+        docs.append(doc)
+    await replace_keyed(db.visit_buckets, "day", docs, previous)
+    return len(docs)
+
+async def refresh_queue_buckets(days: Optional[List[str]] = None) -> int:
+    """Recompute the queue buckets of the given YYYY-MM-DD days, or all of them.
+
+    Queue entries are replaced on re-registration and flipped to DONE in place, so
+    a day is recounted rather than patched; a day holds at most a few hundred entries.
+    """
+    counts = {}
+    previous = await existing_keys(db.queue_buckets, "day") if days is None else set()
+    query = {"date": {"$in": days}} if days is not None else {}
+    async for q in db.queue.find(query, {"_id": 0, "date": 1, "status": 1, "alert_flags": 1}):
+        day = counts.setdefault(q["date"], {"total": 0, "done": 0, "with_alerts": 0})
+        day["total"] += 1
+        day["done"] += q.get("status") == "DONE"
+        day["with_alerts"] += bool(q.get("alert_flags"))
+
+    ops = []
+    if days is None:
+        days = list(counts)
+        # Days that no longer have any queue entries
+        stale = previous - {day_start(at) for at in map(parse_event_time, days) if at}
+        if stale:
+            ops.append(DeleteMany({"day": {"$in": list(stale)}}))
+    for date in days:
+        at = parse_event_time(date)
+        if at is None:
+            continue
+        if date in counts:
+            ops.append(ReplaceOne({"day": day_start(at)}, {"day": day_start(at), **counts[date]}, upsert=True))
+        else:
+            ops.append(DeleteOne({"day": day_start(at)}))
+    if ops:
+        await db.queue_buckets.bulk_write(ops, ordered=False)
+    return len(ops)
+
+async def backfill_timeseries():
+    """Give visits and queue entries written before `at` existed their native time, then build missing buckets"""
+    for collection, source in ((db.visits, "date"), (db.queue, "timestamp")):
+        ops = []
+        migrated = 0
+        async for doc in collection.find({"at": {"$exists": False}}, {source: 1, "date": 1}):
+            # Unparseable values get at=None so they are not retried on every start
+            at = parse_event_time(doc.get(source)) or parse_event_time(doc.get("date"))
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"at": at}}))
+            if len(ops) >= 1000:
+                migrated += (await collection.bulk_write(ops, ordered=False)).modified_count
+                ops = []
+        if ops:
+            migrated += (await collection.bulk_write(ops, ordered=False)).modified_count
+        if migrated:
+            logger.info(f"Backfilled native timestamps on {migrated} {collection.name} documents")
+
+    if not await db.visit_buckets.count_documents({}, limit=1) and await db.visits.count_documents({}, limit=1):
+        logger.info(f"Built {await rebuild_visit_buckets()} daily visit buckets")
+    if not await db.queue_buckets.count_documents({}, limit=1) and await db.queue.count_documents({}, limit=1):
+        logger.info(f"Built {await refresh_queue_buckets()} daily queue buckets")
+
+def report_window(start_date: Optional[str], end_date: Optional[str]):
+    """(start_date, end_date, start, end) for a report; end is the exclusive midnight after end_date"""
+    if not end_date:
+        end_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    if not start_date:
+        start_date = (datetime.now(timezone.utc) - timedelta(days=30)).strftime("%Y-%m-%d")
+    start, end = parse_event_time(start_date), parse_event_time(end_date)
+    if start is None or end is None:
+        raise HTTPException(status_code=400, detail="start_date and end_date must be YYYY-MM-DD")
+    return start_date, end_date, day_start(start), day_start(end) + timedelta(days=1)
+
+# ==========================================
+# SCHEDULED JOBS
+# ==========================================
+# Every worker runs the scheduler; the job_locks lease makes each run happen once.
+
+scheduler = jobs.JobScheduler(db, owner=events.WORKER_ID)
+# Identical concurrent expensive reads (dashboard, patient list, reports) share one computation
+flights = coalesce.SingleFlight()
+report_pool = workers.ComputePool("reports", REPORT_WORKERS)
+deletion_engine = deletions.DeletionEngine(db, events.WORKER_ID, DELETE_BATCH_SIZE, DELETE_BATCH_PAUSE_MS / 1000)
+
+async def run_auto_backup():
+    """Full automatic backup, then GFS retention over the automatic ones"""
+    backup_id = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S_AUTO")
+    entry = await backups.create(db, backup_id, backups.AUTO_CREATOR)
+    logger.info(f"Automatic backup completed: {backup_id} ({entry['bytes']} bytes in {entry['chunks']} chunks)")
+    
+    # Retention reads only the catalog; payload chunks are deleted by backup_id without being loaded
+    pruned = await backups.prune(db, BACKUP_KEEP_DAILY, BACKUP_KEEP_WEEKLY, BACKUP_KEEP_MONTHLY)
+    if pruned:
+        logger.info(f"Cleaned up {len(pruned)} old automatic backups")
+    
+    return {"backup_id": backup_id, "counts": entry["counts"], "bytes": entry["bytes"], "pruned": len(pruned)}
+
+async def run_backup_verification():
+    """Test-restore the newest complete backup and fail the run if it does not match its catalog entry"""
+    newest = await db.backups.find_one({"status": "complete"}, {"_id": 0, "backup_id": 1}, sort=[("created_at", -1)])
+    if not newest:
+        return {"verified": None}
+    result = await backups.verify(db, verify_db, newest["backup_id"])
+    summary = {"verified": newest["backup_id"], **{k: result[k] for k in ("status", "restore_seconds", "documents", "failed_collections")}}
+    if result["status"] != "passed":
+        logger.error(f"Backup verification failed for {newest['backup_id']}: {result['failed_collections']} {result['error'] or ''}")
+        raise RuntimeError(f"Backup {newest['backup_id']} failed verification: {summary}")
+    logger.info(f"Backup {newest['backup_id']} verified: {result['documents']} documents restored in {result['restore_seconds']}s")
+    return summary
+
+async def run_cohort_rebuild():
+    """Recompute the cohort table to correct any drift from non-transactional writes"""
+    return {"cohorts": await rebuild_cohorts()}
+
+async def run_timeseries_rebuild():
+    """Recompute the daily visit and queue buckets to correct any drift"""
+    return {"visit_buckets": await rebuild_visit_buckets(), "queue_buckets": await refresh_queue_buckets()}
+
+async def run_quality_rebuild():
+    """Rescore every patient and recount the data-quality counters to correct any drift"""
+    return {"rescored": await rebuild_quality(recompute=True)}
+
+async def run_job_history_cleanup():
+    """Drop job run history older than JOB_HISTORY_DAYS"""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=JOB_HISTORY_DAYS)).isoformat()
+    result = await db.job_runs.delete_many({"started_at": {"$lt": cutoff}, "status": {"$ne": "running"}})
+    return {"deleted": result.deleted_count}
+
+scheduler.register("auto_backup", os.environ.get("BACKUP_SCHEDULE", "0 2 * * *"), run_auto_backup,
+                   lock_ttl=1800, description="Full database backup")
+scheduler.register("backup_verify", os.environ.get("BACKUP_VERIFY_SCHEDULE", "0 3 * * *"), run_backup_verification,
+                   lock_ttl=3600, description="Test-restore the newest backup into a scratch database")
+scheduler.register("cohort_rebuild", "30 3 * * 0", run_cohort_rebuild,
+                   description="Weekly recompute of the cohort retention table")
+scheduler.register("timeseries_rebuild", "15 4 * * 0", run_timeseries_rebuild,
+                   description="Weekly recompute of the daily visit and queue buckets")
+scheduler.register("quality_rebuild", "45 4 * * 0", run_quality_rebuild,
+                   description="Weekly rescore of patient data quality and its counters")
+scheduler.register("job_history_cleanup", "45 3 * * *", run_job_history_cleanup,
+                   description=f"Delete job run history older than {JOB_HISTORY_DAYS} days")
+
+# ==========================================
+# BACKGROUND DELETION PLANS
+# ==========================================
+# Each plan lists, in order, everything a deletion task removes. Derived data
+# (buckets, cohorts, summaries, revision tokens) is fixed up by the closing steps.
+# Every delete is bounded by the request time, so rows written while a task runs
+# (a patient registering mid-purge) survive it.
+
+def written_before(field: str, bound) -> dict:
+    """Rows whose field predates bound, plus legacy rows that never had it set"""
+    return {"$or": [{field: {"$lt": bound}}, {field: None}]}
+
+@deletion_engine.plan("patient")
+def patient_cascade(task: dict) -> list:
+    """Everything that references one patient; the patient document itself is removed by the request"""
+    patient_id = task["params"]["patient_id"]
+    queue_days = task["params"].get("queue_days", [])
+    
+    async def drop_patient_revisions():
+        keys = [f"patient:{patient_id}", f"visits:{patient_id}", f"consents:{patient_id}"]
+        await db.revisions.delete_many({"key": {"$in": keys}})
+        await touch_revisions(*(f"queue:{day}" for day in queue_days), publish=False)
+        await publish_changes(*keys, *(f"queue:{day}" for day in queue_days))
+    
+    return [
+        deletions.Delete("visits", {"patient_id": patient_id, **written_before("at", task["cutoff"])}),
+        # Consent records carry the signature images
+        deletions.Delete("consents", {"patient_id": patient_id, **written_before("timestamp", task["requested_at"])}),
+        deletions.Delete("queue", {"patient_id": patient_id, **written_before("timestamp", task["requested_at"])}),
+        # The DELETE event logged with the request is newer than the cutoff and stays
+        deletions.Delete("audit_log", {"patient_id": patient_id, **written_before("timestamp", task["requested_at"])}),
+        deletions.Call("queue buckets", lambda: refresh_queue_buckets(queue_days)),
+        deletions.Call("revisions", drop_patient_revisions),
+    ]
+
+@deletion_engine.plan("all_patients")
+def all_patients_purge(task: dict) -> list:
+    # Patients are bounded by the newest _id at request time; registered_at can be back-dated by imports
+    last_id = task["params"].get("last_patient_id")
+    steps = [deletions.Delete("patients", {"_id": {"$lte": last_id}})] if last_id else []
+    return steps + [
+        deletions.Delete("visits", written_before("at", task["cutoff"])),
+        deletions.Delete("consents", written_before("timestamp", task["requested_at"])),
+        deletions.Delete("queue", written_before("timestamp", task["requested_at"])),
+        deletions.Delete("audit_log", {"patient_id": {"$ne": "SYSTEM"}, **written_before("timestamp", task["requested_at"])}),
+        deletions.Call("visit buckets", rebuild_visit_buckets),
+        deletions.Call("queue buckets", refresh_queue_buckets),
+        deletions.Call("cohorts", rebuild_cohorts),
+        deletions.Call("quality counters", rebuild_quality),
+        deletions.Call("revisions", invalidate_revisions),
+    ]
+
+@deletion_engine.plan("all_visits")
+def all_visits_purge(task: dict) -> list:
+    return [
+        deletions.Delete("visits", written_before("at", task["cutoff"])),
+        deletions.Update(
+            "patients", {"$or": [{"visit_count": {"$ne": 0}}, {"visit_months": {"$exists": True}}]},
+            {"$set": {"visit_count": 0}, "$unset": {"first_visit": "", "last_visit": "", "visit_months": ""}},
+            label="visit summaries"
+        ),
+        # Patients with visits recorded since the request get their summaries back
+        deletions.Call("remaining visit summaries", refresh_visit_summaries),
+        deletions.Call("visit buckets", rebuild_visit_buckets),
+        deletions.Call("cohorts", rebuild_cohorts),
+        deletions.Call("revisions", lambda: invalidate_revisions("patient", "visits")),
+    ]
+
+@deletion_engine.plan("all_queue")
+def all_queue_purge(task: dict) -> list:
+    return [
+        deletions.Delete("queue", written_before("timestamp", task["requested_at"])),
+        deletions.Call("queue buckets", refresh_queue_buckets),
+        deletions.Call("revisions", lambda: invalidate_revisions("queue")),
+    ]
+
+async def submit_deletion(kind: str, user: dict, params: Optional[dict] = None, session=None) -> dict:
+    task = await deletion_engine.submit(kind, user["username"], params, session=session)
+    deletion_engine.kick()
+    return task
 
 @app.on_event("startup")
 async def startup():
-    global backup_task
     await init_database()
-    # Start automatic backup scheduler
-    backup_task = asyncio.create_task(scheduled_backup())
-    logger.info("Automatic backup scheduler started")
+    await bus.start()
+    await scheduler.start()
+    await deletion_engine.start()
+    await report_pool.start()
+    logger.info(f"Worker {events.WORKER_ID} started (event bus and job scheduler running)")
 
 @app.on_event("shutdown")
 async def shutdown():
-    global backup_task
-    if backup_task:
-        backup_task.cancel()
+    await scheduler.stop()
+    await deletion_engine.stop()
+    await bus.stop()
+    await report_pool.stop()
     client.close()
 
 # ==========================================
@@ -536,43 +1433,535 @@ async def clear_system_audit(user: dict = Depends(verify_admin)):
 
 @api_router.post("/admin/data/delete-all-patients")
 async def delete_all_patients(data: PasswordVerify, user: dict = Depends(verify_admin)):
-    """Delete ALL patients - requires password verification - ADMIN ONLY"""
+    """Delete ALL patients with their visits, consents, queue and audit rows, in the background - ADMIN ONLY"""
     if not await verify_password_for_user(user["username"], data.password):
         raise HTTPException(status_code=401, detail="Invalid password")
     
     count = await db.patients.count_documents({})
-    await db.patients.delete_many({})
-    await db.queue.delete_many({})
+    newest = await db.patients.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    task = await submit_deletion("all_patients", user, {"last_patient_id": newest["_id"]} if newest else None)
     
-    await log_system_event("DELETE_ALL_PATIENTS", f"Deleted {count} patients and queue", user["username"])
+    await log_system_event("DELETE_ALL_PATIENTS", f"Deleting {count} patients and all their records (task {task['task_id']})", user["username"])
     
-    return {"success": True, "deleted_count": count}
+    return {"success": True, "deleted_count": count, "task_id": task["task_id"]}
 
 @api_router.post("/admin/data/delete-all-visits")
 async def delete_all_visits(data: PasswordVerify, user: dict = Depends(verify_admin)):
-    """Delete ALL visits - requires password verification - ADMIN ONLY"""
+    """Delete ALL visits, in the background - ADMIN ONLY"""
     if not await verify_password_for_user(user["username"], data.password):
         raise HTTPException(status_code=401, detail="Invalid password")
     
     count = await db.visits.count_documents({})
-    await db.visits.delete_many({})
+    task = await submit_deletion("all_visits", user)
     
-    await log_system_event("DELETE_ALL_VISITS", f"Deleted {count} visits", user["username"])
+    await log_system_event("DELETE_ALL_VISITS", f"Deleting {count} visits (task {task['task_id']})", user["username"])
     
-    return {"success": True, "deleted_count": count}
+    return {"success": True, "deleted_count": count, "task_id": task["task_id"]}
 
 @api_router.post("/admin/data/delete-all-queue")
 async def delete_all_queue(data: PasswordVerify, user: dict = Depends(verify_admin)):
-    """Delete ALL queue entries - requires password verification - ADMIN ONLY"""
+    """Delete ALL queue entries, in the background - ADMIN ONLY"""
     if not await verify_password_for_user(user["username"], data.password):
         raise HTTPException(status_code=401, detail="Invalid password")
     
     count = await db.queue.count_documents({})
-    await db.queue.delete_many({})
+    task = await submit_deletion("all_queue", user)
+    
+    await log_system_event("DELETE_ALL_QUEUE", f"Deleting {count} queue entries (task {task['task_id']})", user["username"])
+    
+    return {"success": True, "deleted_count": count, "task_id": task["task_id"]}
+
+@api_router.get("/admin/deletions")
+async def get_deletions(limit: int = Query(50, ge=1, le=500), user: dict = Depends(verify_admin)):
+    """Recent background deletion tasks with their progress, newest first - ADMIN ONLY"""
+    return {"success": True, "tasks": await deletion_engine.recent(limit)}
+
+@api_router.get("/deletions/{task_id}")
+async def get_deletion(task_id: str, user: dict = Depends(verify_manager_or_admin)):
+    """Progress and final counts of one background deletion task"""
+    task = await deletion_engine.get(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Deletion task not found")
+    return {"success": True, "task": task}
+
+# ==========================================
+# DUPLICATE PATIENTS
+# ==========================================
+
+# Merges are written in transactions of at most this many duplicates
+MERGE_CHUNK = 200
+# Contact details the survivor takes from a duplicate when its own are blank
+MERGE_FILL_FIELDS = ("phone", "email", "street", "city", "postcode", "emergency_name", "emergency_phone")
+# Clinical history is combined, so nothing recorded on either record is lost
+MERGE_COMBINE_FIELDS = ("medications", "allergies", "conditions", "surgeries", "procedures", "alerts")
+# Collections whose rows follow a merged patient to the survivor
+MERGE_REPOINT = ("visits", "consents", "queue", "audit_log")
+
+def resolve_merges(merges: List[PatientMerge]) -> Dict[str, str]:
+    """duplicate_id -> final survivor, following chains (C into B, B into A: C goes to A)"""
+    target = {}
+    for m in merges:
+        if m.survivor_id == m.duplicate_id:
+            raise HTTPException(status_code=400, detail=f"{m.duplicate_id} cannot be merged into itself")
+        if target.get(m.duplicate_id, m.survivor_id) != m.survivor_id:
+            raise HTTPException(status_code=400, detail=f"{m.duplicate_id} is merged into two different patients")
+        target[m.duplicate_id] = m.survivor_id
+    
+    resolved = {}
+    for duplicate_id in target:
+        survivor, seen = target[duplicate_id], {duplicate_id}
+        while survivor in target:
+            if survivor in seen:
+                raise HTTPException(status_code=400, detail=f"Merges of {duplicate_id} form a cycle")
+            seen.add(survivor)
+            survivor = target[survivor]
+        resolved[duplicate_id] = survivor
+    return resolved
+
+def combine_values(*values: Optional[str]) -> str:
+    """Distinct non-empty entries of free-text clinical fields, in order; NKDA only if nothing else"""
+    seen = {}
+    for value in values:
+        for part in (value or "").split(";"):
+            part = part.strip()
+            if part and part.upper() not in seen:
+                seen[part.upper()] = part
+    entries = [v for k, v in seen.items() if k != "NKDA"] or list(seen.values())
+    return "; ".join(entries)
+
+def merged_fields(survivor: dict, dups: List[dict]) -> dict:
+    update = {}
+    for field in MERGE_FILL_FIELDS:
+        if not (survivor.get(field) or "").strip():
+            value = next((d[field] for d in dups if (d.get(field) or "").strip()), None)
+            if value:
+                update[field] = value
+    for field in MERGE_COMBINE_FIELDS:
+        combined = combine_values(survivor.get(field), *(d.get(field) for d in dups))
+        if combined != (survivor.get(field) or ""):
+            update[field] = combined
+    registered = [p["registered_at"] for p in (survivor, *dups) if p.get("registered_at")]
+    if registered and min(registered) != survivor.get("registered_at"):
+        update["registered_at"] = min(registered)
+    return update
+
+async def merge_patients(resolved: Dict[str, str], username: str) -> dict:
+    ids = set(resolved) | set(resolved.values())
+    found = {p["patient_id"] async for p in db.patients.find({"patient_id": {"$in": list(ids)}}, {"_id": 0, "patient_id": 1})}
+    missing = sorted(ids - found)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Patients not found: {', '.join(missing[:10])}")
+    
+    by_survivor = defaultdict(list)
+    for duplicate_id, survivor_id in resolved.items():
+        by_survivor[survivor_id].append(duplicate_id)
+    
+    # Whole survivors per chunk, so each survivor's update sees all of its duplicates
+    chunks, current = [], []
+    for survivor_id in sorted(by_survivor):
+        if current and len(current) + len(by_survivor[survivor_id]) > MERGE_CHUNK:
+            chunks.append(current)
+            current = []
+        current.extend((survivor_id, d) for d in by_survivor[survivor_id])
+    if current:
+        chunks.append(current)
+    
+    moved = Counter()
+    queue_days = set()
+    now = datetime.now(timezone.utc).isoformat()
+    
+    for chunk in chunks:
+        survivors = sorted({s for s, _ in chunk})
+        dup_ids = [d for _, d in chunk]
+        
+        async def write_chunk(session):
+            # Records are read inside the transaction, so a retried chunk works from current values
+            records = {p["patient_id"]: p async for p in db.patients.find({"patient_id": {"$in": survivors + dup_ids}}, {"_id": 0}, session=session)}
+            gone = sorted(set(survivors + dup_ids) - set(records))
+            if gone:
+                raise HTTPException(status_code=404, detail=f"Patients not found: {', '.join(gone[:10])}")
+            counts = Counter()
+            # A survivor already queued on a day keeps its own entry for that day
+            queued = defaultdict(set)
+            duplicate_queue_rows = []
+            async for row in db.queue.find({"patient_id": {"$in": survivors + dup_ids}}, {"_id": 1, "patient_id": 1, "date": 1}, session=session):
+                queue_days.add(row["date"])
+                if row["patient_id"] in by_survivor:
+                    queued[row["patient_id"]].add(row["date"])
+                else:
+                    duplicate_queue_rows.append(row)
+            clashing = []
+            for row in duplicate_queue_rows:
+                survivor_id = resolved[row["patient_id"]]
+                if row["date"] in queued[survivor_id]:
+                    clashing.append(row["_id"])
+                queued[survivor_id].add(row["date"])
+            if clashing:
+                counts["queue_dropped"] = (await db.queue.delete_many({"_id": {"$in": clashing}}, session=session)).deleted_count
+            
+            for collection in MERGE_REPOINT:
+                ops = []
+                for survivor_id, duplicate_id in chunk:
+                    change = {"patient_id": survivor_id}
+                    if collection == "queue":
+                        # Queue rows carry the name the desk sees
+                        change["first_name"] = (records[survivor_id].get("first_name") or "").upper()
+                        change["last_name"] = (records[survivor_id].get("last_name") or "").upper()
+                    ops.append(UpdateMany({"patient_id": duplicate_id}, {"$set": change}))
+                counts[collection] = (await db[collection].bulk_write(ops, ordered=False, session=session)).modified_count
+            
+            patient_ops = []
+            quality_changes = [(records[d].get("quality"), None) for d in dup_ids]
+            for survivor_id in survivors:
+                dups = [records[d] for d in by_survivor[survivor_id]]
+                update = {"$addToSet": {"merged_from": {"$each": by_survivor[survivor_id]}}}
+                fields = merged_fields(records[survivor_id], dups)
+                if fields:
+                    fields["quality"] = patient_quality({**records[survivor_id], **fields})
+                    quality_changes.append((records[survivor_id].get("quality"), fields["quality"]))
+                    update["$set"] = {**fields, "updated_at": now}
+                patient_ops.append(UpdateOne({"patient_id": survivor_id}, update))
+            await db.patients.bulk_write(patient_ops, ordered=False, session=session)
+            await db.patients.delete_many({"patient_id": {"$in": dup_ids}}, session=session)
+            await apply_quality_changes(quality_changes, session=session)
+            
+            await db.audit_log.insert_many([{
+                "timestamp": now, "patient_id": survivor_id, "action": "MERGE", "field": "patient_id",
+                "old_value": duplicate_id, "new_value": survivor_id, "user": username
+            } for survivor_id, duplicate_id in chunk], session=session)
+            
+            # Summaries and cohort cells follow the re-pointed visits in the same unit:
+            # every record's cells as read above come out, the survivors' refreshed ones go in
+            cohort_ops = []
+            for p in records.values():
+                if p.get("visit_months"):
+                    cohort, inc = cohort_increments(p["visit_months"], p.get("visit_count", 0), sign=-1)
+                    cohort_ops.append(UpdateOne({"cohort": cohort}, {"$inc": inc}))
+            await refresh_visit_summaries(survivors, session=session)
+            async for p in db.patients.find({"patient_id": {"$in": survivors}, "visit_months.0": {"$exists": True}},
+                                            {"_id": 0, "visit_months": 1, "visit_count": 1}, session=session):
+                cohort, inc = cohort_increments(p["visit_months"], p.get("visit_count", 0))
+                cohort_ops.append(UpdateOne({"cohort": cohort}, {"$inc": inc}, upsert=True))
+            if cohort_ops:
+                await db.cohorts.bulk_write(cohort_ops, ordered=True, session=session)
+                await db.cohorts.delete_many({"patients": {"$lte": 0}}, session=session)
+            return counts
+        
+        moved.update(await run_atomic(write_chunk))
+    
+    survivors = list(by_survivor)
+    dup_keys = [f"{kind}:{pid}" for pid in resolved for kind in ("patient", "visits", "consents")]
+    await db.revisions.delete_many({"key": {"$in": dup_keys}})
+    await touch_revisions(
+        *(f"{kind}:{pid}" for pid in survivors for kind in ("patient", "visits", "consents")),
+        *(f"queue:{day}" for day in queue_days),
+        publish=False
+    )
+    await publish_changes(*dup_keys, *(f"{kind}:{pid}" for pid in survivors for kind in ("patient", "visits", "consents")), *(f"queue:{day}" for day in queue_days))
+    
+    return {"merged": len(resolved), "survivors": len(survivors), "moved": dict(moved)}
+
+@api_router.get("/admin/duplicates")
+async def get_duplicate_candidates(
+    min_score: float = Query(65, ge=0, le=100),
+    limit: int = Query(200, ge=1, le=5000),
+    user: dict = Depends(verify_admin)
+):
+    """Scored duplicate-patient candidate pairs, best first - ADMIN ONLY"""
+    async def load():
+        patients = await fetch_raw(analytics_db.patients, {}, duplicates.PATIENT_FIELDS)
+        dismissed = await db.duplicate_dismissals.distinct("pair")
+        return await report_pool.run(duplicates.candidates_json, patients, min_score, limit, dismissed)
+    
+    return json_body(await flights.do("duplicates", (min_score, limit), load))
+
+@api_router.post("/admin/duplicates/dismiss")
+async def dismiss_duplicates(data: DuplicateDismissRequest, user: dict = Depends(verify_admin)):
+    """Mark candidate pairs as different people so they are no longer suggested - ADMIN ONLY"""
+    if any(pair.count("|") != 1 for pair in data.pairs):
+        raise HTTPException(status_code=400, detail="Pairs must be two patient ids joined by '|'")
+    now = datetime.now(timezone.utc).isoformat()
+    await db.duplicate_dismissals.bulk_write([
+        UpdateOne({"pair": duplicates.pair_key(*pair.split("|", 1))},
+                  {"$setOnInsert": {"dismissed_by": user["username"], "dismissed_at": now}}, upsert=True)
+        for pair in data.pairs
+    ], ordered=False)
+    return {"success": True, "dismissed": len(data.pairs)}
+
+@api_router.post("/admin/duplicates/merge")
+async def merge_duplicates(data: DuplicateMergeRequest, user: dict = Depends(verify_admin)):
+    """Merge confirmed duplicates into their survivors, moving visits, consents, queue and audit rows - ADMIN ONLY"""
+    if not await verify_password_for_user(user["username"], data.password):
+        raise HTTPException(status_code=401, detail="Invalid password")
+    
+    result = await merge_patients(resolve_merges(data.merges), user["username"])
     
-    await log_system_event("DELETE_ALL_QUEUE", f"Deleted {count} queue entries", user["username"])
+    await log_system_event("MERGE_PATIENTS", f"Merged {result['merged']} duplicate patients into {result['survivors']}", user["username"])
+    
+    return {"success": True, **result}
+
+# ==========================================
+# BULK IMPORT / EXPORT (ADMIN ONLY)
+# ==========================================
+
+IMPORT_BATCH_SIZE = 500
+IMPORT_MAX_REPORTED_ERRORS = 1000
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+PATIENT_EXPORT_FIELDS = [
+    "patient_id", "first_name", "last_name", "dob", "phone", "email", "street", "city", "postcode",
+    "emergency_name", "emergency_phone", "reason", "medications", "allergies", "conditions",
+    "surgeries", "procedures", "registered_at", "updated_at"
+]
+VISIT_EXPORT_FIELDS = ["visit_id", "patient_id", "date", "treatment", "notes", "consultant"]
+
+def check_bulk_params(kind: str, fmt: str):
+    if kind not in ("patients", "visits"):
+        raise HTTPException(status_code=400, detail="kind must be 'patients' or 'visits'")
+    if fmt not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+
+async def iter_request_lines(request: Request):
+    """Yield (line_number, text) from the request body without buffering it whole"""
+    buffer = b""
+    line_no = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            yield line_no, line.decode("utf-8-sig").rstrip("\r")
+    if buffer:
+        yield line_no + 1, buffer.decode("utf-8-sig").rstrip("\r")
+
+async def iter_import_records(request: Request, fmt: str):
+    """Yield (line_number, record, error) for every data row in an NDJSON or CSV body"""
+    if fmt == "ndjson":
+        async for line_no, line in iter_request_lines(request):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_no, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield line_no, None, "Expected a JSON object"
+                continue
+            yield line_no, record, None
+        return
+    
+    header = None
+    pending = []
+    pending_quotes = 0
+    start_line = 0
+    async for line_no, line in iter_request_lines(request):
+        if not pending:
+            start_line = line_no
+        pending.append(line)
+        pending_quotes += line.count('"')
+        # An odd number of quotes means a quoted field continues on the next line
+        if pending_quotes % 2:
+            continue
+        text = "\n".join(pending)
+        pending = []
+        pending_quotes = 0
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [h.strip().lower() for h in values]
+            continue
+        if len(values) != len(header):
+            yield start_line, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield start_line, dict(zip(header, values)), None
+    if pending:
+        yield start_line, None, "Unterminated quoted field"
+
+def describe_validation_error(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(loc) for loc in err['loc']) or 'row'}: {err['msg']}" for err in e.errors())
+
+async def import_patient_batch(batch: list, stats: dict, record_error):
+    now = datetime.now(timezone.utc).isoformat()
+    # Later rows for the same patient win, so one batch never upserts a key twice
+    by_id = {}
+    for line_no, row in batch:
+        by_id[generate_patient_id(row.first_name, row.last_name, row.dob)] = (line_no, row)
+    
+    ops = []
+    lines = []
+    for patient_id, (line_no, row) in by_id.items():
+        fields = row.model_dump(exclude={"registered_at"})
+        fields.update({
+            "patient_id": patient_id,
+            "first_name": row.first_name.upper(),
+            "last_name": row.last_name.upper(),
+            "postcode": row.postcode.upper(),
+            "allergies": row.allergies or "NKDA",
+            "updated_at": now
+        })
+        fields["quality"] = patient_quality(fields)
+        ops.append(UpdateOne(
+            {"patient_id": patient_id},
+            {"$set": fields, "$setOnInsert": {"registered_at": row.registered_at or now, "visit_count": 0}},
+            upsert=True
+        ))
+        lines.append(line_no)
+    await run_import_bulk(db.patients, ops, lines, stats, record_error)
+    await touch_revisions(*(f"patient:{pid}" for pid in by_id))
+
+async def import_visit_batch(batch: list, stats: dict, record_error):
+    patient_ids = list({row.patient_id for _, row in batch})
+    known = set()
+    async for p in db.patients.find({"patient_id": {"$in": patient_ids}}, {"_id": 0, "patient_id": 1}):
+        known.add(p["patient_id"])
+    
+    by_id = {}
+    for line_no, row in batch:
+        if row.patient_id not in known:
+            record_error(line_no, f"Unknown patient_id {row.patient_id}")
+            continue
+        # Deterministic ids make re-running the same file idempotent
+        visit_id = row.visit_id or str(uuid.uuid5(uuid.NAMESPACE_URL, f"{row.patient_id}|{row.date}|{row.treatment}"))
+        by_id[visit_id] = (line_no, row)
+    
+    ops = []
+    lines = []
+    for visit_id, (line_no, row) in by_id.items():
+        refs = await visit_references(row.treatment, row.consultant)
+        ops.append(UpdateOne(
+            {"visit_id": visit_id},
+            {
+                "$set": {**row.model_dump(exclude={"visit_id", "treatment", "consultant"}), **refs, "visit_id": visit_id, "at": parse_event_time(row.date)},
+                # A re-imported row replaces the visit, including a consultant it no longer names
+                **({} if "consultant_id" in refs else {"$unset": {"consultant_id": ""}})
+            },
+            upsert=True
+        ))
+        lines.append(line_no)
+    await run_import_bulk(db.visits, ops, lines, stats, record_error)
+    affected = list({row.patient_id for _, row in by_id.values()})
+    await refresh_visit_summaries(affected)
+    await touch_revisions(*(f"visits:{pid}" for pid in affected), *(f"patient:{pid}" for pid in affected))
+
+async def run_import_bulk(collection, ops: list, lines: list, stats: dict, record_error):
+    if not ops:
+        return
+    try:
+        result = await collection.bulk_write(ops, ordered=False)
+        details = result.bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+        for err in details.get("writeErrors", []):
+            record_error(lines[err["index"]], err.get("errmsg", "Write failed"))
+    upserted = len(details.get("upserted", []))
+    stats["inserted"] += upserted
+    stats["updated"] += details.get("nModified", 0)
+    stats["unchanged"] += details.get("nMatched", 0) - details.get("nModified", 0)
+
+@api_router.post("/admin/import")
+async def import_records(
+    request: Request,
+    kind: str = "patients",
+    fmt: str = Query("ndjson", alias="format"),
+    user: dict = Depends(verify_admin)
+):
+    """Bulk upsert patients or visits from a streamed NDJSON/CSV body - ADMIN ONLY
+    
+    Patients are keyed on generate_patient_id, visits on visit_id. Invalid rows are
+    skipped and reported by line number; the body is processed in fixed-size batches.
+    """
+    check_bulk_params(kind, fmt)
+    
+    row_model = PatientImportRow if kind == "patients" else VisitImportRow
+    import_batch = import_patient_batch if kind == "patients" else import_visit_batch
+    
+    stats = {"rows": 0, "inserted": 0, "updated": 0, "unchanged": 0, "errors": 0}
+    errors = []
+    
+    def record_error(line_no, message):
+        stats["errors"] += 1
+        if len(errors) < IMPORT_MAX_REPORTED_ERRORS:
+            errors.append({"line": line_no, "error": message})
+    
+    batch = []
+    async for line_no, record, error in iter_import_records(request, fmt):
+        stats["rows"] += 1
+        if error:
+            record_error(line_no, error)
+            continue
+        try:
+            batch.append((line_no, row_model.model_validate(record)))
+        except ValidationError as e:
+            record_error(line_no, describe_validation_error(e))
+            continue
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await import_batch(batch, stats, record_error)
+            batch = []
+    if batch:
+        await import_batch(batch, stats, record_error)
+    if kind == "visits" and stats["inserted"] + stats["updated"]:
+        # Imported visits can land in any month or day, so recompute rather than patch cells
+        await rebuild_cohorts()
+        await rebuild_visit_buckets()
+    if kind == "patients" and stats["inserted"] + stats["updated"]:
+        # Upserts do not say what they replaced, so recount rather than patch the counters
+        await rebuild_quality()
+    
+    await log_system_event(
+        "DATA_IMPORT",
+        f"Imported {kind} ({fmt}): {stats['inserted']} new, {stats['updated']} updated, {stats['errors']} errors",
+        user["username"]
+    )
     
-    return {"success": True, "deleted_count": count}
+    return {"success": stats["errors"] == 0, "kind": kind, **stats, "error_rows": errors}
+
+@api_router.get("/admin/export")
+async def export_records(
+    kind: str = "patients",
+    fmt: str = Query("ndjson", alias="format"),
+    user: dict = Depends(verify_admin)
+):
+    """Stream all patients or visits as NDJSON/CSV straight from a cursor - ADMIN ONLY"""
+    check_bulk_params(kind, fmt)
+    
+    collection = analytics_db.patients if kind == "patients" else analytics_db.visits
+    fields = PATIENT_EXPORT_FIELDS if kind == "patients" else VISIT_EXPORT_FIELDS
+    hidden = PATIENT_INTERNAL_FIELDS if kind == "patients" else ()
+    cursor = collection.find({}, field_projection(None, hidden=hidden)).batch_size(EXPORT_BATCH_SIZE)
+    # Exported visits carry names, as imports expect, rather than catalog ids
+    name_visit = await visit_namer() if kind == "visits" else None
+    
+    async def generate():
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=fields, extrasaction="ignore")
+        if fmt == "csv":
+            writer.writeheader()
+        async for doc in cursor:
+            if name_visit:
+                doc = await name_visit(doc)
+            if fmt == "csv":
+                writer.writerow(doc)
+            else:
+                out.write(json.dumps(doc, default=str))
+                out.write("\n")
+            if out.tell() >= EXPORT_FLUSH_BYTES:
+                yield out.getvalue()
+                out.seek(0)
+                out.truncate()
+        if out.tell():
+            yield out.getvalue()
+    
+    await log_system_event("DATA_EXPORT", f"Exported {kind} as {fmt}", user["username"])
+    
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+    return StreamingResponse(
+        generate(),
+        media_type="text/csv" if fmt == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{kind}_{stamp}.{fmt}"'}
+    )
 
 @api_router.post("/admin/backup")
 async def create_backup(data: PasswordVerify, user: dict = Depends(verify_admin)):
@@ -582,55 +1971,40 @@ async def create_backup(data: PasswordVerify, user: dict = Depends(verify_admin)
     
     now = datetime.now(timezone.utc)
     backup_id = now.strftime("%Y%m%d_%H%M%S")
-    
-    # Collect all data
-    patients = await db.patients.find({}, {"_id": 0}).to_list(50000)
-    visits = await db.visits.find({}, {"_id": 0}).to_list(100000)
-    queue = await db.queue.find({}, {"_id": 0}).to_list(10000)
-    users_data = await db.users.find({}, {"_id": 0}).to_list(100)
-    audit_log = await db.audit_log.find({}, {"_id": 0}).to_list(50000)
-    login_audit = await db.login_audit.find({}, {"_id": 0}).to_list(10000)
-    
-    backup_doc = {
-        "backup_id": backup_id,
-        "created_at": now.isoformat(),
-        "created_by": user["username"],
-        "data": {
-            "patients": patients,
-            "visits": visits,
-            "queue": queue,
-            "users": users_data,
-            "audit_log": audit_log,
-            "login_audit": login_audit
-        },
-        "counts": {
-            "patients": len(patients),
-            "visits": len(visits),
-            "queue": len(queue),
-            "users": len(users_data)
-        }
-    }
-    
-    await db.backups.insert_one(backup_doc)
+    entry = await backups.create(db, backup_id, user["username"], now)
     
     await log_system_event("BACKUP_CREATE", f"Backup {backup_id} created", user["username"])
     
     return {
         "success": True,
         "backup_id": backup_id,
-        "created_at": now.isoformat(),
-        "counts": backup_doc["counts"]
+        "created_at": entry["created_at"],
+        "counts": entry["counts"],
+        "bytes": entry["bytes"]
     }
 
 @api_router.get("/admin/backups")
 async def get_backups(user: dict = Depends(verify_admin)):
     """List all backups - ADMIN ONLY"""
-    backups = await db.backups.find(
+    catalog = await db.backups.find(
         {}, 
-        {"_id": 0, "backup_id": 1, "created_at": 1, "created_by": 1, "counts": 1}
-    ).sort("created_at", -1).to_list(100)
+        {"_id": 0, "backup_id": 1, "created_at": 1, "created_by": 1, "kind": 1, "status": 1, "counts": 1, "bytes": 1,
+         "verification.status": 1, "verification.verified_at": 1, "verification.restore_seconds": 1,
+         "verification.failed_collections": 1, "verification.error": 1}
+    ).sort("created_at", -1).to_list(None)
+    
+    return {"success": True, "backups": catalog}
+
+@api_router.post("/admin/backup/{backup_id}/verify")
+async def verify_backup(backup_id: str, user: dict = Depends(verify_admin)):
+    """Test-restore a backup into the scratch database and compare counts and checksums - ADMIN ONLY"""
+    result = await backups.verify(db, verify_db, backup_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Backup not found or incomplete")
+    
+    await log_system_event("BACKUP_VERIFY", f"Verified backup {backup_id}: {result['status']}", user["username"])
     
-    return {"success": True, "backups": backups}
+    return {"success": True, "backup_id": backup_id, "verification": result}
 
 @api_router.post("/admin/restore/{backup_id}")
 async def restore_backup(backup_id: str, data: PasswordVerify, user: dict = Depends(verify_admin)):
@@ -638,33 +2012,41 @@ async def restore_backup(backup_id: str, data: PasswordVerify, user: dict = Depe
     if not await verify_password_for_user(user["username"], data.password):
         raise HTTPException(status_code=401, detail="Invalid password")
     
-    backup = await db.backups.find_one({"backup_id": backup_id})
+    backup = await db.backups.find_one({"backup_id": backup_id}, {"_id": 0, "status": 1})
     if not backup:
         raise HTTPException(status_code=404, detail="Backup not found")
-    
-    backup_data = backup.get("data", {})
+    if backup.get("status", "complete") != "complete":
+        raise HTTPException(status_code=409, detail="Backup is incomplete and cannot be restored")
     
     # Clear current data
     await db.patients.delete_many({})
     await db.visits.delete_many({})
     await db.queue.delete_many({})
-    
-    # Restore data
-    patients_restored = 0
-    visits_restored = 0
-    queue_restored = 0
-    
-    if backup_data.get("patients"):
-        await db.patients.insert_many(backup_data["patients"])
-        patients_restored = len(backup_data["patients"])
-    
-    if backup_data.get("visits"):
-        await db.visits.insert_many(backup_data["visits"])
-        visits_restored = len(backup_data["visits"])
-    
-    if backup_data.get("queue"):
-        await db.queue.insert_many(backup_data["queue"])
-        queue_restored = len(backup_data["queue"])
+    for name in catalogs.KINDS + ("catalog_counters",):
+        await db[name].delete_many({})
+    
+    # Restore data one payload chunk at a time
+    restored = {}
+    for name in backups.RESTORED_COLLECTIONS:
+        restored[name] = 0
+        async for docs in backups.iter_documents(db, backup_id, name):
+            if docs:
+                await db[name].insert_many(docs)
+                restored[name] += len(docs)
+    patients_restored = restored["patients"]
+    visits_restored = restored["visits"]
+    
+    # Backups taken before visit summaries, native timestamps or catalogs existed restore documents without them
+    await catalog_cache.invalidate()
+    await migrate_visit_catalogs()
+    await migrate_alert_flags()
+    await backfill_visit_summaries()
+    await rebuild_cohorts()
+    await backfill_timeseries()
+    await rebuild_visit_buckets()
+    await refresh_queue_buckets()
+    await rebuild_quality()
+    await invalidate_revisions()
     
     await log_system_event(
         "BACKUP_RESTORE", 
@@ -675,11 +2057,7 @@ async def restore_backup(backup_id: str, data: PasswordVerify, user: dict = Depe
     return {
         "success": True,
         "backup_id": backup_id,
-        "restored": {
-            "patients": patients_restored,
-            "visits": visits_restored,
-            "queue": queue_restored
-        }
+        "restored": restored
     }
 
 @api_router.delete("/admin/backup/{backup_id}")
@@ -688,42 +2066,92 @@ async def delete_backup(backup_id: str, data: PasswordVerify, user: dict = Depen
     if not await verify_password_for_user(user["username"], data.password):
         raise HTTPException(status_code=401, detail="Invalid password")
     
-    result = await db.backups.delete_one({"backup_id": backup_id})
-    if result.deleted_count == 0:
+    if not await backups.delete(db, backup_id):
         raise HTTPException(status_code=404, detail="Backup not found")
     
     await log_system_event("BACKUP_DELETE", f"Deleted backup {backup_id}", user["username"])
     
     return {"success": True}
 
+@api_router.get("/admin/indexes")
+async def get_index_status(check: bool = False, user: dict = Depends(verify_admin)):
+    """Reconcile the index registry; with check=true also explain every known query shape - ADMIN ONLY"""
+    result = {"success": True, "changes": await indexes.reconcile(db)}
+    if check:
+        scans = await indexes.find_collscans(db)
+        result.update({"collection_scans": scans, "shapes_checked": len(indexes.QUERY_SHAPES)})
+        result["success"] = not scans
+    return result
+
+@api_router.get("/admin/coalescing")
+async def get_coalescing_stats(user: dict = Depends(verify_admin)):
+    """How often identical concurrent reads shared one computation, per key - ADMIN ONLY"""
+    return {"success": True, "keys": flights.stats()}
+
+@api_router.get("/admin/jobs")
+async def get_jobs(user: dict = Depends(verify_admin)):
+    """Registered scheduled jobs with their next and last runs - ADMIN ONLY"""
+    return {"jobs": await scheduler.describe()}
+
+@api_router.get("/admin/jobs/{name}/runs")
+async def get_job_runs(name: str, limit: int = Query(50, ge=1, le=500), user: dict = Depends(verify_admin)):
+    """Run history of one job, newest first - ADMIN ONLY"""
+    if name not in scheduler.jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+    runs = await db.job_runs.find({"job": name}, {"_id": 0}).sort("started_at", -1).to_list(limit)
+    return {"job": name, "runs": runs}
+
+@api_router.post("/admin/jobs/{name}/run")
+async def run_job(name: str, user: dict = Depends(verify_admin)):
+    """Trigger a job now, in the background - ADMIN ONLY"""
+    if name not in scheduler.jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+    try:
+        run_id = await scheduler.run_now(name, user["username"])
+    except jobs.JobAlreadyRunning:
+        raise HTTPException(status_code=409, detail="Job is already running")
+    
+    await log_system_event("JOB_RUN", f"Manually started job {name}", user["username"])
+    
+    return {"success": True, "job": name, "run_id": run_id}
+
 # ==========================================
 # PATIENT ENDPOINTS
 # ==========================================
 
+# Bookkeeping on patient records (cohort months, data quality, merge history);
+# patient reads and exports leave it out unless fields= asks for it
+PATIENT_INTERNAL_FIELDS = ("visit_months", "quality", "merged_from")
+
 @api_router.get("/patients")
-async def get_all_patients(user: dict = Depends(verify_token)):
-    patients = await db.patients.find({}, {"_id": 0}).sort("last_name", 1).to_list(10000)
-    
-    visited_ids = set()
-    async for visit in db.visits.find({}, {"patient_id": 1}):
-        visited_ids.add(visit["patient_id"])
-    
-    result = []
-    for p in patients:
-        result.append({
-            **p,
-            "is_new": p["patient_id"] not in visited_ids,
-            "name": f"{p['first_name']} {p['last_name']}"
-        })
+async def get_all_patients(fields: Optional[str] = None, user: dict = Depends(verify_token)):
+    wanted = parse_fields(fields)
     
-    return result
+    async def load():
+        patients = await db.patients.find(
+            {}, field_projection(wanted, ("patient_id", "first_name", "last_name", "visit_count"), PATIENT_INTERNAL_FIELDS)
+        ).sort("last_name", 1).to_list(10000)
+        
+        result = []
+        for p in patients:
+            result.append(select_fields({
+                **p,
+                "is_new": not p.get("visit_count"),
+                "name": f"{p['first_name']} {p['last_name']}"
+            }, wanted))
+        return FastJSONResponse(result).body
+    
+    return json_body(await flights.do("patients", fields_key(wanted), load))
 
 @api_router.get("/patients/{patient_id}")
-async def get_patient(patient_id: str, user: dict = Depends(verify_token)):
-    patient = await db.patients.find_one({"patient_id": patient_id}, {"_id": 0})
-    if not patient:
-        raise HTTPException(status_code=404, detail="Patient not found")
-    return patient
+async def get_patient(patient_id: str, request: Request, user: dict = Depends(verify_token)):
+    async def load():
+        patient = await db.patients.find_one({"patient_id": patient_id}, field_projection(None, hidden=PATIENT_INTERNAL_FIELDS))
+        if not patient:
+            raise HTTPException(status_code=404, detail="Patient not found")
+        return patient
+    
+    return await conditional_response(request, f"patient:{patient_id}", load)
 
 @api_router.put("/patients/{patient_id}")
 async def update_patient(patient_id: str, data: PatientUpdate, user: dict = Depends(verify_token)):
@@ -746,7 +2174,10 @@ async def update_patient(patient_id: str, data: PatientUpdate, user: dict = Depe
                 "user": user["username"]
             })
     
+    update_data["quality"] = patient_quality({**patient, **update_data})
     await db.patients.update_one({"patient_id": patient_id}, {"$set": update_data})
+    await apply_quality_changes([(patient.get("quality"), update_data["quality"])])
+    await touch_revisions(f"patient:{patient_id}")
     
     return {"success": True}
 
@@ -762,12 +2193,39 @@ async def delete_patient(patient_id: str, data: PasswordVerify, user: dict = Dep
     
     patient_name = f"{patient.get('first_name', '')} {patient.get('last_name', '')}"
     
-    await db.patients.delete_one({"patient_id": patient_id})
-    await db.visits.delete_many({"patient_id": patient_id})
+    bucket_ops = []
+    bucket_days = []
+    async for v in db.visits.find({"patient_id": patient_id}, {"_id": 0, "at": 1, "date": 1, "treatment_ids": 1, "consultant_id": 1}):
+        day, inc = visit_bucket_inc(v, sign=-1)
+        if day:
+            bucket_ops.append(UpdateOne({"day": day}, {"$inc": inc}))
+            bucket_days.append(day)
+    queue_days = await db.queue.distinct("date", {"patient_id": patient_id})
+    
+    # The patient and their share of the aggregates go now; their visits, consents,
+    # queue and audit rows are removed in the background
+    async def erase(session):
+        await db.patients.delete_one({"patient_id": patient_id}, session=session)
+        await apply_quality_changes([(patient.get("quality"), None)], session=session)
+        if bucket_ops:
+            await db.visit_buckets.bulk_write(bucket_ops, ordered=False, session=session)
+            await db.visit_buckets.delete_many({"day": {"$in": bucket_days}, "count": {"$lte": 0}}, session=session)
+        if patient.get("visit_months"):
+            cohort, inc = cohort_increments(patient["visit_months"], patient.get("visit_count", 0), sign=-1)
+            await db.cohorts.update_one({"cohort": cohort}, {"$inc": inc}, session=session)
+            await db.cohorts.delete_one({"cohort": cohort, "patients": {"$lte": 0}}, session=session)
+        await touch_revisions(f"patient:{patient_id}", f"visits:{patient_id}", session=session, publish=False)
+        return await deletion_engine.submit("patient", user["username"], {
+            "patient_id": patient_id, "queue_days": queue_days
+        }, session=session)
+    
+    task = await run_atomic(erase)
+    deletion_engine.kick()
+    await publish_changes(f"patient:{patient_id}", f"visits:{patient_id}")
     
     await log_system_event("DELETE", f"Deleted patient {patient_name}", user["username"], patient_id, "Full Record", patient_name, "DELETED")
     
-    return {"success": True}
+    return {"success": True, "task_id": task["task_id"]}
 
 @api_router.get("/patients/{patient_id}/audit")
 async def get_patient_audit(patient_id: str, user: dict = Depends(verify_token)):
@@ -788,7 +2246,8 @@ async def get_patient_pdf(patient_id: str, data: PasswordVerify, user: dict = De
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
     
-    visits = await db.visits.find({"patient_id": patient_id}, {"_id": 0}).sort("date", -1).to_list(100)
+    name_visit = await visit_namer()
+    visits = [await name_visit(v) for v in await db.visits.find({"patient_id": patient_id}, {"_id": 0}).sort("date", -1).to_list(100)]
     
     # Get consents with signatures
     consents = await db.consents.find({"patient_id": patient_id}, {"_id": 0}).sort("timestamp", -1).to_list(50)
@@ -942,6 +2401,7 @@ async def kiosk_register(data: KioskRegistration):
     today = now.strftime("%Y-%m-%d")
     
     existing = await db.patients.find_one({"patient_id": patient_id})
+    touched = [f"patient:{patient_id}"]
     
     patient_data = {
         "patient_id": patient_id,
@@ -964,12 +2424,17 @@ async def kiosk_register(data: KioskRegistration):
         "updated_at": now.isoformat()
     }
     
+    patient_data["quality"] = patient_quality(patient_data)
+    
     if existing:
         await db.patients.update_one({"patient_id": patient_id}, {"$set": patient_data})
+        await apply_quality_changes([(existing.get("quality"), patient_data["quality"])])
         await log_system_event("KIOSK_UPDATE", f"Updated via kiosk", "KIOSK", patient_id)
     else:
         patient_data["registered_at"] = now.isoformat()
+        patient_data["visit_count"] = 0
         await db.patients.insert_one(patient_data)
+        await apply_quality_changes([(None, patient_data["quality"])])
         await log_system_event("KIOSK_REGISTER", f"New patient registered via kiosk", "KIOSK", patient_id, "Registration", "", f"{data.first_name} {data.last_name}")
     
     # Save consent record with signatures
@@ -982,12 +2447,14 @@ async def kiosk_register(data: KioskRegistration):
             "signature_data_processing": data.signature_data_processing,
             "signature_medical_disclaimer": data.signature_medical_disclaimer,
             "alerts_declared": data.alerts,
+            "alert_flags": alert_flags.parse(data.alerts),
             "conditions_declared": data.conditions,
             "medications_declared": data.medications,
             "allergies_declared": data.allergies or "NKDA",
             "reason_declared": data.reason
         }
         await db.consents.insert_one(consent_record)
+        touched.append(f"consents:{patient_id}")
         await log_system_event("CONSENT_SIGNED", f"Patient signed consents", "KIOSK", patient_id)
     
     if not data.skip_queue:
@@ -996,36 +2463,55 @@ async def kiosk_register(data: KioskRegistration):
         queue_entry = {
             "date": today,
             "timestamp": now.isoformat(),
+            "at": now,
             "patient_id": patient_id,
             "first_name": data.first_name.strip().upper(),
             "last_name": data.last_name.strip().upper(),
             "reason": data.reason,
-            "alerts": data.alerts,
+            "alert_flags": alert_flags.parse(data.alerts),
             "status": "WAITING"
         }
         await db.queue.insert_one(queue_entry)
+        await refresh_queue_buckets([today])
+        touched.append(f"queue:{today}")
         await log_system_event("QUEUE_ADD", f"Added to queue: {data.reason}", "KIOSK", patient_id)
         logger.info(f"Added patient {patient_id} to queue for {today}")
     
+    await touch_revisions(*touched)
+    
     return {"success": True, "patient_id": patient_id}
 
 @api_router.get("/queue")
-async def get_queue(user: dict = Depends(verify_token)):
+async def get_queue(request: Request, user: dict = Depends(verify_token)):
     today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    queue = await db.queue.find({"date": today, "status": {"$ne": "DONE"}}, {"_id": 0}).sort("timestamp", 1).to_list(100)
-    return queue
+    
+    async def load():
+        queue = await db.queue.find({"date": today, "status": {"$ne": "DONE"}}, {"_id": 0, "at": 0}).sort("timestamp", 1).to_list(100)
+        for entry in queue:
+            entry["alerts"] = alert_flags.display(entry.get("alert_flags"))
+        return queue
+    
+    return await conditional_response(request, f"queue:{today}", load, "waiting")
 
 @api_router.get("/queue/all")
-async def get_all_queue(user: dict = Depends(verify_token)):
+async def get_all_queue(request: Request, user: dict = Depends(verify_token)):
     today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    queue = await db.queue.find({"date": today}, {"_id": 0}).sort("timestamp", 1).to_list(100)
-    return queue
+    
+    async def load():
+        queue = await db.queue.find({"date": today}, {"_id": 0, "at": 0}).sort("timestamp", 1).to_list(100)
+        for entry in queue:
+            entry["alerts"] = alert_flags.display(entry.get("alert_flags"))
+        return queue
+    
+    return await conditional_response(request, f"queue:{today}", load, "all")
 
 @api_router.post("/queue/{patient_id}/complete")
 async def complete_queue_entry(patient_id: str, user: dict = Depends(verify_token)):
     today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     await db.queue.update_one({"patient_id": patient_id, "date": today}, {"$set": {"status": "DONE"}})
     await db.patients.update_one({"patient_id": patient_id}, {"$set": {"reason": ""}})
+    await refresh_queue_buckets([today])
+    await touch_revisions(f"queue:{today}", f"patient:{patient_id}")
     return {"success": True}
 
 # ==========================================
@@ -1034,35 +2520,90 @@ async def complete_queue_entry(patient_id: str, user: dict = Depends(verify_toke
 
 @api_router.post("/visits")
 async def create_visit(data: VisitCreate, user: dict = Depends(verify_token)):
-    patient = await db.patients.find_one({"patient_id": data.patient_id})
-    if not patient:
-        raise HTTPException(status_code=404, detail="Patient not found")
+    """Record a visit, close today's queue entry and update the patient's visit summary in one unit"""
+    now = datetime.now(timezone.utc)
+    today = now.strftime("%Y-%m-%d")
+    month = now.strftime("%Y-%m")
     
     visit = {
         "visit_id": str(uuid.uuid4()),
         "patient_id": data.patient_id,
-        "date": datetime.now(timezone.utc).isoformat(),
-        "treatment": data.treatment,
-        "notes": data.notes,
-        "consultant": data.consultant
+        "date": now.isoformat(),
+        "at": now,
+        "notes": data.notes
     }
     
-    await db.visits.insert_one(visit)
+    changed = (f"patient:{data.patient_id}", f"visits:{data.patient_id}", f"queue:{today}")
+    
+    async def write_visit(session):
+        # The summary update doubles as the existence check, saving a find_one round trip
+        patient = await db.patients.find_one_and_update(
+            {"patient_id": data.patient_id},
+            {
+                "$set": {"reason": ""},
+                "$inc": {"visit_count": 1},
+                "$min": {"first_visit": visit["date"]},
+                "$max": {"last_visit": visit["date"]},
+                "$addToSet": {"visit_months": month}
+            },
+            projection={"_id": 0, "patient_id": 1, "visit_months": 1},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if not patient:
+            raise HTTPException(status_code=404, detail="Patient not found")
+        # Resolved once the patient exists and inside the visit's transaction, so a rejected
+        # or rolled-back visit leaves no catalog entries behind
+        visit.update(await visit_references(data.treatment, data.consultant, session))
+        day, bucket_inc = visit_bucket_inc(visit)
+        
+        # The pre-update month set tells whether this is the patient's first visit ever / this month
+        months = patient.get("visit_months") or []
+        cohort = min(months) if months else month
+        cohort_inc = {"visits": 1}
+        if not months:
+            cohort_inc["patients"] = 1
+        if month not in months:
+            cohort_inc[f"active.{month_offset(cohort, month)}"] = 1
+        
+        # Built lazily: a write that fails inside the transaction leaves no coroutine un-awaited
+        writes = [
+            lambda: db.visits.insert_one(dict(visit), session=session),
+            lambda: db.queue.update_one({"patient_id": data.patient_id, "date": today}, {"$set": {"status": "DONE"}}, session=session),
+            lambda: db.cohorts.update_one({"cohort": cohort}, {"$inc": cohort_inc}, upsert=True, session=session),
+            lambda: db.visit_buckets.update_one({"day": day}, {"$inc": bucket_inc}, upsert=True, session=session),
+            lambda: log_system_event("NEW_VISIT", f"Treatment: {data.treatment}", user["username"], data.patient_id, "Visit", "", data.treatment, session=session)
+        ]
+        if session is None:
+            await asyncio.gather(*(write() for write in writes))
+        else:
+            # Operations sharing a session must not run concurrently
+            for write in writes:
+                await write()
+        
+        await touch_revisions(*changed, session=session, publish=False)
     
-    # Log new visit
-    await log_system_event("NEW_VISIT", f"Treatment: {data.treatment}", user["username"], data.patient_id, "Visit", "", data.treatment)
-    
-    # Mark queue entry as done
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    await db.queue.update_one({"patient_id": data.patient_id, "date": today}, {"$set": {"status": "DONE"}})
-    await db.patients.update_one({"patient_id": data.patient_id}, {"$set": {"reason": ""}})
+    await run_atomic(write_visit)
+    await refresh_queue_buckets([today])
+    await publish_changes(*changed)
     
     return {"success": True, "visit_id": visit["visit_id"]}
 
 @api_router.get("/visits/{patient_id}")
-async def get_patient_visits(patient_id: str, user: dict = Depends(verify_token)):
-    visits = await db.visits.find({"patient_id": patient_id}, {"_id": 0}).sort("date", -1).to_list(100)
-    return visits
+async def get_patient_visits(patient_id: str, request: Request, fields: Optional[str] = None, user: dict = Depends(verify_token)):
+    wanted = parse_fields(fields)
+    if wanted is not None:
+        # Names are stored as catalog ids
+        wanted |= {ref for field, ref in (("treatment", "treatment_ids"), ("consultant", "consultant_id")) if field in wanted}
+    
+    async def load():
+        name_visit = await visit_namer()
+        visits = await db.visits.find({"patient_id": patient_id}, field_projection(wanted, hidden=("at",))).sort("date", -1).to_list(100)
+        return [await name_visit(v) for v in visits]
+    
+    # Same selection, same ETag, however the fields are ordered or spaced
+    variant = "fields=" + ",".join(fields_key(wanted)) if wanted is not None else ""
+    return await conditional_response(request, f"visits:{patient_id}", load, variant)
 
 @api_router.put("/visits/{visit_id}")
 async def update_visit(visit_id: str, data: dict, user: dict = Depends(verify_token)):
@@ -1073,13 +2614,17 @@ async def update_visit(visit_id: str, data: dict, user: dict = Depends(verify_to
     
     patient_id = visit.get("patient_id")
     changes_made = []
+    old_ids = visit.get("treatment_ids") or []
     
     # Only allow updating treatment and notes, not date
-    if "treatment" in data and data["treatment"] != visit.get("treatment"):
-        old_val = visit.get("treatment", "")
-        new_val = data["treatment"]
-        await log_system_event("UPDATE", f"Visit treatment changed", user["username"], patient_id, "visit_treatment", old_val, new_val)
-        changes_made.append("treatment")
+    if "treatment" in data:
+        new_ids = await catalog_ids("treatments", catalogs.split_treatments(data["treatment"]))
+        if new_ids != old_ids:
+            treatments = await get_catalog("treatments")
+            old_val = "\n".join(treatments.name(t) for t in old_ids)
+            new_val = "\n".join(treatments.name(t) for t in new_ids)
+            await log_system_event("UPDATE", f"Visit treatment changed", user["username"], patient_id, "visit_treatment", old_val, new_val)
+            changes_made.append("treatment")
     
     if "notes" in data and data["notes"] != visit.get("notes"):
         old_val = visit.get("notes", "")
@@ -1089,29 +2634,128 @@ async def update_visit(visit_id: str, data: dict, user: dict = Depends(verify_to
     
     if changes_made:
         update_data = {}
-        if "treatment" in data:
-            update_data["treatment"] = data["treatment"]
+        if "treatment" in changes_made:
+            update_data["treatment_ids"] = new_ids
         if "notes" in data:
             update_data["notes"] = data["notes"]
         
         await db.visits.update_one({"visit_id": visit_id}, {"$set": update_data})
+        at = parse_event_time(visit.get("at") or visit.get("date"))
+        if "treatment" in changes_made and at:
+            inc = Counter()
+            for t in old_ids or [None]:
+                inc[f"treatments.{bucket_key(t)}"] -= 1
+            for t in new_ids or [None]:
+                inc[f"treatments.{bucket_key(t)}"] += 1
+            inc = {k: v for k, v in inc.items() if v}
+            if inc:
+                await db.visit_buckets.update_one({"day": day_start(at)}, {"$inc": inc})
+        await touch_revisions(f"visits:{patient_id}")
     
     return {"success": True, "changes": changes_made}
 
+@api_router.get("/patients/{patient_id}/alerts")
+async def get_patient_alert_history(patient_id: str, user: dict = Depends(verify_token)):
+    """Flags raised at each of the patient's check-ins and declared on each consent, newest first"""
+    checkins, consents = await asyncio.gather(
+        db.queue.find(
+            {"patient_id": patient_id, "alert_flags.0": {"$exists": True}}, {"_id": 0, "date": 1, "timestamp": 1, "alert_flags": 1}
+        ).sort("timestamp", -1).to_list(200),
+        db.consents.find(
+            {"patient_id": patient_id, "alert_flags.0": {"$exists": True}}, {"_id": 0, "timestamp": 1, "alert_flags": 1}
+        ).sort("timestamp", -1).to_list(200)
+    )
+    history = [{"source": "checkin", **c} for c in checkins] + [{"source": "consent", **c} for c in consents]
+    history.sort(key=lambda h: h["timestamp"], reverse=True)
+    for entry in history:
+        entry["alerts"] = alert_flags.display(entry["alert_flags"])
+    counts = Counter(code for entry in checkins for code in entry["alert_flags"])
+    return {
+        "success": True,
+        "history": history,
+        "flags": [{"code": code, "alert": alert_flags.label(code), "checkins": n} for code, n in counts.most_common()]
+    }
+
 @api_router.get("/patients/{patient_id}/consents")
-async def get_patient_consents(patient_id: str, user: dict = Depends(verify_token)):
+async def get_patient_consents(patient_id: str, request: Request, user: dict = Depends(verify_token)):
     """Get all consent records for a patient with signatures"""
-    consents = await db.consents.find({"patient_id": patient_id}, {"_id": 0}).sort("timestamp", -1).to_list(100)
-    return {"success": True, "consents": consents}
+    async def load():
+        consents = await db.consents.find({"patient_id": patient_id}, {"_id": 0}).sort("timestamp", -1).to_list(100)
+        return {"success": True, "consents": consents}
+    
+    return await conditional_response(request, f"consents:{patient_id}", load)
+
+# ==========================================
+# CATALOG ENDPOINTS
+# ==========================================
+
+@api_router.get("/catalogs/{kind}")
+async def get_catalog_entries(kind: str, include_inactive: bool = False, user: dict = Depends(verify_token)):
+    """Treatments or consultants for autocomplete, served from the worker's in-memory copy"""
+    check_catalog_kind(kind)
+    return {"success": True, "entries": (await get_catalog(kind)).listing(include_inactive)}
+
+@api_router.post("/admin/catalogs/{kind}")
+async def create_catalog_entry(kind: str, data: CatalogEntryCreate, user: dict = Depends(verify_manager_or_admin)):
+    check_catalog_kind(kind)
+    try:
+        entry = await catalogs.create(db, kind, data.name, data.aliases)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="That name or alias is already catalogued")
+    await catalog_cache.invalidate(kind)
+    await log_system_event("CATALOG_CREATE", f"Added {kind[:-1]} {entry['name']}", user["username"], field=kind, new_value=entry["name"])
+    return {"success": True, "entry": {k: entry[k] for k in ("id", "name", "aliases", "active")}}
+
+@api_router.put("/admin/catalogs/{kind}/{entry_id}")
+async def update_catalog_entry(kind: str, entry_id: int, data: CatalogEntryUpdate, user: dict = Depends(verify_manager_or_admin)):
+    """Rename, re-alias or retire an entry; retired entries stay on past visits but leave autocomplete"""
+    check_catalog_kind(kind)
+    old = (await get_catalog(kind)).by_id.get(entry_id)
+    try:
+        entry = await catalogs.update(db, kind, entry_id, data.name, data.aliases, data.active)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="That name or alias belongs to another entry")
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Catalog entry not found")
+    await catalog_cache.invalidate(kind)
+    if old and old["name"] != entry["name"]:
+        # Visit listings show the name, so their cached copies are stale
+        await invalidate_revisions("visits")
+    await log_system_event(
+        "CATALOG_UPDATE", f"Updated {kind[:-1]} {entry_id}", user["username"],
+        field=kind, old_value=(old or {}).get("name", ""), new_value=entry["name"]
+    )
+    return {"success": True, "entry": {k: entry[k] for k in ("id", "name", "aliases", "active")}}
+
+@api_router.post("/admin/catalogs/{kind}/{entry_id}/merge")
+async def merge_catalog_entry(kind: str, entry_id: int, data: CatalogMerge, user: dict = Depends(verify_manager_or_admin)):
+    """Fold a duplicate entry into another: its visits move over and its names become aliases"""
+    check_catalog_kind(kind)
+    if entry_id == data.into_id:
+        raise HTTPException(status_code=400, detail="An entry cannot be merged into itself")
+    changed = await catalogs.merge(db, kind, entry_id, data.into_id)
+    if changed is None:
+        raise HTTPException(status_code=404, detail="Catalog entry not found")
+    await catalog_cache.invalidate(kind)
+    await rebuild_visit_buckets()
+    await invalidate_revisions("visits")
+    await log_system_event(
+        "CATALOG_MERGE", f"Merged {kind[:-1]} {entry_id} into {data.into_id} ({changed} visits)", user["username"]
+    )
+    return {"success": True, "visits_updated": changed}
 
 # ==========================================
 # KIOSK SETTINGS
 # ==========================================
 
+async def load_kiosk_settings() -> Optional[dict]:
+    """Kiosk settings, cached per worker; every kiosk screen polls them"""
+    return await kiosk_settings_cache.get("kiosk", lambda: db.settings.find_one({"type": "kiosk"}, {"_id": 0}))
+
 @api_router.get("/kiosk/settings")
 async def get_kiosk_settings():
     """Get kiosk settings (public endpoint for kiosk mode)"""
-    settings = await db.settings.find_one({"type": "kiosk"})
+    settings = await load_kiosk_settings()
     if not settings:
         return {"exit_pin": "1234"}
     return {"exit_pin": settings.get("exit_pin", "1234")}
@@ -1124,13 +2768,14 @@ async def update_kiosk_settings(data: KioskSettings, user: dict = Depends(verify
         {"$set": {"type": "kiosk", "exit_pin": data.exit_pin}},
         upsert=True
     )
+    await kiosk_settings_cache.invalidate("kiosk")
     await log_system_event("KIOSK_SETTINGS", f"Updated kiosk PIN", user["username"])
     return {"success": True}
 
 @api_router.post("/kiosk/verify-pin")
 async def verify_kiosk_pin(pin: str):
     """Verify PIN to exit kiosk mode"""
-    settings = await db.settings.find_one({"type": "kiosk"})
+    settings = await load_kiosk_settings()
     correct_pin = settings.get("exit_pin", "1234") if settings else "1234"
     return {"success": pin == correct_pin}
 
@@ -1139,41 +2784,56 @@ async def verify_kiosk_pin(pin: str):
 # ==========================================
 
 @api_router.get("/dashboard")
-async def get_dashboard_data(user: dict = Depends(verify_token)):
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    
-    patients = await db.patients.find({}, {"_id": 0}).sort("last_name", 1).to_list(10000)
-    queue = await db.queue.find({"date": today, "status": {"$ne": "DONE"}}, {"_id": 0}).sort("timestamp", 1).to_list(100)
+async def get_dashboard_data(fields: Optional[str] = None, queue_ids: bool = False, user: dict = Depends(verify_token)):
+    """Patient list plus today's queue.
     
-    visited_ids = set()
-    async for visit in db.visits.find({}, {"patient_id": 1}):
-        visited_ids.add(visit["patient_id"])
-    
-    queue_map = {q["patient_id"]: q for q in queue}
-    
-    all_patients = []
-    queue_patients = []
-    
-    for p in patients:
-        pid = p["patient_id"]
-        patient_data = {
-            **p,
-            "name": f"{p['first_name']} {p['last_name']}",
-            "is_new": pid not in visited_ids,
-            "alerts": queue_map.get(pid, {}).get("alerts", ""),
-            "queue_reason": queue_map.get(pid, {}).get("reason", "")
-        }
-        all_patients.append(patient_data)
+    fields= trims each patient to the listed keys; queue_ids=true returns the queue
+    as patient_ids instead of repeating the patient objects already sent in "all".
+    """
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    wanted = parse_fields(fields)
+    
+    async def load():
+        patients = await db.patients.find(
+            {}, field_projection(wanted, ("patient_id", "first_name", "last_name", "visit_count"), PATIENT_INTERNAL_FIELDS)
+        ).sort("last_name", 1).to_list(10000)
+        queue = await db.queue.find(
+            {"date": today, "status": {"$ne": "DONE"}}, {"_id": 0, "patient_id": 1, "alert_flags": 1, "reason": 1}
+        ).sort("timestamp", 1).to_list(100)
         
-        if pid in queue_map:
-            queue_patients.append(patient_data)
+        queue_map = {q["patient_id"]: q for q in queue}
+        
+        all_patients = []
+        queue_patients = []
+        
+        for p in patients:
+            pid = p["patient_id"]
+            patient_data = select_fields({
+                **p,
+                "name": f"{p['first_name']} {p['last_name']}",
+                "is_new": not p.get("visit_count"),
+                "alerts": alert_flags.display(queue_map.get(pid, {}).get("alert_flags")),
+                "alert_flags": queue_map.get(pid, {}).get("alert_flags", []),
+                "queue_reason": queue_map.get(pid, {}).get("reason", "")
+            }, wanted)
+            all_patients.append(patient_data)
+            
+            if pid in queue_map:
+                queue_patients.append(pid if queue_ids else patient_data)
+        
+        return FastJSONResponse({"success": True, "all": all_patients, "queue": queue_patients}).body
     
-    return {"success": True, "all": all_patients, "queue": queue_patients}
+    return json_body(await flights.do("dashboard", (today, fields_key(wanted), queue_ids), load))
 
 # ==========================================
 # COMPREHENSIVE REPORTS ENDPOINTS
 # ==========================================
 
+async def fetch_raw(collection, query: dict, projection: dict) -> bytes:
+    """Matching documents as one blob of concatenated BSON, never decoded on the event loop"""
+    cursor = collection.find_raw_batches(query, projection).limit(REPORT_MAX_ROWS).max_time_ms(REPORT_MAX_TIME_MS)
+    return b"".join([batch async for batch in cursor])
+
 @api_router.get("/reports/comprehensive")
 async def get_comprehensive_reports(
     start_date: Optional[str] = None,
@@ -1181,423 +2841,225 @@ async def get_comprehensive_reports(
     user: dict = Depends(verify_token)
 ):
     """Get all reports data in one call"""
-    if not end_date:
-        end_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    if not start_date:
-        start_date = (datetime.now(timezone.utc) - timedelta(days=30)).strftime("%Y-%m-%d")
-    
-    # Get all visits in range
-    visits = await db.visits.find({
-        "date": {"$gte": start_date, "$lte": end_date + "T23:59:59"}
-    }, {"_id": 0}).to_list(50000)
-    
-    # Get all patients
-    patients = await db.patients.find({}, {"_id": 0}).to_list(50000)
-    patients_map = {p["patient_id"]: p for p in patients}
-    
-    # Get queue data for the period
-    queue_data = await db.queue.find({
-        "date": {"$gte": start_date, "$lte": end_date}
-    }, {"_id": 0}).to_list(50000)
-    
-    # Calculate date range
-    start_dt = datetime.fromisoformat(start_date)
-    end_dt = datetime.fromisoformat(end_date)
-    total_days = max(1, (end_dt - start_dt).days + 1)
-    
-    # ==========================================
-    # 1. VISIT TRENDS
-    # ==========================================
-    daily_visits = defaultdict(int)
-    weekly_visits = defaultdict(int)
-    monthly_visits = defaultdict(int)
-    
-    for v in visits:
-        try:
-            dt = datetime.fromisoformat(v["date"].replace("Z", "+00:00"))
-            day = dt.strftime("%Y-%m-%d")
-            week = dt.strftime("%Y-W%W")
-            month = dt.strftime("%Y-%m")
-            daily_visits[day] += 1
-            weekly_visits[week] += 1
-            monthly_visits[month] += 1
-        except:
-            pass
-    
-    daily_counts = list(daily_visits.values()) if daily_visits else [0]
-    peak_day = max(daily_visits.items(), key=lambda x: x[1]) if daily_visits else ("N/A", 0)
-    worst_day = min(daily_visits.items(), key=lambda x: x[1]) if daily_visits else ("N/A", 0)
-    avg_daily = round(sum(daily_counts) / total_days, 1)
-    
-    visit_trends = {
-        "daily_stats": dict(sorted(daily_visits.items())),
-        "weekly_stats": dict(sorted(weekly_visits.items())),
-        "monthly_stats": dict(sorted(monthly_visits.items())),
-        "peak_day": {"date": peak_day[0], "count": peak_day[1]},
-        "worst_day": {"date": worst_day[0], "count": worst_day[1]},
-        "avg_daily": avg_daily,
-        "total_visits": len(visits)
-    }
-    
-    # ==========================================
-    # 2. CONSULTANT WORKLOAD
-    # ==========================================
-    consultant_visits = defaultdict(int)
-    consultant_weekly = defaultdict(lambda: defaultdict(int))
-    
-    for v in visits:
-        consultant = v.get("consultant", "Unknown")
-        consultant_visits[consultant] += 1
-        try:
-            dt = datetime.fromisoformat(v["date"].replace("Z", "+00:00"))
-            week = dt.strftime("%Y-W%W")
-            consultant_weekly[consultant][week] += 1
-        except:
-            pass
-    
-    total_consultant_visits = sum(consultant_visits.values())
-    consultant_stats = []
-    for name, count in sorted(consultant_visits.items(), key=lambda x: -x[1]):
-        pct = round(count / total_consultant_visits * 100, 1) if total_consultant_visits else 0
-        consultant_stats.append({
-            "name": name,
-            "count": count,
-            "percentage": pct,
-            "weekly_trend": dict(sorted(consultant_weekly[name].items()))
-        })
-    
-    top_consultant = consultant_stats[0] if consultant_stats else {"name": "N/A", "count": 0}
-    
-    consultant_workload = {
-        "consultants": consultant_stats,
-        "top_consultant": top_consultant,
-        "total_visits": total_consultant_visits
-    }
-    
-    # ==========================================
-    # 3. TREATMENT MIX
-    # ==========================================
-    treatment_counts = defaultdict(int)
-    treatment_monthly = defaultdict(lambda: defaultdict(int))
-    
-    for v in visits:
-        treatment = v.get("treatment", "Unknown")
-        treatment_counts[treatment] += 1
-        try:
-            dt = datetime.fromisoformat(v["date"].replace("Z", "+00:00"))
-            month = dt.strftime("%Y-%m")
-            treatment_monthly[treatment][month] += 1
-        except:
-            pass
-    
-    total_treatments = sum(treatment_counts.values())
-    treatment_stats = []
-    for name, count in sorted(treatment_counts.items(), key=lambda x: -x[1])[:20]:  # Top 20
-        pct = round(count / total_treatments * 100, 1) if total_treatments else 0
-        treatment_stats.append({
-            "name": name,
-            "count": count,
-            "percentage": pct,
-            "monthly_trend": dict(sorted(treatment_monthly[name].items()))
-        })
-    
-    treatment_mix = {
-        "treatments": treatment_stats,
-        "total": total_treatments
-    }
-    
-    # ==========================================
-    # 4. NEW VS RETURNING PATIENTS
-    # ==========================================
-    # First visits per patient
-    patient_first_visit = {}
-    patient_visit_count = defaultdict(int)
-    
-    all_visits_sorted = sorted(visits, key=lambda x: x.get("date", ""))
-    for v in all_visits_sorted:
-        pid = v["patient_id"]
-        patient_visit_count[pid] += 1
-        if pid not in patient_first_visit:
-            patient_first_visit[pid] = v["date"]
-    
-    # New patients in range (first visit in range)
-    new_patient_visits = 0
-    returning_patient_visits = 0
-    patients_with_multiple = 0
-    
-    for v in visits:
-        pid = v["patient_id"]
-        first_visit_date = patient_first_visit.get(pid, "")[:10]
-        if first_visit_date >= start_date and first_visit_date <= end_date:
-            if v["date"][:10] == first_visit_date:
-                new_patient_visits += 1
-            else:
-                returning_patient_visits += 1
-        else:
-            returning_patient_visits += 1
-    
-    # Patients with 2+ visits in period
-    patients_in_period = set(v["patient_id"] for v in visits)
-    for pid in patients_in_period:
-        visits_in_period = sum(1 for v in visits if v["patient_id"] == pid)
-        if visits_in_period >= 2:
-            patients_with_multiple += 1
-    
-    repeat_rate = round(patients_with_multiple / len(patients_in_period) * 100, 1) if patients_in_period else 0
-    
-    new_vs_returning = {
-        "new_patient_visits": new_patient_visits,
-        "returning_visits": returning_patient_visits,
-        "unique_patients": len(patients_in_period),
-        "repeat_patients": patients_with_multiple,
-        "repeat_rate": repeat_rate,
-        "new_registrations": await db.patients.count_documents({
-            "registered_at": {"$gte": start_date, "$lte": end_date + "T23:59:59"}
-        })
-    }
-    
-    # ==========================================
-    # 5. INACTIVE PATIENTS (Lost / Follow-up needed)
-    # ==========================================
-    today = datetime.now(timezone.utc)
-    inactive_60 = []
-    inactive_90 = []
-    
-    for pid, patient in patients_map.items():
-        # Find last visit
-        patient_visits = [v for v in visits if v["patient_id"] == pid]
-        if patient_visits:
-            last_visit_date = max(v["date"] for v in patient_visits)
-        else:
-            # Check all visits
-            all_patient_visits = await db.visits.find({"patient_id": pid}, {"date": 1}).sort("date", -1).limit(1).to_list(1)
-            if all_patient_visits:
-                last_visit_date = all_patient_visits[0]["date"]
-            else:
-                continue  # No visits ever
-        
-        try:
-            last_dt = datetime.fromisoformat(last_visit_date.replace("Z", "+00:00"))
-            days_since = (today - last_dt).days
-            
-            patient_info = {
-                "patient_id": pid,
-                "name": f"{patient.get('first_name', '')} {patient.get('last_name', '')}",
-                "phone": patient.get("phone", ""),
-                "email": patient.get("email", ""),
-                "last_visit": last_visit_date[:10],
-                "days_since": days_since
-            }
-            
-            if days_since > 90:
-                inactive_90.append(patient_info)
-            elif days_since > 60:
-                inactive_60.append(patient_info)
-        except:
-            pass
-    
-    inactive_patients = {
-        "over_60_days": sorted(inactive_60, key=lambda x: -x["days_since"]),
-        "over_90_days": sorted(inactive_90, key=lambda x: -x["days_since"]),
-        "count_60": len(inactive_60),
-        "count_90": len(inactive_90)
-    }
-    
-    # ==========================================
-    # 6. QUEUE ANALYTICS
-    # ==========================================
-    queue_by_day = defaultdict(int)
-    completed_by_day = defaultdict(int)
-    
-    for q in queue_data:
-        day = q.get("date", "")[:10]
-        queue_by_day[day] += 1
-        if q.get("status") == "DONE":
-            completed_by_day[day] += 1
-    
-    total_checkins = sum(queue_by_day.values())
-    total_completed = sum(completed_by_day.values())
-    completion_rate = round(total_completed / total_checkins * 100, 1) if total_checkins else 0
-    
-    queue_analytics = {
-        "daily_checkins": dict(sorted(queue_by_day.items())),
-        "daily_completed": dict(sorted(completed_by_day.items())),
-        "total_checkins": total_checkins,
-        "total_completed": total_completed,
-        "completion_rate": completion_rate,
-        "avg_checkins_per_day": round(total_checkins / total_days, 1)
-    }
-    
-    # ==========================================
-    # 7. ALERTS ANALYTICS
-    # ==========================================
-    alert_counts = defaultdict(int)
-    checkins_with_alerts = 0
-    
-    for q in queue_data:
-        alerts = q.get("alerts", "")
-        if alerts:
-            checkins_with_alerts += 1
-            for alert in alerts.split(", "):
-                if alert.strip():
-                    alert_counts[alert.strip()] += 1
-    
-    alert_rate = round(checkins_with_alerts / total_checkins * 100, 1) if total_checkins else 0
-    
-    alerts_analytics = {
-        "top_alerts": sorted([{"alert": k, "count": v} for k, v in alert_counts.items()], key=lambda x: -x["count"])[:10],
-        "checkins_with_alerts": checkins_with_alerts,
-        "alert_rate": alert_rate,
-        "total_checkins": total_checkins
-    }
-    
-    # ==========================================
-    # 8. GEOGRAPHIC DISTRIBUTION
-    # ==========================================
-    city_counts = defaultdict(int)
-    city_registrations = defaultdict(lambda: defaultdict(int))
-    city_visits = defaultdict(int)
-    
-    for p in patients:
-        city = p.get("city", "Unknown").strip().upper() or "Unknown"
-        city_counts[city] += 1
-        reg_date = p.get("registered_at", "")[:7]  # YYYY-MM
-        if reg_date:
-            city_registrations[city][reg_date] += 1
-    
-    for v in visits:
-        pid = v["patient_id"]
-        patient = patients_map.get(pid, {})
-        city = patient.get("city", "Unknown").strip().upper() or "Unknown"
-        city_visits[city] += 1
-    
-    city_stats = []
-    total_patients_geo = sum(city_counts.values())
-    for city, count in sorted(city_counts.items(), key=lambda x: -x[1])[:15]:
-        pct = round(count / total_patients_geo * 100, 1) if total_patients_geo else 0
-        city_stats.append({
-            "city": city,
-            "patient_count": count,
-            "visit_count": city_visits.get(city, 0),
-            "percentage": pct,
-            "registration_trend": dict(sorted(city_registrations[city].items()))
-        })
-    
-    geographic = {
-        "cities": city_stats,
-        "total_cities": len(city_counts),
-        "total_patients": total_patients_geo
-    }
-    
-    # ==========================================
-    # 9. DATA QUALITY
-    # ==========================================
-    missing_email = 0
-    missing_phone = 0
-    missing_postcode = 0
-    missing_emergency = 0
-    completeness_scores = []
-    
-    email_counts = defaultdict(int)
-    phone_counts = defaultdict(int)
-    
-    for p in patients:
-        score = 0
-        total_fields = 7  # email, phone, postcode, street, city, emergency_name, emergency_phone
-        
-        email = p.get("email", "").strip()
-        phone = p.get("phone", "").strip()
-        postcode = p.get("postcode", "").strip()
-        street = p.get("street", "").strip()
-        city = p.get("city", "").strip()
-        em_name = p.get("emergency_name", "").strip()
-        em_phone = p.get("emergency_phone", "").strip()
-        
-        if email:
-            score += 1
-            email_counts[email.lower()] += 1
-        else:
-            missing_email += 1
-        
-        if phone:
-            score += 1
-            phone_counts[phone] += 1
-        else:
-            missing_phone += 1
-        
-        if postcode:
-            score += 1
-        else:
-            missing_postcode += 1
-        
-        if street:
-            score += 1
-        if city:
-            score += 1
-        
-        if em_name and em_phone:
-            score += 2
-        else:
-            missing_emergency += 1
-        
-        completeness_scores.append(round(score / total_fields * 100))
-    
-    # Find duplicates
-    duplicate_emails = [email for email, count in email_counts.items() if count > 1 and email]
-    duplicate_phones = [phone for phone, count in phone_counts.items() if count > 1 and phone]
-    
-    avg_completeness = round(sum(completeness_scores) / len(completeness_scores), 1) if completeness_scores else 0
-    
-    data_quality = {
-        "missing": {
-            "email": missing_email,
-            "phone": missing_phone,
-            "postcode": missing_postcode,
-            "emergency_contact": missing_emergency
+    start_date, end_date, start, end = report_window(start_date, end_date)
+    
+    async def load():
+        # Only the columns the report engine reads are fetched, as undecoded BSON;
+        # decoding, computing and rendering all happen in the report pool
+        visits, patients, queue_data, quality, alerts = await asyncio.gather(
+            fetch_raw(analytics_db.visits, {"at": {"$gte": start, "$lt": end}}, analytics.VISIT_FIELDS),
+            fetch_raw(analytics_db.patients, {}, analytics.PATIENT_FIELDS),
+            fetch_raw(analytics_db.queue, {"at": {"$gte": start, "$lt": end}}, analytics.QUEUE_FIELDS),
+            # Data quality comes from the counters maintained on write, not a rescan of the patients
+            data_quality_summary(),
+            # and alert counts from an aggregation over the flags, not from the rows
+            alert_summary(start, end)
+        )
+        names = {kind: (await get_catalog(kind)).names() for kind in catalogs.KINDS}
+        return await report_pool.run(
+            analytics.report_json, visits, patients, queue_data, start_date, end_date, datetime.now(timezone.utc),
+            quality, names, alerts
+        )
+    
+    return json_body(await flights.do("reports", (start_date, end_date), load))
+
+@api_router.get("/reports/data-quality")
+async def get_data_quality_report(user: dict = Depends(verify_token)):
+    """Missing fields, shared emails/phones and average completeness, from the counters kept on write"""
+    return {"success": True, **await data_quality_summary()}
+
+@api_router.get("/admin/data-quality/worst")
+async def get_worst_data_quality(limit: int = 50, missing: Optional[str] = None, user: dict = Depends(verify_manager_or_admin)):
+    """Patients with the least complete records first; ?missing=email narrows to one missing field"""
+    query = {"quality.missing": missing} if missing else {}
+    patients = await db.patients.find(
+        query, {"_id": 0, "patient_id": 1, "first_name": 1, "last_name": 1, "phone": 1, "email": 1, "quality": 1}
+    ).sort([("quality.score", 1), ("patient_id", 1)]).limit(min(max(limit, 1), 500)).to_list(None)
+    return {"success": True, "patients": patients}
+
+@api_router.get("/reports/alerts")
+async def get_alert_report(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    flag: Optional[str] = None,
+    limit: int = Query(200, ge=1, le=1000),
+    user: dict = Depends(verify_token)
+):
+    """Alert counts for the period; ?flag=<code> also lists the check-ins carrying that flag"""
+    start_date, end_date, start, end = report_window(start_date, end_date)
+    body = {"success": True, "period": {"start": start_date, "end": end_date}, **await alert_summary(start, end)}
+    if flag:
+        checkins, declared = await asyncio.gather(
+            analytics_db.queue.find(
+                {"alert_flags": flag, "at": {"$gte": start, "$lt": end}},
+                {"_id": 0, "patient_id": 1, "first_name": 1, "last_name": 1, "date": 1, "timestamp": 1, "status": 1, "alert_flags": 1}
+            ).sort("at", -1).limit(limit).max_time_ms(REPORT_MAX_TIME_MS).to_list(None),
+            analytics_db.consents.count_documents(
+                {"alert_flags": flag, "timestamp": {"$gte": start.isoformat(), "$lt": end.isoformat()}}, maxTimeMS=REPORT_MAX_TIME_MS
+            )
+        )
+        body.update({"flag": flag, "label": alert_flags.label(flag), "checkins": checkins, "consents_declaring": declared})
+    return body
+
+@api_router.get("/reports/timeseries")
+async def get_timeseries_report(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    user: dict = Depends(verify_token)
+):
+    """Visit trends (daily/weekly/monthly), weekday x hour heatmap and queue throughput
+    
+    Served from the daily buckets: one document per day per series, however many
+    visits the period holds. Heatmap keys are "weekday-hour" (Monday = 0, UTC hours).
+    """
+    start_date, end_date, start, end = report_window(start_date, end_date)
+    period = {"day": {"$gte": start, "$lt": end}}
+    visit_buckets = await analytics_db.visit_buckets.find(period, {"_id": 0}).sort("day", 1).max_time_ms(REPORT_MAX_TIME_MS).to_list(None)
+    queue_buckets = await analytics_db.queue_buckets.find(period, {"_id": 0}).sort("day", 1).max_time_ms(REPORT_MAX_TIME_MS).to_list(None)
+    
+    daily = []
+    weekly = Counter()
+    monthly = Counter()
+    heatmap = Counter()
+    treatments = Counter()
+    consultants = Counter()
+    treatment_catalog, consultant_catalog = await asyncio.gather(get_catalog("treatments"), get_catalog("consultants"))
+    for bucket in visit_buckets:
+        day = parse_event_time(bucket["day"])
+        count = bucket.get("count", 0)
+        daily.append({"date": day.strftime("%Y-%m-%d"), "visits": count})
+        weekly[day.strftime(analytics.WEEK_FORMAT)] += count
+        monthly[day.strftime("%Y-%m")] += count
+        for hour, n in bucket.get("hours", {}).items():
+            heatmap[f"{day.weekday()}-{hour}"] += n
+        for k, n in bucket.get("treatments", {}).items():
+            treatments[bucket_name(treatment_catalog, k)] += n
+        for k, n in bucket.get("consultants", {}).items():
+            consultants[bucket_name(consultant_catalog, k)] += n
+    
+    queue_daily = [
+        {"date": parse_event_time(b["day"]).strftime("%Y-%m-%d"), "total": b.get("total", 0),
+         "done": b.get("done", 0), "with_alerts": b.get("with_alerts", 0)}
+        for b in queue_buckets
+    ]
+    checked_in = sum(d["total"] for d in queue_daily)
+    treated = sum(d["done"] for d in queue_daily)
+    
+    return FastJSONResponse({
+        "success": True,
+        "period": {"start": start_date, "end": end_date},
+        "visits": {
+            "total": sum(d["visits"] for d in daily),
+            "daily": daily,
+            "weekly": [{"week": k, "visits": v} for k, v in sorted(weekly.items())],
+            "monthly": [{"month": k, "visits": v} for k, v in sorted(monthly.items())],
+            "heatmap": {k: v for k, v in heatmap.items() if v},
+            "treatments": {k: v for k, v in treatments.most_common() if v > 0},
+            "consultants": {k: v for k, v in consultants.most_common() if v > 0}
         },
-        "duplicates": {
-            "emails": duplicate_emails[:10],
-            "phones": duplicate_phones[:10],
-            "email_count": len(duplicate_emails),
-            "phone_count": len(duplicate_phones)
+        "queue": {
+            "total": checked_in,
+            "done": treated,
+            "completion_rate": round(treated / checked_in * 100, 1) if checked_in else 0,
+            "daily": queue_daily
         },
-        "avg_completeness_score": avg_completeness,
-        "total_patients": len(patients)
-    }
+        "buckets_read": len(visit_buckets) + len(queue_buckets)
+    })
+
+@api_router.get("/reports/cohorts")
+async def get_cohort_report(
+    months: int = Query(12, ge=1, le=120),
+    user: dict = Depends(verify_token)
+):
+    """Monthly cohort retention matrix and lifetime visits, served from the cohort table
+    
+    retention[k-1] is the share of a cohort that visited again in month cohort+k;
+    cells in the future are null.
+    """
+    current = datetime.now(timezone.utc).strftime("%Y-%m")
+    rows = await analytics_db.cohorts.find(
+        {"cohort": {"$gte": shift_month(current, 1 - months)}}, {"_id": 0}
+    ).sort("cohort", 1).max_time_ms(REPORT_MAX_TIME_MS).to_list(months)
+    
+    matrix = []
+    for row in rows:
+        size = row.get("patients", 0)
+        elapsed = month_offset(row["cohort"], current)
+        returned = [
+            row.get("active", {}).get(str(k), 0) if k <= elapsed else None
+            for k in range(1, COHORT_REPORT_OFFSETS + 1)
+        ]
+        matrix.append({
+            "cohort": row["cohort"],
+            "patients": size,
+            "visits": row.get("visits", 0),
+            "avg_visits": round(row.get("visits", 0) / size, 2) if size else 0,
+            "returned": returned,
+            "retention": [round(n / size * 100, 1) if n is not None and size else None for n in returned]
+        })
     
-    # ==========================================
-    # 10. HOURLY HEATMAP
-    # ==========================================
-    hourly_stats = {}
-    for v in visits:
-        try:
-            dt = datetime.fromisoformat(v["date"].replace("Z", "+00:00"))
-            hour = dt.hour
-            day_of_week = dt.weekday()
-            key = f"{day_of_week}-{hour}"
-            hourly_stats[key] = hourly_stats.get(key, 0) + 1
-        except:
-            pass
+    totals = await analytics_db.cohorts.aggregate([
+        {"$group": {"_id": None, "patients": {"$sum": "$patients"}, "visits": {"$sum": "$visits"}}}
+    ], maxTimeMS=REPORT_MAX_TIME_MS).to_list(1)
+    lifetime = totals[0] if totals else {"patients": 0, "visits": 0}
     
     return {
         "success": True,
-        "period": {"start": start_date, "end": end_date, "days": total_days},
-        "visit_trends": visit_trends,
-        "consultant_workload": consultant_workload,
-        "treatment_mix": treatment_mix,
-        "new_vs_returning": new_vs_returning,
-        "inactive_patients": inactive_patients,
-        "queue_analytics": queue_analytics,
-        "alerts_analytics": alerts_analytics,
-        "geographic": geographic,
-        "data_quality": data_quality,
-        "hourly_heatmap": hourly_stats
+        "offsets": COHORT_REPORT_OFFSETS,
+        "cohorts": matrix,
+        "lifetime": {
+            "patients": lifetime["patients"],
+            "visits": lifetime["visits"],
+            "avg_visits_per_patient": round(lifetime["visits"] / lifetime["patients"], 2) if lifetime["patients"] else 0
+        }
     }
 
+@api_router.post("/admin/cohorts/rebuild")
+async def rebuild_cohort_table(user: dict = Depends(verify_admin)):
+    """Recompute the cohort table from scratch - ADMIN ONLY"""
+    cohorts = await rebuild_cohorts()
+    await log_system_event("COHORTS_REBUILD", f"Rebuilt {cohorts} cohorts", user["username"])
+    return {"success": True, "cohorts": cohorts}
+
 @api_router.get("/reports/consultants")
 async def get_consultants(user: dict = Depends(verify_token)):
-    consultants = await db.visits.distinct("consultant")
-    return consultants
+    """Every catalogued consultant name, retired ones included so past visits can still be filtered"""
+    return [entry["name"] for entry in (await get_catalog("consultants")).listing(include_inactive=True)]
+
+# ==========================================
+# PUSH EVENTS
+# ==========================================
+
+@api_router.get("/events/stream")
+async def stream_events(user: dict = Depends(verify_token)):
+    """Server-Sent Events feed of changed resource keys ("queue:<date>", "patient:<id>"...)
+    
+    Fed by the cross-worker bus, so changes made through any worker arrive here.
+    Clients refetch the named resources (cheaply, with If-None-Match).
+    """
+    pending = asyncio.Queue(maxsize=1000)
+    
+    def forward(event):
+        if event["kind"] == "changed" and not pending.full():
+            pending.put_nowait(event["payload"]["keys"])
+    
+    async def generate():
+        bus.subscribe(forward)
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    keys = await asyncio.wait_for(pending.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                    yield f"event: changed\ndata: {json.dumps({'keys': keys})}\n\n"
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            bus.unsubscribe(forward)
+    
+    # An explicit identity encoding keeps the compression middleware from buffering the stream
+    return StreamingResponse(generate(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache", "Content-Encoding": "identity", "X-Accel-Buffering": "no"
+    })
 
 # ==========================================
 # HEALTH CHECK
@@ -1609,10 +3071,80 @@ async def root():
 
 @api_router.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
+    """Liveness plus real dependency checks; 503 when Mongo is unreachable"""
+    checks = {}
+    healthy = True
+    
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), timeout=2)
+        checks["mongo"] = {"ok": True, "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+    except Exception as e:
+        healthy = False
+        checks["mongo"] = {"ok": False, "error": str(e) or type(e).__name__}
+    
+    checks["transactions"] = {"ok": True, "enabled": transactions_supported}
+    checks["backup_scheduler"] = {"ok": scheduler.alive}
+    checks["deletions"] = {"ok": deletion_engine.alive}
+    checks["event_bus"] = {"ok": bus.alive, "mode": bus.mode, "worker": events.WORKER_ID}
+    checks["admission"] = {"ok": True, "lanes": {name: lane.describe() for name, lane in LANES.items()}}
+    checks["report_pool"] = {"ok": True, "mode": report_pool.mode, "size": report_pool.size, "in_flight": report_pool.in_flight}
+    
+    return JSONResponse(
+        {"status": "healthy" if healthy else "unhealthy", "checks": checks, "timestamp": datetime.now(timezone.utc).isoformat()},
+        status_code=200 if healthy else 503
+    )
+
+@api_router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint; labels carry route templates only, never patient data"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
 
 app.include_router(api_router)
 
+@app.exception_handler(ExecutionTimeout)
+async def query_timeout_handler(request: Request, exc: ExecutionTimeout):
+    logger.warning(f"Query time limit hit on {request.url.path}: {exc}")
+    return JSONResponse({"detail": "Query exceeded its time limit; narrow the request and retry"}, status_code=503)
+
+@app.exception_handler(ConnectionFailure)
+async def database_unavailable_handler(request: Request, exc: ConnectionFailure):
+    # Server selection and pool wait-queue timeouts land here instead of hanging the request
+    logger.error(f"Database unavailable on {request.url.path}: {exc}")
+    return JSONResponse({"detail": "Database temporarily unavailable"}, status_code=503, headers={"Retry-After": "5"})
+
+@app.exception_handler(BrokenProcessPool)
+async def compute_pool_broken_handler(request: Request, exc: BrokenProcessPool):
+    # The pool has already been replaced; the next attempt gets fresh processes
+    return JSONResponse({"detail": "Report worker restarted; retry the request"}, status_code=503, headers={"Retry-After": "2"})
+
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MIN_SIZE, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
+# Patient-facing lanes queue without limit; heavy lanes shed with 429/503 (see admission.py).
+# Every limit is per worker and can be overridden with LANE_<NAME>_CONCURRENCY / _QUEUE / _TIMEOUT.
+LANES = {
+    "kiosk": admission.Lane.from_env("kiosk", 64),
+    "interactive": admission.Lane.from_env("interactive", 64),
+    "analytics": admission.Lane.from_env("analytics", max(REPORT_WORKERS, 2), max_waiting=8, wait_timeout=20),
+    "admin_bulk": admission.Lane.from_env("admin_bulk", 1, max_waiting=2, wait_timeout=30, retry_after=30),
+}
+ADMISSION_RULES = [
+    (None, r"^/api/(health|metrics|events/stream)/?$"),
+    ("kiosk", r"^/api/(kiosk|queue)(/|$)"),
+    ("analytics", r"^/api/reports/"),
+    ("analytics", r"^/api/patients/[^/]+/pdf$"),
+    ("analytics", r"^/api/admin/(export|duplicates)$"),
+    ("admin_bulk", r"^/api/admin/(backup|restore|import|data|cohorts/rebuild|duplicates/merge)(/|$)"),
+    ("admin_bulk", r"^/api/admin/catalogs/[^/]+/[^/]+/merge$"),
+]
+
+app.add_middleware(admission.AdmissionMiddleware, lanes=LANES, rules=ADMISSION_RULES, default="interactive")
+
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -0,0 +1,103 @@
+"""Bounded process pool for CPU-bound request work.
+
+The API serves every request from one asyncio event loop per uvicorn worker,
+so a few hundred milliseconds of pure-Python or NumPy work (building a report
+over tens of thousands of rows) stalls every other request on that worker,
+kiosk registrations and queue polls included. ComputePool runs such work in
+separate processes instead:
+
+* processes are spawned, not forked, so they never inherit the parent's Mongo
+  client, threads or event loop; each one only imports the module of the
+  function it runs;
+* arguments and results cross the process boundary pickled, so callers hand
+  over compact payloads (raw BSON bytes in, rendered JSON bytes out) rather
+  than lists of dicts;
+* at most `size` tasks run at once; further submissions wait in the pool's
+  queue without blocking the event loop.
+
+size=0 runs tasks in a thread of the default executor instead, for
+single-process deployments and local development.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+compute_duration = metrics.registry.histogram(
+    "compute_pool_task_duration_seconds", "Time from submission to result of pooled CPU work, queueing included",
+    (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+compute_in_flight = metrics.registry.gauge("compute_pool_tasks_in_flight", "Pooled CPU tasks queued or running")
+compute_failures = metrics.registry.counter("compute_pool_failures_total", "Pooled CPU tasks that raised or lost their process")
+
+
+def _ready() -> int:
+    return os.getpid()
+
+
+class ComputePool:
+    def __init__(self, name: str, size: int, max_tasks_per_child: Optional[int] = 200):
+        self.name = name
+        self.size = size
+        # Recycle processes now and then so fragmented NumPy heaps are returned to the OS
+        self.max_tasks_per_child = max_tasks_per_child
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.in_flight = 0
+
+    @property
+    def mode(self) -> str:
+        return "processes" if self.size else "thread"
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.size,
+                mp_context=multiprocessing.get_context("spawn"),
+                max_tasks_per_child=self.max_tasks_per_child
+            )
+        return self.executor
+
+    async def start(self):
+        """Spawn the processes up front so the first request does not pay for interpreter start-up"""
+        if self.size:
+            loop = asyncio.get_running_loop()
+            executor = self._executor()
+            await asyncio.gather(*(loop.run_in_executor(executor, _ready) for _ in range(self.size)))
+            logger.info(f"Compute pool {self.name} ready ({self.size} processes)")
+
+    async def stop(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def run(self, func, *args):
+        """Run func(*args) in the pool and return its result; func must be a module-level function"""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        self.in_flight += 1
+        metrics.registry.set(compute_in_flight, self.in_flight, pool=self.name)
+        try:
+            if not self.size:
+                return await loop.run_in_executor(None, func, *args)
+            return await loop.run_in_executor(self._executor(), func, *args)
+        except BrokenProcessPool:
+            # A process died mid-task (e.g. killed for memory); start a fresh pool for the next call
+            logger.error(f"Compute pool {self.name} lost a process; restarting it")
+            self.executor = None
+            metrics.registry.inc(compute_failures, pool=self.name)
+            raise
+        except Exception:
+            metrics.registry.inc(compute_failures, pool=self.name)
+            raise
+        finally:
+            self.in_flight -= 1
+            metrics.registry.set(compute_in_flight, self.in_flight, pool=self.name)
+            metrics.registry.observe(compute_duration, time.perf_counter() - started, pool=self.name)
@@ -90,6 +90,16 @@ export const ClinicProvider = ({ children }) => {
     }
   }, [api, loadDashboardData]);
 
+  const getTreatments = useCallback(async () => {
+    try {
+      const response = await api().get('/catalogs/treatments');
+      return response.data.entries || [];
+    } catch (error) {
+      console.error('Failed to load treatments:', error);
+      return [];
+    }
+  }, [api]);
+
   const getPatientAudit = useCallback(async (patientId) => {
     try {
       const response = await api().get(`/patients/${patientId}/audit`);
@@ -122,6 +132,7 @@ export const ClinicProvider = ({ children }) => {
       deletePatient,
       getPatientVisits,
       createVisit,
+      getTreatments,
       getPatientAudit
     }}>
       {children}
@@ -20,7 +20,7 @@ import {
   AlertTriangle, Pill, Heart, History, Plus, Edit, Trash2, ChevronDown,
   ChevronRight, Loader2, Shield, Users, Settings, Download, Key, UserPlus,
   ClipboardList, Lock, Unlock, Crown, Database, HardDrive, RotateCcw, Archive,
-  FileSignature
+  FileSignature, ShieldCheck
 } from 'lucide-react';
 
 const StaffPortal = () => {
@@ -28,7 +28,7 @@ const StaffPortal = () => {
   const { user, logout, isManager, isAdmin, api } = useAuth();
   const { 
     patients, queue, selectedPatient, setSelectedPatient, loading,
-    loadDashboardData, loadPatient, updatePatient, getPatientVisits, createVisit, getPatientAudit
+    loadDashboardData, loadPatient, updatePatient, getPatientVisits, createVisit, getTreatments, getPatientAudit
   } = useClinic();
 
   const [searchTerm, setSearchTerm] = useState('');
@@ -54,6 +54,7 @@ const StaffPortal = () => {
   const [editingVisit, setEditingVisit] = useState(null);
   const [editVisitForm, setEditVisitForm] = useState({ treatment: '', notes: '' });
   const [editVisitLoading, setEditVisitLoading] = useState(false);
+  const [treatmentOptions, setTreatmentOptions] = useState([]);
   
   // Password verification
   const [deletePassword, setDeletePassword] = useState('');
@@ -110,7 +111,15 @@ const StaffPortal = () => {
     }
   };
 
+  // Catalogued treatments not yet on the form, offered as one-click lines
+  const treatmentSuggestions = (text) => {
+    const lines = (text || '').split('\n').map(l => l.trim().toLowerCase());
+    return treatmentOptions.filter(t => !lines.includes(t.name.toLowerCase()));
+  };
+  const appendTreatment = (text, name) => (text && !text.endsWith('\n') ? `${text}\n${name}` : `${text || ''}${name}`);
+
   const handleOpenVisitModal = () => {
+    getTreatments().then(setTreatmentOptions);
     setVisitForm({
       treatment: '',
       notes: '',  // Always empty on open
@@ -136,6 +145,7 @@ const StaffPortal = () => {
 
   // Edit visit functions
   const handleOpenEditVisit = (visit) => {
+    getTreatments().then(setTreatmentOptions);
     setEditingVisit(visit);
     setEditVisitForm({
       treatment: visit.treatment || '',
@@ -310,7 +320,7 @@ const StaffPortal = () => {
     setDataActionLoading(true);
     try {
       const res = await api().post('/admin/data/delete-all-patients', { password: dataPassword });
-      alert(`Deleted ${res.data.deleted_count} patients`);
+      alert(`Deleting ${res.data.deleted_count} patients and their records in the background`);
       setDataConfirmAction(null);
       setDataPassword('');
       loadDashboardData();
@@ -326,7 +336,7 @@ const StaffPortal = () => {
     setDataActionLoading(true);
     try {
       const res = await api().post('/admin/data/delete-all-visits', { password: dataPassword });
-      alert(`Deleted ${res.data.deleted_count} visits`);
+      alert(`Deleting ${res.data.deleted_count} visits in the background`);
       setDataConfirmAction(null);
       setDataPassword('');
     } catch (error) {
@@ -341,7 +351,7 @@ const StaffPortal = () => {
     setDataActionLoading(true);
     try {
       const res = await api().post('/admin/data/delete-all-queue', { password: dataPassword });
-      alert(`Deleted ${res.data.deleted_count} queue entries`);
+      alert(`Deleting ${res.data.deleted_count} queue entries in the background`);
       setDataConfirmAction(null);
       setDataPassword('');
       loadDashboardData();
@@ -383,6 +393,22 @@ const StaffPortal = () => {
     }
   };
 
+  const handleVerifyBackup = async (backupId) => {
+    setDataActionLoading(true);
+    try {
+      const res = await api().post(`/admin/backup/${backupId}/verify`);
+      const v = res.data.verification;
+      alert(v.status === 'passed'
+        ? `Backup ${backupId} verified: ${v.documents} documents restored in ${v.restore_seconds}s`
+        : `Backup ${backupId} FAILED verification: ${v.error || v.failed_collections.join(', ')}`);
+      loadAdminData();
+    } catch (error) {
+      alert(error.response?.data?.detail || 'Verification failed');
+    } finally {
+      setDataActionLoading(false);
+    }
+  };
+
   const handleDeleteBackup = async (backupId) => {
     if (!dataPassword) return;
     setDataActionLoading(true);
@@ -679,7 +705,12 @@ const StaffPortal = () => {
           <DialogHeader><DialogTitle>New Consultation</DialogTitle></DialogHeader>
           <div className="space-y-4">
             <div><label className="text-xs text-slate-400 uppercase">Treatment (one per line)</label>
-              <Textarea value={visitForm.treatment} onChange={(e) => setVisitForm(prev => ({ ...prev, treatment: e.target.value }))} placeholder="IV Vitamin C&#10;B12 Injection&#10;NAD+ Infusion" className="bg-slate-950 border-slate-800 mt-1 h-32 font-mono text-sm" /></div>
+              <Textarea value={visitForm.treatment} onChange={(e) => setVisitForm(prev => ({ ...prev, treatment: e.target.value }))} placeholder="IV Vitamin C&#10;B12 Injection&#10;NAD+ Infusion" className="bg-slate-950 border-slate-800 mt-1 h-32 font-mono text-sm" />
+              <div className="flex flex-wrap gap-1 mt-2">
+                {treatmentSuggestions(visitForm.treatment).map(t => (
+                  <button key={t.id} type="button" onClick={() => setVisitForm(prev => ({ ...prev, treatment: appendTreatment(prev.treatment, t.name) }))} className="text-xs px-2 py-0.5 rounded border border-slate-700 text-slate-400 hover:text-slate-200 hover:border-slate-500">+ {t.name}</button>
+                ))}
+              </div></div>
             <div><label className="text-xs text-slate-400 uppercase">Notes</label>
               <Input value={visitForm.notes} onChange={(e) => setVisitForm(prev => ({ ...prev, notes: e.target.value }))} placeholder="Optional notes..." className="bg-slate-950 border-slate-800 mt-1" /></div>
             <div><label className="text-xs text-slate-400 uppercase">Consultant</label>
@@ -701,7 +732,12 @@ const StaffPortal = () => {
               Date: <span className="text-slate-300">{editingVisit?.date?.replace('T', ' ').slice(0, 19)}</span> (cannot be changed)
             </div>
             <div><label className="text-xs text-slate-400 uppercase">Treatment (one per line)</label>
-              <Textarea value={editVisitForm.treatment} onChange={(e) => setEditVisitForm(prev => ({ ...prev, treatment: e.target.value }))} className="bg-slate-950 border-slate-800 mt-1 h-32 font-mono text-sm" /></div>
+              <Textarea value={editVisitForm.treatment} onChange={(e) => setEditVisitForm(prev => ({ ...prev, treatment: e.target.value }))} className="bg-slate-950 border-slate-800 mt-1 h-32 font-mono text-sm" />
+              <div className="flex flex-wrap gap-1 mt-2">
+                {treatmentSuggestions(editVisitForm.treatment).map(t => (
+                  <button key={t.id} type="button" onClick={() => setEditVisitForm(prev => ({ ...prev, treatment: appendTreatment(prev.treatment, t.name) }))} className="text-xs px-2 py-0.5 rounded border border-slate-700 text-slate-400 hover:text-slate-200 hover:border-slate-500">+ {t.name}</button>
+                ))}
+              </div></div>
             <div><label className="text-xs text-slate-400 uppercase">Notes</label>
               <Input value={editVisitForm.notes} onChange={(e) => setEditVisitForm(prev => ({ ...prev, notes: e.target.value }))} className="bg-slate-950 border-slate-800 mt-1" /></div>
             <div className="text-xs text-slate-500">
@@ -1161,7 +1197,7 @@ const StaffPortal = () => {
                           Create Backup
                         </Button>
                       </div>
-                      <p className="text-xs text-slate-500 mb-3">Automatic backups run daily at 2:00 AM UTC (last 30 kept)</p>
+                      <p className="text-xs text-slate-500 mb-3">Automatic backups run daily at 2:00 AM UTC (one per day kept for a week, per week for a month, per month for a year)</p>
 
                       {backups.length === 0 ? (
                         <p className="text-slate-500 text-sm text-center py-4">No backups found</p>
@@ -1174,6 +1210,7 @@ const StaffPortal = () => {
                                 <th className="p-2 text-left">Created</th>
                                 <th className="p-2 text-left">By</th>
                                 <th className="p-2 text-left">Data</th>
+                                <th className="p-2 text-left">Verified</th>
                                 <th className="p-2 text-left">Actions</th>
                               </tr>
                             </thead>
@@ -1186,6 +1223,19 @@ const StaffPortal = () => {
                                   <td className="p-2 text-slate-500 text-xs whitespace-nowrap">
                                     P:{b.counts?.patients || 0} V:{b.counts?.visits || 0}
                                   </td>
+                                  <td className="p-2 text-xs whitespace-nowrap">
+                                    {!b.verification ? (
+                                      <span className="text-slate-600">-</span>
+                                    ) : b.verification.status === 'passed' ? (
+                                      <span className="text-emerald-400" title={`Verified ${b.verification.verified_at?.slice(0, 16).replace('T', ' ')}`}>
+                                        OK {b.verification.restore_seconds}s
+                                      </span>
+                                    ) : (
+                                      <span className="text-red-400 font-bold" title={b.verification.error || b.verification.failed_collections?.join(', ')}>
+                                        FAILED
+                                      </span>
+                                    )}
+                                  </td>
                                   <td className="p-2">
                                     {dataConfirmAction === `restore-${b.backup_id}` ? (
                                       <div className="flex gap-2">
@@ -1199,6 +1249,9 @@ const StaffPortal = () => {
                                         <Button size="sm" variant="outline" onClick={() => setDataConfirmAction(`restore-${b.backup_id}`)} className="h-7 px-2 text-emerald-400 border-emerald-500/50" title="Restore">
                                           <RotateCcw className="w-3 h-3" />
                                         </Button>
+                                        <Button size="sm" variant="outline" onClick={() => handleVerifyBackup(b.backup_id)} disabled={dataActionLoading} className="h-7 px-2 text-blue-400 border-blue-500/50" title="Test restore">
+                                          <ShieldCheck className="w-3 h-3" />
+                                        </Button>
                                         <Button size="sm" variant="outline" onClick={() => handleDeleteBackup(b.backup_id)} disabled={!dataPassword || dataActionLoading} className="h-7 px-2 text-red-400 border-red-500/50" title="Delete">
                                           <Trash2 className="w-3 h-3" />
                                         </Button>
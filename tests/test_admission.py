@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionMiddleware, Lane, Rejected
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_release_hands_the_slot_to_the_oldest_waiter():
+    async def scenario():
+        lane = Lane("t", concurrency=1)
+        await lane.acquire()
+        order = []
+
+        async def request(name):
+            await lane.acquire()
+            order.append(name)
+
+        waiting = [asyncio.create_task(request(n)) for n in ("b", "c")]
+        await settle()
+        assert (lane.active, lane.waiting, order) == (1, 2, [])
+
+        lane.release()
+        await settle()
+        # The slot passed straight on: never free, so a newcomer cannot jump the queue
+        assert (lane.active, lane.waiting, order) == (1, 1, ["b"])
+
+        lane.release()
+        await asyncio.gather(*waiting)
+        assert order == ["b", "c"]
+        lane.release()
+        assert (lane.active, lane.waiting) == (0, 0)
+
+    run(scenario())
+
+
+def test_newcomer_waits_behind_queued_requests():
+    async def scenario():
+        lane = Lane("t", concurrency=2)
+        await lane.acquire()
+        await lane.acquire()
+        first = asyncio.create_task(lane.acquire())
+        await settle()
+        lane.release()
+        second = asyncio.create_task(lane.acquire())
+        await settle()
+        assert first.done() and not second.done()
+        lane.release()
+        await second
+        assert lane.active == 2
+
+    run(scenario())
+
+
+def test_full_queue_sheds_with_429():
+    async def scenario():
+        lane = Lane("reports", concurrency=1, max_waiting=1, retry_after=7)
+        await lane.acquire()
+        queued = asyncio.create_task(lane.acquire())
+        await settle()
+        with pytest.raises(Rejected) as rejected:
+            await lane.acquire()
+        assert (rejected.value.status, rejected.value.retry_after, rejected.value.lane) == (429, 7, "reports")
+        lane.release()
+        await queued
+        assert (lane.active, lane.waiting) == (1, 0)
+
+    run(scenario())
+
+
+def test_wait_timeout_sheds_with_503_and_leaves_the_queue():
+    async def scenario():
+        lane = Lane("bulk", concurrency=1, wait_timeout=0.01)
+        await lane.acquire()
+        with pytest.raises(Rejected) as rejected:
+            await lane.acquire()
+        assert rejected.value.status == 503
+        assert (lane.active, lane.waiting) == (1, 0)
+        lane.release()
+        assert lane.active == 0
+
+    run(scenario())
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def scenario():
+        lane = Lane("t", concurrency=1)
+        await lane.acquire()
+        waiter = asyncio.create_task(lane.acquire())
+        await settle()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert lane.waiting == 0
+        lane.release()
+        assert lane.active == 0
+
+    run(scenario())
+
+
+def test_from_env_overrides(monkeypatch):
+    monkeypatch.setenv("LANE_REPORTS_CONCURRENCY", "3")
+    monkeypatch.setenv("LANE_REPORTS_QUEUE", "4")
+    lane = Lane.from_env("reports", 1, max_waiting=8, wait_timeout=20)
+    assert (lane.concurrency, lane.max_waiting, lane.wait_timeout) == (3, 4, 20)
+
+
+def test_middleware_routes_and_rejects():
+    async def scenario():
+        lanes = {"heavy": Lane("heavy", concurrency=1, max_waiting=0, retry_after=9), "light": Lane("light", concurrency=4)}
+        release = asyncio.Event()
+        seen = []
+
+        async def app(scope, receive, send):
+            seen.append(scope["path"])
+            if scope["path"].startswith("/api/reports"):
+                await release.wait()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"{}"})
+
+        middleware = AdmissionMiddleware(app, lanes, [(None, r"^/api/health$"), ("heavy", r"^/api/reports/")], default="light")
+        assert middleware.classify("/api/health") is None
+        assert middleware.classify("/api/patients") is lanes["light"]
+
+        async def call(path):
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+            await middleware({"type": "http", "method": "GET", "path": path}, None, send)
+            return sent
+
+        holder = asyncio.create_task(call("/api/reports/comprehensive"))
+        await settle()
+        shed = await call("/api/reports/cohorts")
+        assert shed[0]["status"] == 429
+        assert (b"retry-after", b"9") in shed[0]["headers"]
+        assert (await call("/api/patients"))[0]["status"] == 200
+        release.set()
+        assert (await holder)[0]["status"] == 200
+        assert seen == ["/api/reports/comprehensive", "/api/patients"]
+        assert lanes["heavy"].active == 0
+
+    run(scenario())
@@ -0,0 +1,29 @@
+import alert_flags
+from alert_flags import display, label, parse
+
+
+def test_parse_maps_kiosk_labels_to_codes():
+    text = "Today: Fever/Flu/Inf, Recent: Alcohol <24h, Recent: No Food/Fluid <24h"
+    assert parse(text) == ["fever", "alcohol_24h", "no_food_24h"]
+
+
+def test_parse_ignores_case_spacing_and_punctuation():
+    assert parse("  today - DIZZY / faint ,recent:drugs <72H") == ["dizzy", "drugs_72h"]
+
+
+def test_parse_drops_repeats_and_blanks():
+    assert parse("Today: Unwell, , today: unwell,Today: Fever/Flu/Inf,") == ["unwell", "fever"]
+    assert parse("") == parse(None) == parse(" , ") == []
+
+
+def test_unknown_labels_keep_a_derived_code():
+    codes = parse("Pregnant, Today: Unwell, On blood thinners")
+    assert codes == ["pregnant", "unwell", "on_blood_thinners"]
+    assert label("on_blood_thinners") == "On blood thinners"
+
+
+def test_display_round_trips_known_labels():
+    text = ", ".join(alert_flags.KNOWN.values())
+    assert parse(text) == list(alert_flags.KNOWN)
+    assert display(parse(text)) == text
+    assert display([]) == display(None) == ""
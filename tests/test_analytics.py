@@ -0,0 +1,16 @@
+from datetime import datetime, timedelta, timezone
+
+import analytics
+
+
+def test_week_labels_match_week_format():
+    # The columnar engine derives weeks arithmetically; /reports/timeseries uses strftime.
+    # Both must put every day in the same week, across year boundaries and leap years.
+    days = [datetime(2023, 1, 1, 12, tzinfo=timezone.utc) + timedelta(days=i) for i in range(4 * 366)]
+    rows = [
+        {"visit_id": str(i), "patient_id": "P", "at": day, "date": day.isoformat(), "treatment_ids": [1], "consultant_id": 1}
+        for i, day in enumerate(days)
+    ]
+    snapshot = analytics.ReportSnapshot(rows, [], [], {"treatments": {1: "T"}, "consultants": {1: "C"}})
+    labels = analytics.week_strings(snapshot.calendar()["weeks"])
+    assert labels == [day.strftime(analytics.WEEK_FORMAT) for day in days]
@@ -0,0 +1,43 @@
+from datetime import date, datetime, timedelta, timezone
+
+from backups import gfs_retained
+
+
+def daily_backups(newest: date, days: int, times=("02:00",)):
+    """Catalog rows, newest first, one per listed time of each day"""
+    entries = []
+    for offset in range(days):
+        day = newest - timedelta(days=offset)
+        for at in sorted(times, reverse=True):
+            created = datetime.fromisoformat(f"{day.isoformat()}T{at}:00").replace(tzinfo=timezone.utc)
+            entries.append({"backup_id": f"{day.isoformat()}T{at}", "created_at": created.isoformat()})
+    return entries
+
+
+def test_keeps_newest_of_each_recent_day_week_and_month():
+    # 2025-03-12 is a Wednesday; ISO weeks start on Monday
+    kept = gfs_retained(daily_backups(date(2025, 3, 12), 400), daily=7, weekly=4, monthly=12)
+    expected_days = (
+        [f"2025-03-{d:02d}" for d in range(6, 13)]  # daily: the last seven days
+        + ["2025-03-02", "2025-02-23"]  # weekly: last day of the two earlier ISO weeks not already kept
+        + ["2025-02-28", "2025-01-31", "2024-12-31", "2024-11-30", "2024-10-31", "2024-09-30",
+           "2024-08-31", "2024-07-31", "2024-06-30", "2024-05-31", "2024-04-30"]  # monthly
+    )
+    assert kept == {f"{day}T02:00" for day in expected_days}
+
+
+def test_only_the_newest_backup_of_a_day_counts():
+    kept = gfs_retained(daily_backups(date(2025, 3, 12), 3, times=("02:00", "14:00")), daily=2, weekly=0, monthly=0)
+    assert kept == {"2025-03-12T14:00", "2025-03-11T14:00"}
+
+
+def test_newest_backup_is_always_kept():
+    entries = daily_backups(date(2025, 3, 12), 5)
+    assert gfs_retained(entries, daily=0, weekly=0, monthly=0) == {"2025-03-12T02:00"}
+    assert gfs_retained([], daily=7, weekly=4, monthly=12) == set()
+
+
+def test_iso_week_spans_a_year_boundary():
+    # 2024-12-30 .. 2025-01-05 is ISO week 2025-W01; the week before ends Sunday 2024-12-29
+    kept = gfs_retained(daily_backups(date(2025, 1, 5), 14), daily=0, weekly=2, monthly=0)
+    assert kept == {"2025-01-05T02:00", "2024-12-29T02:00"}
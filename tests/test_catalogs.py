@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import catalogs
+import server
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    db = AsyncMongoMockClient()["clinic_test"]
+    monkeypatch.setattr(server, "db", db)
+    for kind in catalogs.KINDS:
+        server.catalog_cache.discard(kind)
+    yield db
+    for kind in catalogs.KINDS:
+        server.catalog_cache.discard(kind)
+
+
+def test_normalize_and_split():
+    assert catalogs.normalize("  IV-Drip ") == catalogs.normalize("iv drip") == "iv drip"
+    assert catalogs.split_treatments("IV Drip\n\niv  drip\nB12 ") == ["IV Drip", "B12"]
+
+
+def test_name_never_blanks_a_referenced_id():
+    catalog = catalogs.Catalog("treatments", [{"id": 1, "name": "B12", "keys": ["b12"]}])
+    assert catalog.name(1) == "B12"
+    assert catalog.name(None) == ""
+    assert catalog.name(9) == "#9"
+    assert catalog.covers([1, None]) and not catalog.covers([1, 9])
+
+
+def test_resolve_finds_entries_newer_than_the_cached_copy(mock_db):
+    async def scenario():
+        stale = await catalogs.load(mock_db, "treatments")
+        added = await catalogs.create(mock_db, "treatments", "IV Drip")
+        ids, created = await catalogs.resolve(mock_db, stale, ["iv drip", "B12"])
+        assert ids[0] == added["id"] and created
+        assert await mock_db.treatments.count_documents({}) == 2
+
+    asyncio.run(scenario())
+
+
+def test_namer_reloads_a_catalog_missing_an_id(mock_db):
+    async def scenario():
+        await server.get_catalog("treatments")
+        # Another worker adds an entry after this one cached the catalog
+        entry = await catalogs.create(mock_db, "treatments", "NAD+ Infusion")
+        name_visit = await server.visit_namer()
+        visit = await name_visit({"visit_id": "V1", "treatment_ids": [entry["id"]], "consultant_id": 42})
+        assert visit == {"visit_id": "V1", "treatment": "NAD+ Infusion", "consultant": "#42"}
+
+    asyncio.run(scenario())
+
+
+def test_interrupted_merge_can_be_repeated(mock_db, monkeypatch):
+    async def scenario():
+        source = await catalogs.create(mock_db, "consultants", "Dr S Mitchell", ["sarah mitchell"])
+        target = await catalogs.create(mock_db, "consultants", "Dr Sarah Mitchell")
+        await mock_db.visits.insert_many([{"visit_id": "V1", "consultant_id": source["id"]},
+                                          {"visit_id": "V2", "consultant_id": target["id"]}])
+
+        real_update = catalogs.update
+
+        async def crash(*args, **kwargs):
+            raise ConnectionError("worker died")
+
+        monkeypatch.setattr(catalogs, "update", crash)
+        with pytest.raises(ConnectionError):
+            await catalogs.merge(mock_db, "consultants", source["id"], target["id"])
+        # Visits already point at the target and the source is still there to name old references
+        assert await mock_db.consultants.count_documents({"id": source["id"]}) == 1
+        assert await mock_db.visits.count_documents({"consultant_id": source["id"]}) == 0
+
+        monkeypatch.setattr(catalogs, "update", real_update)
+        assert await catalogs.merge(mock_db, "consultants", source["id"], target["id"]) == 0
+        catalog = await catalogs.load(mock_db, "consultants")
+        assert [e["id"] for e in catalog.entries] == [target["id"]]
+        assert catalog.lookup("dr s mitchell") == catalog.lookup("Sarah Mitchell") == target["id"]
+        assert [v["consultant_id"] async for v in mock_db.visits.find()] == [target["id"], target["id"]]
+
+    asyncio.run(scenario())
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from coalesce import SingleFlight
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_calls_share_one_computation():
+    async def scenario():
+        flights = SingleFlight()
+        calls = 0
+        gate = asyncio.Event()
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await gate.wait()
+            return {"rows": calls}
+
+        requests = [asyncio.create_task(flights.do("dashboard", None, compute)) for _ in range(5)]
+        await asyncio.sleep(0)
+        gate.set()
+        results = await asyncio.gather(*requests)
+        assert calls == 1
+        assert all(result is results[0] for result in results)
+        stats = flights.stats()[0]
+        assert (stats["leaders"], stats["followers"], stats["in_flight"]) == (1, 4, False)
+
+    run(scenario())
+
+
+def test_different_keys_and_later_calls_run_again():
+    async def scenario():
+        flights = SingleFlight()
+        calls = []
+
+        async def compute(key):
+            calls.append(key)
+            await asyncio.sleep(0)
+            return key
+
+        assert await asyncio.gather(
+            flights.do("reports", ("2025-01-01", "2025-01-31"), lambda: compute("jan")),
+            flights.do("reports", ("2025-02-01", "2025-02-28"), lambda: compute("feb")),
+        ) == ["jan", "feb"]
+        # Nothing is cached once a flight lands
+        assert await flights.do("reports", ("2025-01-01", "2025-01-31"), lambda: compute("jan")) == "jan"
+        assert calls == ["jan", "feb", "jan"]
+        assert flights.flights == {}
+
+    run(scenario())
+
+
+def test_errors_reach_every_caller_and_are_not_kept():
+    async def scenario():
+        flights = SingleFlight()
+        attempts = 0
+
+        async def compute():
+            nonlocal attempts
+            attempts += 1
+            await asyncio.sleep(0)
+            if attempts == 1:
+                raise RuntimeError("database unavailable")
+            return "ok"
+
+        results = await asyncio.gather(*(flights.do("patients", None, compute) for _ in range(3)), return_exceptions=True)
+        assert [type(r) for r in results] == [RuntimeError] * 3
+        assert await flights.do("patients", None, compute) == "ok"
+
+    run(scenario())
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def scenario():
+        flights = SingleFlight()
+        gate = asyncio.Event()
+
+        async def compute():
+            await gate.wait()
+            return "body"
+
+        leader = asyncio.create_task(flights.do("dashboard", None, compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("dashboard", None, compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        gate.set()
+        assert await follower == "body"
+
+    run(scenario())
+
+
+def test_key_stats_are_bounded():
+    async def scenario():
+        flights = SingleFlight(max_tracked_keys=3)
+
+        async def compute():
+            return 1
+
+        for day in range(10):
+            await flights.do("reports", day, compute)
+        assert [s["key"] for s in flights.stats()] == ["9", "8", "7"]
+
+    run(scenario())
@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+from starlette.requests import Request
+
+import server
+
+USER = {"username": "ADMIN", "role": "ADMIN"}
+
+
+def request(if_none_match=None):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "headers": headers})
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    db = AsyncMongoMockClient()["clinic_test"]
+    monkeypatch.setattr(server, "db", db)
+    return db
+
+
+def test_unknown_patient_leaves_no_revision(mock_db):
+    async def scenario():
+        for header in (None, "*"):
+            with pytest.raises(HTTPException) as raised:
+                await server.get_patient("MADE-UP", request(header), USER)
+            assert raised.value.status_code == 404
+        assert "etag" not in (await server.get_patient_visits("MADE-UP", request(), None, USER)).headers
+        assert await mock_db.revisions.count_documents({}) == 0
+
+    asyncio.run(scenario())
+
+
+def test_existing_patient_is_revisioned_and_revalidated(mock_db):
+    async def scenario():
+        await mock_db.patients.insert_one({"patient_id": "P1", "first_name": "A"})
+        first = await server.get_patient("P1", request(), USER)
+        etag = first.headers["etag"]
+        assert first.status_code == 200
+        assert await mock_db.revisions.count_documents({"key": "patient:P1"}) == 1
+
+        assert (await server.get_patient("P1", request(etag), USER)).status_code == 304
+        assert (await server.get_patient("P1", request("*"), USER)).status_code == 304
+
+        await mock_db.patients.delete_one({"patient_id": "P1"})
+        with pytest.raises(HTTPException):
+            await server.get_patient("P1", request("*"), USER)
+
+    asyncio.run(scenario())
+
+
+def test_visit_fields_variant_ignores_order_and_spacing(mock_db):
+    async def scenario():
+        await mock_db.visits.insert_one({"visit_id": "V1", "patient_id": "P1", "date": "2026-01-01", "notes": "x"})
+        etags = {(await server.get_patient_visits("P1", request(), fields, USER)).headers["etag"]
+                 for fields in ("date,notes", "notes,date", " notes , date,date")}
+        assert len(etags) == 1
+        everything = await server.get_patient_visits("P1", request(), None, USER)
+        assert everything.headers["etag"] not in etags
+
+    asyncio.run(scenario())
+
+
+def test_patient_read_leaves_out_bookkeeping(mock_db):
+    async def scenario():
+        await mock_db.patients.insert_one({"patient_id": "P1", "first_name": "A", "visit_months": ["2026-01"],
+                                           "quality": {"score": 50}, "merged_from": ["P2"]})
+        body = (await server.get_patient("P1", request(), USER)).body
+        assert json.loads(body) == {"patient_id": "P1", "first_name": "A"}
+
+    asyncio.run(scenario())
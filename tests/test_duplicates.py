@@ -0,0 +1,159 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+
+import duplicates
+import server
+from duplicates import Patient, find_candidates, score_pair
+from server import PatientMerge, combine_values, merged_fields, resolve_merges
+
+
+def patient(patient_id, first, last, dob="1990-04-12", **extra):
+    return {"patient_id": patient_id, "first_name": first, "last_name": last, "dob": dob, **extra}
+
+
+def test_normalisers():
+    assert duplicates.normalize_phone("+44 7700 900123") == duplicates.normalize_phone("07700 900123") == "7700900123"
+    assert duplicates.normalize_phone("0044 7700 900123") == "7700900123"
+    assert duplicates.normalize_phone("12345") == ""
+    assert duplicates.normalize_email(" Jo+clinic@Example.com ") == "jo@example.com"
+    assert duplicates.normalize_email("not-an-email") == ""
+    assert duplicates.normalize_dob("12/04/1990") == duplicates.normalize_dob("1990-04-12") == "1990-04-12"
+    assert duplicates.normalize_name("O'Brien-Zoë") == "obrienzoe"
+
+
+def test_soundex_and_jaro_winkler():
+    assert duplicates.soundex("robert") == duplicates.soundex("rupert") == "r163"
+    assert duplicates.soundex("ashcraft") == "a261"
+    assert duplicates.jaro_winkler("martha", "marhta") == pytest.approx(0.961, abs=1e-3)
+    assert duplicates.jaro_winkler("", "") == 0.0
+    assert duplicates.jaro_winkler("same", "same") == 1.0
+
+
+def test_dob_similarity():
+    assert duplicates.dob_similarity("1990-04-12", "1990-04-12") == 1.0
+    assert duplicates.dob_similarity("1990-04-12", "1990-04-13") == 0.6  # one digit
+    assert duplicates.dob_similarity("1990-04-12", "1990-12-04") == 0.6  # day and month swapped
+    assert duplicates.dob_similarity("1990-04-12", "1985-01-01") == 0.0
+
+
+def test_household_members_score_below_likely():
+    a = Patient(patient("A", "Oliver", "Smith", phone="07700 900123", email="home@x.com", postcode="AB1 2CD"))
+    twin = Patient(patient("B", "Harriet", "Smith", phone="07700 900123", email="home@x.com", postcode="AB12CD"))
+    typo = Patient(patient("C", "Olivre", "Smith", phone="+44 7700 900123", email="home@x.com", postcode="AB1 2CD"))
+    assert score_pair(a, twin)[0] < duplicates.LIKELY_SCORE
+    assert score_pair(a, typo)[0] >= duplicates.LIKELY_SCORE
+
+
+def test_find_candidates_blocks_scores_and_picks_survivor():
+    docs = [
+        patient("SMITH-JON-1990-04-12", "Jon", "Smith", phone="07700 900123", visit_count=1),
+        patient("SMYTH-JON-1990-04-12", "Jon", "Smyth", phone="07700 900123", visit_count=5),
+        patient("JONES-ANN-1970-01-01", "Ann", "Jones", dob="1970-01-01"),
+    ]
+    result = find_candidates(docs)
+    assert result["patients"] == 3
+    [pair] = result["candidates"]
+    assert pair["pair"] == "SMITH-JON-1990-04-12|SMYTH-JON-1990-04-12"
+    assert {"phone", "name_dob"} <= set(pair["matched_on"])
+    # The longer history survives
+    assert pair["survivor"]["patient_id"] == "SMYTH-JON-1990-04-12"
+    assert find_candidates(docs, dismissed=[pair["pair"]])["candidates"] == []
+
+
+def test_oversized_blocks_are_skipped():
+    shared = [patient(f"P{i}", f"First{i}", f"Last{i}", dob=f"19{50 + i % 40}-01-01", phone="07700 900123")
+              for i in range(duplicates.MAX_BLOCK + 1)]
+    result = find_candidates(shared)
+    assert result["blocks_skipped"]["phone"] == 1
+    # A clinic-wide shared number never pairs patients by itself
+    assert all("phone" not in pair["matched_on"] for pair in result["candidates"])
+
+
+def merges(*pairs):
+    return [PatientMerge(survivor_id=survivor, duplicate_id=duplicate) for duplicate, survivor in pairs]
+
+
+def test_resolve_merges_follows_chains():
+    # C into B, B into A: everything ends up in A
+    assert resolve_merges(merges(("C", "B"), ("B", "A"), ("E", "D"))) == {"C": "A", "B": "A", "E": "D"}
+
+
+@pytest.mark.parametrize("pairs, detail", [
+    ((("A", "A"),), "A cannot be merged into itself"),
+    ((("B", "A"), ("B", "C")), "B is merged into two different patients"),
+    ((("A", "B"), ("B", "C"), ("C", "A")), "Merges of A form a cycle"),
+])
+def test_resolve_merges_rejects(pairs, detail):
+    with pytest.raises(HTTPException) as rejected:
+        resolve_merges(merges(*pairs))
+    assert (rejected.value.status_code, rejected.value.detail) == (400, detail)
+
+
+def test_repeated_merge_is_accepted():
+    assert resolve_merges(merges(("B", "A"), ("B", "A"))) == {"B": "A"}
+
+
+def test_merged_fields():
+    assert combine_values("NKDA", "Penicillin; latex", "LATEX") == "Penicillin; latex"
+    assert combine_values("NKDA", "nkda", None) == "NKDA"
+    survivor = {"patient_id": "A", "phone": "", "email": "a@x.com", "allergies": "NKDA", "registered_at": "2024-05-01"}
+    dups = [{"patient_id": "B", "phone": "07700 900123", "email": "b@x.com", "allergies": "Penicillin", "registered_at": "2023-01-01"}]
+    assert merged_fields(survivor, dups) == {"phone": "07700 900123", "allergies": "Penicillin", "registered_at": "2023-01-01"}
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    db = AsyncMongoMockClient()["clinic_test"]
+    monkeypatch.setattr(server, "db", db)
+
+    async def publish(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(server.bus, "publish", publish)
+
+    # mongomock lacks $substrCP; on the ASCII dates summaries read it is $substr
+    import mongomock.aggregate
+    handle = mongomock.aggregate._Parser._handle_string_operator
+    monkeypatch.setattr(mongomock.aggregate._Parser, "_handle_string_operator",
+                        lambda parser, op, values: handle(parser, "$substr" if op == "$substrCP" else op, values))
+    return db
+
+
+def test_merge_moves_cohort_cells_from_records_read_in_the_transaction(mock_db, monkeypatch):
+    # D is not merged but shares B's cohort, so cells wrongly left behind would show
+    visits = {"A": ["2026-01-05", "2026-03-02"], "B": ["2026-02-10"], "C": ["2025-12-01", "2026-01-20"], "D": ["2026-02-15"]}
+
+    async def scenario():
+        for pid, dates in visits.items():
+            await mock_db.patients.insert_one(patient(pid, "Jo", "Smith"))
+            await mock_db.visits.insert_many([{"visit_id": f"{pid}{i}", "patient_id": pid, "date": d} for i, d in enumerate(dates)])
+        await server.refresh_visit_summaries()
+        await server.rebuild_cohorts()
+
+        real_run_atomic = server.run_atomic
+
+        async def visit_lands_first(callback):
+            # A visit for the duplicate commits after the up-front checks but before the chunk
+            await mock_db.visits.insert_one({"visit_id": "late", "patient_id": "B", "date": "2026-04-01"})
+            await server.refresh_visit_summaries(["B"])
+            await server.rebuild_cohorts()
+            return await real_run_atomic(callback)
+
+        monkeypatch.setattr(server, "run_atomic", visit_lands_first)
+        await server.merge_patients({"B": "A", "C": "A"}, "tester")
+
+        async def cohorts():
+            # Retracted cells stay behind as zeros, which read the same as absent ones
+            rows = await mock_db.cohorts.find({}, {"_id": 0}).sort("cohort", 1).to_list(None)
+            return [{**row, "active": {k: n for k, n in row["active"].items() if n}} for row in rows]
+
+        merged = await cohorts()
+        await server.rebuild_cohorts()
+        assert merged == await cohorts()
+        assert merged == [{"cohort": "2025-12", "patients": 1, "visits": 6, "active": {"0": 1, "1": 1, "2": 1, "3": 1, "4": 1}},
+                          {"cohort": "2026-02", "patients": 1, "visits": 1, "active": {"0": 1}}]
+
+    asyncio.run(scenario())
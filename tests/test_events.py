@@ -0,0 +1,50 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+
+import events
+
+
+def event(at: datetime, clock_offset: timedelta = timedelta(0), kind: str = "change") -> dict:
+    """An event as a worker whose clock is off by clock_offset would insert it"""
+    return {"_id": ObjectId.from_datetime(at + clock_offset), "kind": kind, "payload": {}, "origin": "w", "at": at}
+
+
+def bus_with_log():
+    bus = events.EventBus(AsyncMongoMockClient()["clinic_test"])
+    received = []
+    bus.subscribe(lambda e: received.append(e["kind"]))
+    return bus, received
+
+
+def test_resumed_tail_delivers_events_with_smaller_ids_once():
+    async def scenario():
+        bus, received = bus_with_log()
+        now = datetime.now(timezone.utc)
+        await bus.collection.insert_one(event(now, kind="from host a"))
+        await bus._tail()
+        # Host b's clock runs behind, so its later event carries a smaller ObjectId
+        await bus.collection.insert_one(event(now + timedelta(milliseconds=5), -timedelta(seconds=2), kind="from host b"))
+        await bus._tail()
+        await bus._tail()
+        assert received == ["from host a", "from host b"]
+
+    asyncio.run(scenario())
+
+
+def test_history_is_not_replayed_and_old_ids_are_forgotten():
+    async def scenario():
+        bus, received = bus_with_log()
+        start = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(minutes=1)
+        await bus.collection.insert_one(event(start, kind="history"))
+        last = await bus.collection.find_one({}, sort=[("$natural", -1)])
+        bus.seen = {last["_id"]: events._aware(last["at"])}
+        await bus.collection.insert_one(event(start + timedelta(seconds=30), kind="new"))
+        await bus._tail()
+        assert received == ["new"]
+        assert bus._resume_point() == start + timedelta(seconds=30) - events.EVENT_OVERLAP
+        assert len(bus.seen) == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,47 @@
+"""Index registry checks against a real mongod (the query planner cannot be faked).
+
+Set TEST_MONGO_URL to point at a disposable server; the test works in a
+throwaway database and is skipped when no server answers.
+"""
+import asyncio
+import os
+import uuid
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+
+import indexes
+
+TEST_MONGO_URL = os.environ.get("TEST_MONGO_URL", "mongodb://localhost:27017")
+
+
+async def check_indexes():
+    client = AsyncIOMotorClient(TEST_MONGO_URL, serverSelectionTimeoutMS=1000)
+    try:
+        await client.admin.command("ping")
+    except PyMongoError as e:
+        client.close()
+        pytest.skip(f"no mongod at {TEST_MONGO_URL} ({type(e).__name__})")
+
+    db = client[f"clinic_index_check_{uuid.uuid4().hex[:8]}"]
+    try:
+        changes = await indexes.reconcile(db)
+        assert changes["failed"] == []
+        # Explain on a collection that does not exist plans EOF, which would hide a scan
+        for collection in {shape[1] for shape in indexes.QUERY_SHAPES}:
+            if not await db[collection].find_one():
+                await db[collection].insert_one({})
+
+        again = await indexes.reconcile(db)
+        scans = await indexes.find_collscans(db)
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+    assert again == {"created": [], "rebuilt": [], "dropped": [], "failed": []}
+    assert scans == []
+
+
+def test_query_shapes_use_indexes():
+    asyncio.run(check_indexes())
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from jobs import CronSchedule
+
+
+def at(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("expression, after, expected", [
+    # Strictly after: a time exactly on a slot moves to the next slot
+    ("0 2 * * *", at(2025, 3, 10, 2, 0), at(2025, 3, 11, 2, 0)),
+    ("0 2 * * *", at(2025, 3, 10, 1, 59, 59), at(2025, 3, 10, 2, 0)),
+    ("*/15 * * * *", at(2025, 3, 10, 9, 46), at(2025, 3, 10, 10, 0)),
+    ("0,30 9-10 * * *", at(2025, 3, 10, 10, 30), at(2025, 3, 11, 9, 0)),
+    # Month and year roll-over
+    ("0 0 1 * *", at(2025, 12, 15, 12, 0), at(2026, 1, 1, 0, 0)),
+    ("@monthly", at(2025, 1, 31, 23, 59), at(2025, 2, 1, 0, 0)),
+    # Day of week, 0 and 7 both Sunday; 2025-03-10 is a Monday
+    ("0 4 * * 0", at(2025, 3, 10, 0, 0), at(2025, 3, 16, 4, 0)),
+    ("0 4 * * 7", at(2025, 3, 10, 0, 0), at(2025, 3, 16, 4, 0)),
+    ("@weekly", at(2025, 3, 16, 0, 0), at(2025, 3, 23, 0, 0)),
+    ("0 8 * * 1-5", at(2025, 3, 14, 9, 0), at(2025, 3, 17, 8, 0)),
+    # Day of month and day of week both restricted: either matches
+    ("0 0 13 * 5", at(2025, 3, 1, 0, 0), at(2025, 3, 7, 0, 0)),
+    # Only in leap years
+    ("0 0 29 2 *", at(2025, 3, 1, 0, 0), at(2028, 2, 29, 0, 0)),
+])
+def test_next_after(expression, after, expected):
+    assert CronSchedule(expression).next_after(after) == expected
+
+
+def test_next_after_converts_to_utc():
+    local = datetime(2025, 3, 10, 3, 30, tzinfo=timezone(timedelta(hours=2)))
+    assert CronSchedule("0 2 * * *").next_after(local) == at(2025, 3, 10, 2, 0)
+
+
+@pytest.mark.parametrize("expression", ["0 2 * *", "60 * * * *", "0 24 * * *", "0 0 0 * *", "*/0 * * * *", "5-1 * * * *"])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_never_fires():
+    with pytest.raises(ValueError):
+        CronSchedule("0 0 31 2 *").next_after(at(2025, 1, 1))
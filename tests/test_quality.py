@@ -0,0 +1,133 @@
+import asyncio
+from collections import Counter
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+from server import patient_quality, quality_counter_ops
+
+COMPLETE = {"email": "Jo@X.com", "phone": "07700 900123", "postcode": "AB1", "street": "1 High St", "city": "Leeds",
+            "emergency_name": "Sam", "emergency_phone": "07700 900999"}
+
+
+def apply(ops, counters=None):
+    """Fold counter UpdateOnes into {key: Counter} the way Mongo would"""
+    counters = counters if counters is not None else {}
+    for op in ops:
+        key = op._filter["key"]
+        if key not in counters and not op._upsert:
+            continue
+        counter = counters.setdefault(key, Counter())
+        for field, n in op._doc["$inc"].items():
+            counter[field] += n
+    return counters
+
+
+def test_patient_quality():
+    assert patient_quality(COMPLETE) == {"score": 100, "missing": [], "email_key": "jo@x.com", "phone_key": "7700900123"}
+    partial = patient_quality({**COMPLETE, "email": " ", "emergency_phone": ""})
+    assert partial["missing"] == ["email", "emergency_contact"]
+    assert partial["score"] == round(4 / 7 * 100)
+    assert (partial["email_key"], partial["phone_key"]) == (None, "7700900123")
+
+
+def test_counter_deltas_add_change_and_remove():
+    full = patient_quality(COMPLETE)
+    no_email = patient_quality({**COMPLETE, "email": ""})
+    moved_phone = patient_quality({**COMPLETE, "phone": "+44 7700 900555"})
+
+    counters = apply(quality_counter_ops(None, full))
+    assert counters["totals"] == Counter(patients=1, score_total=100)
+    assert counters["email:jo@x.com"]["count"] == counters["phone:7700900123"]["count"] == 1
+
+    apply(quality_counter_ops(full, no_email), counters)
+    assert counters["totals"]["patients"] == 1
+    assert counters["totals"]["score_total"] == no_email["score"]
+    assert counters["totals"]["missing.email"] == 1
+    assert counters["email:jo@x.com"]["count"] == 0
+
+    apply(quality_counter_ops(no_email, moved_phone), counters)
+    assert counters["totals"]["missing.email"] == 0
+    assert (counters["phone:7700900123"]["count"], counters["phone:7700900555"]["count"]) == (0, 1)
+
+    apply(quality_counter_ops(moved_phone, None), counters)
+    assert all(n == 0 for counter in counters.values() for n in counter.values())
+
+
+def test_unchanged_quality_writes_nothing():
+    quality = patient_quality(COMPLETE)
+    assert quality_counter_ops(quality, dict(quality)) == []
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    db = AsyncMongoMockClient()["clinic_test"]
+    monkeypatch.setattr(server, "db", db)
+    return db
+
+
+def legacy_patients():
+    """Patients as written before quality was stored, with a spread of missing fields"""
+    patients = []
+    for i in range(40):
+        doc = {"patient_id": f"P{i}", "first_name": "A", "last_name": "B", "dob": "1990-01-01", **COMPLETE,
+               "email": f"p{i % 30}@x.com", "phone": f"07700 900{i % 25:03d}"}
+        if i % 3 == 0:
+            doc["email"] = ""
+        if i % 4 == 0:
+            del doc["postcode"]
+        if i % 5 == 0:
+            doc["emergency_phone"] = None
+        patients.append(doc)
+    return patients
+
+
+def test_backfill_scores_legacy_patients_from_their_full_documents(mock_db):
+    async def scenario():
+        patients = legacy_patients()
+        await mock_db.patients.insert_many([dict(p) for p in patients])
+        await server.backfill_quality()
+
+        stored = {p["patient_id"]: p["quality"] async for p in mock_db.patients.find({}, {"_id": 0, "patient_id": 1, "quality": 1})}
+        expected = {p["patient_id"]: patient_quality(p) for p in patients}
+        assert stored == expected
+
+        counters = apply(op for p in patients for op in quality_counter_ops(None, expected[p["patient_id"]]))
+        totals = await mock_db.quality_counters.find_one({"key": "totals"}, {"_id": 0})
+        assert totals["patients"] == counters["totals"]["patients"] == 40
+        assert totals["score_total"] == counters["totals"]["score_total"]
+        assert totals["missing"] == {field: counters["totals"][f"missing.{field}"] for field, _ in server.QUALITY_CHECKS}
+        assert totals["missing"]["email"] == 14
+        for key, counter in counters.items():
+            if key != "totals" and counter["count"]:
+                assert (await mock_db.quality_counters.find_one({"key": key}))["count"] == counter["count"]
+
+    asyncio.run(scenario())
+
+
+def test_rebuild_replaces_counters_in_place(mock_db):
+    async def scenario():
+        await mock_db.patients.insert_many([dict(p) for p in legacy_patients()])
+        await server.rebuild_quality()
+        await mock_db.quality_counters.insert_one({"key": "email:gone@x.com", "kind": "email", "value": "gone@x.com", "count": 0})
+        before = await mock_db.quality_counters.count_documents({})
+
+        real_replace = server.replace_keyed
+
+        async def racing(collection, key, docs, previous):
+            # A kiosk registration lands between the scan and the write
+            await mock_db.quality_counters.bulk_write(quality_counter_ops(None, patient_quality({**COMPLETE, "email": "new@x.com", "phone": "07700 900001"})))
+            await real_replace(collection, key, docs, previous)
+
+        server.replace_keyed = racing
+        try:
+            await server.rebuild_quality(recompute=True)
+        finally:
+            server.replace_keyed = real_replace
+        assert await mock_db.quality_counters.find_one({"key": "email:gone@x.com"}) is None
+        assert await mock_db.quality_counters.find_one({"key": "email:new@x.com"})
+        assert await mock_db.quality_counters.count_documents({}) == before
+        assert (await mock_db.quality_counters.find_one({"key": "totals"}))["patients"] == 40
+
+    asyncio.run(scenario())
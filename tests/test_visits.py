@@ -0,0 +1,59 @@
+import asyncio
+import gc
+import warnings
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+from server import VisitCreate
+
+USER = {"username": "ADMIN", "role": "ADMIN"}
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    db = AsyncMongoMockClient()["clinic_test"]
+    monkeypatch.setattr(server, "db", db)
+
+    async def publish(*args, **kwargs):
+        pass
+
+    # The event bus writes to the real database it was built with
+    monkeypatch.setattr(server.bus, "publish", publish)
+    return db
+
+
+def test_failed_write_in_a_transaction_leaves_nothing_unawaited(mock_db, monkeypatch):
+    class Session:
+        """Stands in for a transaction session; mongomock ignores it"""
+
+    async def in_transaction(callback):
+        return await callback(Session())
+
+    collection_type = type(mock_db.visits)
+
+    def sessionless(method):
+        # mongomock rejects any session, so the stand-in is dropped on the way through
+        async def call(collection, *args, session=None, **kwargs):
+            if method == "insert_one" and collection.name == "visits":
+                raise RuntimeError("transaction aborted")
+            return await original[method](collection, *args, **kwargs)
+        return call
+
+    original = {method: getattr(collection_type, method)
+                for method in ("find_one", "find_one_and_update", "insert_one", "update_one", "bulk_write")}
+
+    async def scenario():
+        await mock_db.patients.insert_one({"patient_id": "P1", "first_name": "A", "last_name": "B"})
+        monkeypatch.setattr(server, "run_atomic", in_transaction)
+        for method in original:
+            monkeypatch.setattr(collection_type, method, sessionless(method))
+        with pytest.raises(RuntimeError, match="transaction aborted"):
+            await server.create_visit(VisitCreate(patient_id="P1", treatment="B12", consultant="Dr A", notes=""), USER)
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        asyncio.run(scenario())
+        gc.collect()
+    assert not [w for w in caught if "never awaited" in str(w.message)]